@@ -0,0 +1,108 @@
+import os
+import time
+from math import cos, sin, pi
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from lib import Vector, Scene
+from framebuffer import Framebuffer
+
+# Renders a sequence of frames of one scene, with the camera and optionally the lights moving along paths. The scene is compiled once and every worker process receives it once,
+# a frame only moves the camera and the lights and traces the rays, so neither a new Scene nor a new Window is built per frame
+
+
+# Evenly spaced points from start to end, both included
+def linear_path(start: Vector, end: Vector, frames: int):
+
+    return [start + (end - start) * (frame / max(frames - 1, 1)) for frame in range(frames)]
+
+
+# Points on a horizontal circle around center, for lights that circle the scene. The first point is in front of the center, towards the camera
+def circle_path(center: Vector, radius: float, frames: int):
+
+    return [Vector(center.x + radius * sin(2 * pi * frame / frames), center.y, center.z - radius * cos(2 * pi * frame / frames)) for frame in range(frames)]
+
+
+def frame_path(output_dir: str, name: str, index: int):
+
+    return os.path.join(output_dir, f"{name}_{index:04d}.png")
+
+
+# Moves the camera and, if positions are given, the lights of the scene
+def place(scene: Scene, camera: Vector, light_positions: list = None):
+
+    scene.camera = camera
+
+    if light_positions is not None:
+
+        for light, position in zip(scene.lights, light_positions):
+
+            light.position = position
+
+
+# Places the camera and the lights and renders the scene into a new framebuffer, which is saved to path
+def render_frame(scene: Scene, camera: Vector, light_positions: list, path: str):
+
+    place(scene, camera, light_positions)
+
+    frame = Framebuffer(scene.window.size_x, scene.window.size_y, scene.window.color.as_tuple(True))
+    scene.ray_trace_sphere(scene.shapes, frame)
+
+    frame.save(path)
+
+    return path
+
+
+# Renders one frame per camera position into output_dir as name_0000.png, name_0001.png and so on. light_paths holds one list of positions per frame with a position for each light of the scene.
+# The frames are spread over the worker processes, each of them traces its frames on its own. Returns the paths of the frames, the seconds it took and the frames per minute
+def render_animation(scene: Scene, cameras: list, light_paths: list = None, output_dir: str = "static/frames", name: str = "frame", workers: int = None):
+
+    workers = workers or os.cpu_count() or 1
+    light_paths = light_paths or [None] * len(cameras)
+
+    if len(light_paths) != len(cameras):
+
+        raise ValueError(f"There are {len(cameras)} camera positions but {len(light_paths)} sets of light positions")
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    scene.compile_if_changed()
+    start = time.perf_counter()
+    paths = [frame_path(output_dir, name, index) for index in range(len(cameras))]
+
+    if workers == 1:
+
+        camera, light_positions = scene.camera, [light.position for light in scene.lights]
+
+        for path, frame_camera, frame_lights in zip(paths, cameras, light_paths):
+
+            render_frame(scene, frame_camera, frame_lights, path)
+
+        place(scene, camera, light_positions)       # The scene is left as it was given
+
+    else:
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_animation_worker, initargs=(scene,)) as pool:
+
+            futures = [pool.submit(_render_frame, *frame) for frame in zip(cameras, light_paths, paths)]
+
+            for future in as_completed(futures):
+
+                future.result()
+
+    seconds = time.perf_counter() - start
+
+    return {"frames": paths, "seconds": seconds, "frames_per_minute": len(paths) / seconds * 60}
+
+
+# Every worker process gets the compiled scene once, its frames are traced one after another in that process
+_animation_scene = None
+
+def _init_animation_worker(scene: Scene):
+
+    global _animation_scene
+    _animation_scene = scene
+    _animation_scene.workers = 1        # The frames are the unit of parallel work, a frame is not split into bands again
+
+
+def _render_frame(camera: Vector, light_positions: list, path: str):
+
+    return render_frame(_animation_scene, camera, light_positions, path)
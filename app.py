@@ -1,22 +1,53 @@
-from flask import Flask, redirect, jsonify, request, render_template, url_for
+from flask import Flask, redirect, jsonify, request, render_template, url_for, send_file, Response
 from lib import Vector, Window, Sphere, Scene, Light, Material, Wall
-from threading import Thread
+from jobs import JobManager, JobQueueFull, DONE, FAILED
+from cache import RenderCache, scene_key
+from incremental import RecordStore
+from framebuffer import ENCODINGS, from_image
+from scene_format import SceneFormatError, build_scene
+from PIL import Image
+import os
+import json
 
 app = Flask(__name__)
 
-actual_scene = None                 # For a customer-ready approach a task queue is needed, but for only this demo we use a global variable
+app.config["RENDER_WORKERS"] = int(os.environ.get("HIZTRACER_WORKERS", 2))            # How many scenes are rendered at the same time, each in its own process
+app.config["RENDER_QUEUE_SIZE"] = int(os.environ.get("HIZTRACER_QUEUE_SIZE", 16))     # How many more scenes may wait for a free worker before new ones are refused
+app.config["CACHE_DIR"] = os.environ.get("HIZTRACER_CACHE_DIR", "cache")                       # Finished renders are kept here under the hash of their scene
+app.config["CACHE_MAX_ENTRIES"] = int(os.environ.get("HIZTRACER_CACHE_MAX_ENTRIES", 500))
+app.config["CACHE_MAX_BYTES"] = int(os.environ.get("HIZTRACER_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+app.config["PROCESSES_PER_RENDER"] = int(os.environ.get("HIZTRACER_PROCESSES_PER_RENDER", max(1, (os.cpu_count() or 1) // app.config["RENDER_WORKERS"])))
+app.config["RECORD_MAX_ENTRIES"] = int(os.environ.get("HIZTRACER_RECORD_MAX_ENTRIES", 8))            # Records of earlier renders kept for incremental re-renders, 0 turns them off
+app.config["SAVE_IMAGES"] = os.environ.get("HIZTRACER_SAVE_IMAGES", "0") == "1"          # Also write every finished render to static/renders, they are served from memory either way
+app.config["API_MAX_PIXELS"] = int(os.environ.get("HIZTRACER_API_MAX_PIXELS", 1920 * 1080))   # Largest image /api/render accepts
+app.config["API_MAX_DEPTH"] = int(os.environ.get("HIZTRACER_API_MAX_DEPTH", 8))              # Deepest reflections /api/render accepts, the same as the form renders with
+app.config["API_MAX_SHAPES"] = int(os.environ.get("HIZTRACER_API_MAX_SHAPES", 1000))
+app.config["API_MAX_VERTICES"] = int(os.environ.get("HIZTRACER_API_MAX_VERTICES", 100_000))  # Vertices and triangles of all meshes of a scene together
+app.config["RENDER_STATS"] = os.environ.get("HIZTRACER_RENDER_STATS", "0") == "1"        # Collect counters and timings of every render for /stats, off by default because it slows renders down by about a third
+
+jobs = None                         # Created on the first request, so that importing the app does not start any processes
+STREAM_KEEP_ALIVE = 15              # Seconds a stream waits for news of its job before it sends a comment to keep the connection open
+
+
+def get_jobs():
+
+    global jobs
+
+    if jobs is None:
+
+        cache = RenderCache(app.config["CACHE_DIR"], app.config["CACHE_MAX_ENTRIES"], app.config["CACHE_MAX_BYTES"])
+        records = RecordStore(os.path.join(app.config["CACHE_DIR"], "records"), app.config["RECORD_MAX_ENTRIES"]) if app.config["RECORD_MAX_ENTRIES"] > 0 else None
+        jobs = JobManager(app.config["RENDER_WORKERS"], app.config["RENDER_QUEUE_SIZE"], cache=cache, records=records, save_images=app.config["SAVE_IMAGES"])
+
+    return jobs
 
 # Does the server sided input validation and renders the right type of template depending on if there is an error or the rendering has started
 @app.route("/", methods = ["GET", "POST"])
 def index():
 
     render_start = False
-    global actual_scene
-
-    if request.method == "GET":
-
-        actual_scene = None         # So that hen the demanded raytracing is done the program does not use the old scene 
-
+    job_id = None
+    image_size = None
 
     if request.method == "POST":
 
@@ -179,33 +210,186 @@ def index():
         
         try: # In case there is a missed edge case after all we make it sure so that the program does not crash
 
-            actual_scene = Scene(Window(window_width, window_height, "image", sky_color), scene_objects, camera_position, scene_lights, 8)
-            Thread(target=start_render).start() # We need a thread for sending the progress amount simultaneously to the JavaScript
+            job_id = get_jobs().new_job_id()
+            render_mode = "progressive" if request.form.get("preview") else "python"     # A fast preview first, refined pass by pass
+            max_samples = 16 if request.form.get("antialias") else 1                    # Extra samples only where the edges need them
+            scene = Scene(Window(window_width, window_height, get_jobs().image_name(job_id), sky_color), scene_objects, camera_position, scene_lights, 8, render_mode=render_mode, workers=app.config["PROCESSES_PER_RENDER"], max_samples=max_samples, shadows=True, instrument=app.config["RENDER_STATS"])
+            job_id = get_jobs().submit(job_id, scene, scene_key(scene)) # The scene is rendered in a worker process unless it is cached or already being rendered, the page asks for its progress with the job ID
             
             render_start = True
+            image_size = (window_width, window_height)
+
+        except JobQueueFull:
+
+            return render_template("index.html", error="The server is busy with other renders, please try again in a moment.")
 
         except:
 
             return render_template("index.html", error="An unexpected error occured while rendering the scene, please check your parameters.")
 
-    return render_template("index.html", render_start=render_start)
+    return render_template("index.html", render_start=render_start, job_id=job_id, image_size=image_size)
     
-# Sends the progress percentage to JavaScript
-@app.route("/progress")
-def progress():
+# Queues a scene given as JSON in the format of scene_format.py and answers with the job and the URLs to follow it, the same jobs as the ones of the form
+@app.route("/api/render", methods = ["POST"])
+def api_render():
 
-    global actual_scene
-    if not actual_scene is None:
+    data = request.get_json(silent=True)
 
-        return jsonify(progress=actual_scene.progress)
-    
-    return jsonify(progress=0)
+    if data is None:
+
+        return jsonify(errors=["The request body must be a JSON scene"]), 400
+
+    job_id = get_jobs().new_job_id()
+
+    try:
+
+        scene = build_scene(data, get_jobs().image_name(job_id), app.config["API_MAX_PIXELS"], allow_files=False, max_depth=app.config["API_MAX_DEPTH"], max_shapes=app.config["API_MAX_SHAPES"], max_vertices=app.config["API_MAX_VERTICES"], workers=app.config["PROCESSES_PER_RENDER"], instrument=app.config["RENDER_STATS"])
+        job_id = get_jobs().submit(job_id, scene, scene_key(scene))
+
+    except SceneFormatError as error:
+
+        return jsonify(errors=error.errors), 400
+
+    except JobQueueFull as error:
+
+        return jsonify(errors=[str(error)]), 503
+
+    job = get_jobs().get(job_id)
+
+    return jsonify(dict(job.as_dict(), progress=url_for("progress", job_id=job_id), stream=url_for("stream", job_id=job_id), result=url_for("result", job_id=job_id), stats=url_for("job_stats", job_id=job_id))), 202
+
+# Sends the state and progress percentage of a job to JavaScript
+@app.route("/progress/<job_id>")
+def progress(job_id):
+
+    job = get_jobs().get(job_id)
+
+    if job is None:
+
+        return jsonify(error="Unknown job"), 404
+
+    return jsonify(job.as_dict())
+
+# Pushes every finished band of a job's image to the browser as a server-sent event as soon as the worker reports it, followed by a done or failed event
+@app.route("/stream/<job_id>")
+def stream(job_id):
+
+    job = get_jobs().get(job_id)
+
+    if job is None:
+
+        return jsonify(error="Unknown job"), 404
+
+    def events():
+
+        sent = 0
+        last_progress = None
+
+        while True:
+
+            bands, state, current_progress = get_jobs().updates(job, sent, last_progress, STREAM_KEEP_ALIVE)
+
+            for start, data in bands:
+
+                yield f"event: band\ndata: {json.dumps({'y': start, 'png': data})}\n\n"
+
+            sent += len(bands)
+
+            if state in (DONE, FAILED):
+
+                yield f"event: {state}\ndata: {json.dumps(job.as_dict())}\n\n"
+
+                return
+
+            if current_progress != last_progress:
+
+                last_progress = current_progress
+
+                yield f"event: progress\ndata: {json.dumps({'state': state, 'progress': current_progress})}\n\n"
+
+            elif not bands:
+
+                yield ": keep-alive\n\n"        # Nothing happened for a while, a comment line lets a closed connection end the stream
+
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Sends the rendered image of a finished job, encoded as ?format=png (the default), webp or ppm. ?level sets the PNG compression from 0 to 9, ?quality the WebP quality from 0 to 100
+@app.route("/result/<job_id>")
+def result(job_id):
+
+    image_format = request.args.get("format", "png")
+
+    if image_format not in ENCODINGS:
+
+        return jsonify(error=f"Unknown format, choose one of {', '.join(ENCODINGS)}"), 400
+
+    try:
+
+        compress_level = int(request.args.get("level", 6))
+        quality = int(request.args.get("quality", 80))
+
+    except ValueError:
+
+        return jsonify(error="The level and the quality have to be integers"), 400
+
+    if not (0 <= compress_level <= 9 and 0 <= quality <= 100):
+
+        return jsonify(error="The level has to be between 0 and 9 and the quality between 0 and 100"), 400
+
+    job = get_jobs().get(job_id)
+
+    if job is None:
+
+        return jsonify(error="Unknown job"), 404
+
+    if job.state == FAILED:
+
+        return jsonify(job.as_dict()), 500
+
+    if job.state != DONE:
+
+        return jsonify(job.as_dict()), 409      # Not finished yet
+
+    if job.framebuffer is not None:
+
+        return Response(job.framebuffer.encode(image_format, compress_level, quality), mimetype=ENCODINGS[image_format])
+
+    if job.path is None or not os.path.exists(job.path):
+
+        return jsonify(error="The image is no longer available"), 410     # Evicted from the cache in the meantime
+
+    if image_format == "png" and "level" not in request.args:
+
+        return send_file(job.path, mimetype="image/png")
+
+    with Image.open(job.path) as image:         # Cached images only exist as PNG files
+
+        framebuffer = from_image(image)
+
+    return Response(framebuffer.encode(image_format, compress_level, quality), mimetype=ENCODINGS[image_format])
+
+
+# Sends the state of the job queue, the render cache and the counters and timings summed over the instrumented renders
+@app.route("/stats")
+def stats():
+
+    return jsonify(get_jobs().stats())
+
+# Sends the counters and timings of a single render
+@app.route("/stats/<job_id>")
+def job_stats(job_id):
+
+    job = get_jobs().get(job_id)
+
+    if job is None:
+
+        return jsonify(error="Unknown job"), 404
 
+    if job.render_stats is None:
 
-def start_render():
+        return jsonify(error="There are no stats of this render"), 404      # Not finished, failed, served from the cache or not instrumented
 
-    global actual_scene
-    actual_scene.blit_image()
+    return jsonify(job.render_stats)
 
 
 # As the user enters the vectors as strings, this function test if those tuples are in the right format to be vectors
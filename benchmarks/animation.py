@@ -0,0 +1,64 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+from lib import Vector, Window, Scene
+from animation import render_animation, linear_path
+from benchmarks.scenes import SCENES
+
+# Compares building a new Window and Scene for every frame of a camera path with render_animation, in frames per minute
+# Run from the repository root with: python -m benchmarks.animation [frames] [workers]
+
+SCENE = "many-spheres"
+SIZE = (108, 80)
+
+
+def cameras(frames: int):
+
+    return linear_path(Vector(-0.3, -0.1, -1.2), Vector(0.3, 0.1, -0.8), frames)
+
+
+def build_scene(name: str):
+
+    window = Window(*SIZE, name, Vector(0, 0, 0))
+
+    return Scene(window, **SCENES[SCENE](window))
+
+
+# The way frames were rendered before, each one a scene of its own saved to ./static by blit_image
+def render_frame_by_frame(frames: int):
+
+    start = time.perf_counter()
+
+    for index, camera in enumerate(cameras(frames)):
+
+        scene = build_scene(f"benchmark-animation-{index}")
+        scene.camera = camera
+        scene.blit_image()
+
+    seconds = time.perf_counter() - start
+
+    for index in range(frames):
+
+        os.remove(f"static/benchmark-animation-{index}.png")
+
+    return frames / seconds * 60
+
+
+def main(frames: int = 8, workers: int = None):
+
+    workers = workers or os.cpu_count() or 1
+    output_dir = tempfile.mkdtemp()
+    scene = build_scene("benchmark-animation")
+
+    print(f"{'frame by frame':<32} {render_frame_by_frame(frames):>8.1f} frames/minute")
+    print(f"{'render_animation, 1 process':<32} {render_animation(scene, cameras(frames), output_dir=output_dir, workers=1)['frames_per_minute']:>8.1f} frames/minute")
+    print(f"{f'render_animation, {workers} processes':<32} {render_animation(scene, cameras(frames), output_dir=output_dir, workers=workers)['frames_per_minute']:>8.1f} frames/minute")
+
+    shutil.rmtree(output_dir)
+
+
+if __name__ == "__main__":
+
+    main(*(int(argument) for argument in sys.argv[1:]))
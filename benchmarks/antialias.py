@@ -0,0 +1,99 @@
+import random
+import sys
+import time
+from math import sqrt
+from PIL import Image
+from lib import Vector, Sphere, Wall, Material, Light, Window, Scene
+
+# Compares the adaptive anti-aliasing of Scene with uniform 16x supersampling, in rays cast per pixel and in how far the edges are from the uniformly supersampled image
+# Run from the repository root with: python -m benchmarks.antialias [width]
+
+REFERENCE_SAMPLES = 16
+
+
+def build_scene(width: int, max_samples: int):
+
+    window = Window(width, width * 3 // 4, "benchmark-antialias", Vector(30, 30, 60))
+    shapes = [
+        Sphere(Vector(-0.4, 0, 1.5), 0.5, Vector(0, 0, 255), Material(0.4, 32)),
+        Sphere(Vector(0.6, 0.2, 2), 0.4, Vector(255, 60, 0), Material(0.2, 16)),
+        Wall(Vector(-3, 0.6, 0), Vector(-3, 0.6, 5), Vector(3, 0.6, 0), Vector(3, 0.6, 5), Vector(150, 150, 150), Material(0.3, 8)),
+    ]
+    lights = [Light(Vector(-1, -1, 0), Vector(255, 255, 255))]
+
+    return Scene(window, shapes, Vector(0, 0, -1), lights, 3, max_samples=max_samples)
+
+
+# Renders into an image in memory so that nothing ends up in ./static
+def render(scene: Scene):
+
+    image = Image.new("RGB", (scene.window.size_x, scene.window.size_y))
+
+    start = time.perf_counter()
+    scene.ray_trace_sphere(scene.shapes, image.load())
+
+    return image, time.perf_counter() - start
+
+
+# Every pixel gets REFERENCE_SAMPLES jittered samples, one in each cell of a grid over the pixel
+def render_uniform(scene: Scene):
+
+    image = Image.new("RGB", (scene.window.size_x, scene.window.size_y))
+    pixels = image.load()
+    generator = random.Random(0)
+    grid = int(sqrt(REFERENCE_SAMPLES))
+
+    start = time.perf_counter()
+
+    for i in range(scene.window.size_y):
+
+        for j in range(scene.window.size_x):
+
+            total = Vector(0, 0, 0)
+
+            for stratum in range(REFERENCE_SAMPLES):
+
+                offset_j = (stratum % grid + generator.random()) / grid - 0.5
+                offset_i = (stratum // grid + generator.random()) / grid - 0.5
+
+                color = scene.sample_pixel(scene.shapes, j + offset_j, i + offset_i)
+                total += Vector(*(min(max(component, 0), 255) for component in color.as_tuple(False)))
+
+            pixels[j, i] = (total / REFERENCE_SAMPLES).as_tuple(True)
+
+    return image, time.perf_counter() - start
+
+
+# Mean absolute channel difference to the reference over the pixels where the reference differs from the single sample render, which are the edges
+def edge_error(image, reference, single):
+
+    data, reference_data, single_data = image.tobytes(), reference.tobytes(), single.tobytes()
+    errors = []
+
+    for k in range(0, len(data), 3):
+
+        if reference_data[k:k + 3] != single_data[k:k + 3]:
+
+            errors.append(sum(abs(a - b) for a, b in zip(data[k:k + 3], reference_data[k:k + 3])) / 3)
+
+    return sum(errors) / len(errors) if errors else 0
+
+
+def main(width: int = 96):
+
+    single, single_seconds = render(build_scene(width, 1))
+
+    adaptive_scene = build_scene(width, REFERENCE_SAMPLES)
+    adaptive, adaptive_seconds = render(adaptive_scene)
+
+    reference, reference_seconds = render_uniform(build_scene(width, 1))
+
+    print(f"{'render':<14} {'rays/pixel':>10} {'seconds':>8} {'edge error':>11}")
+    print(f"{'1 sample':<14} {1:>10.2f} {single_seconds:>8.2f} {edge_error(single, reference, single):>11.2f}")
+    print(f"{'adaptive':<14} {adaptive_scene.rays_per_pixel:>10.2f} {adaptive_seconds:>8.2f} {edge_error(adaptive, reference, single):>11.2f}")
+    print(f"{'uniform 16x':<14} {REFERENCE_SAMPLES:>10.2f} {reference_seconds:>8.2f} {0:>11.2f}")
+
+
+if __name__ == "__main__":
+
+    main(*(int(argument) for argument in sys.argv[1:]))
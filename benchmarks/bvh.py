@@ -0,0 +1,75 @@
+import random
+import sys
+import time
+from lib import Vector, Window, Ray, Sphere, Wall, Material, Scene
+
+# Measures how the cost of Scene.closest_object grows with the amount of objects, once with the bounding volume hierarchy and once by testing every shape
+# Run from the repository root with: python -m benchmarks.bvh [amount of rays]
+
+OBJECT_COUNTS = (10, 25, 50, 100, 200, 400)
+
+
+# Spheres and small walls scattered in front of the camera, half of each
+def random_shapes(amount: int, generator: random.Random):
+
+    material = Material(0.5, 32)
+    shapes = []
+
+    for i in range(amount):
+
+        x, y, z = generator.uniform(-3, 3), generator.uniform(-2, 2), generator.uniform(1, 8)
+        color = Vector(generator.randint(0, 255), generator.randint(0, 255), generator.randint(0, 255))
+
+        if i % 2 == 0:
+
+            shapes.append(Sphere(Vector(x, y, z), generator.uniform(0.05, 0.3), color, material))
+
+        else:
+
+            size = generator.uniform(0.1, 0.4)
+            shapes.append(Wall(Vector(x - size, y - size, z), Vector(x - size, y + size, z), Vector(x + size, y - size, z), Vector(x + size, y + size, z), color, material))
+
+    return shapes
+
+
+def random_rays(amount: int, generator: random.Random):
+
+    camera = Vector(0, 0, -1)
+
+    return [Ray(camera, Vector(generator.uniform(-1, 1), generator.uniform(-0.75, 0.75), 0) - camera) for _ in range(amount)]
+
+
+# Seconds it takes to find the closest object for every ray. The rays are not primary rays of the window, so the screen-space tile bins are turned off
+def time_closest_object(shapes: list, rays: list, use_bvh: bool):
+
+    scene = Scene(Window(2, 2, "bvh", Vector(0, 0, 0)), shapes, Vector(0, 0, -1), [], 1, use_bvh=use_bvh, tile_size=0)
+
+    start = time.perf_counter()
+
+    for ray in rays:
+
+        scene.closest_object(ray, shapes)
+
+    return time.perf_counter() - start
+
+
+def main(amount_of_rays: int = 2000):
+
+    generator = random.Random(1)
+    rays = random_rays(amount_of_rays, generator)
+
+    print(f"{'objects':>8} {'linear µs/ray':>14} {'bvh µs/ray':>11} {'speedup':>8}")
+
+    for amount in OBJECT_COUNTS:
+
+        shapes = random_shapes(amount, generator)
+
+        linear = time_closest_object(shapes, rays, False) / amount_of_rays * 1e6
+        bvh = time_closest_object(shapes, rays, True) / amount_of_rays * 1e6
+
+        print(f"{amount:>8} {linear:>14.1f} {bvh:>11.1f} {linear / bvh:>7.1f}x")
+
+
+if __name__ == "__main__":
+
+    main(*(int(argument) for argument in sys.argv[1:]))
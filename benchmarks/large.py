@@ -0,0 +1,57 @@
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from lib import Vector, Window, Scene
+from benchmarks.scenes import SCENES
+
+# Renders one large image with the framebuffer in memory and once memory mapped, each in a fresh process, and reports the time and the peak memory of rendering and saving the PNG
+# Run from the repository root with: python -m benchmarks.large [width] [height] [workers]
+
+SCENE = "three-spheres"
+
+
+def render_large(width: int, height: int, workers: int, mapped: bool):
+
+    directory = tempfile.mkdtemp()
+    window = Window(width, height, "benchmark-large", Vector(0, 0, 0), os.path.join(directory, "framebuffer.rgb") if mapped else None)
+    scene = Scene(window, workers=workers, **SCENES[SCENE](window))
+
+    start = time.perf_counter()
+    scene.ray_trace_sphere(scene.shapes, window.framebuffer)
+    window.framebuffer.save(os.path.join(directory, "large.png"))
+    seconds = time.perf_counter() - start
+
+    size = os.path.getsize(os.path.join(directory, "large.png"))
+
+    if mapped:
+
+        window.framebuffer.close()
+
+    for name in os.listdir(directory):
+
+        os.remove(os.path.join(directory, name))
+
+    os.rmdir(directory)
+
+    return seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, size      # Linux reports kilobytes
+
+
+def main(width: int = 1200, height: int = 900, workers: int = 1):
+
+    print(f"{SCENE}, {width}x{height}, {workers} process(es), {3 * width * height / 1024 ** 2:.1f} MB of pixels")
+
+    for mapped in (False, True):
+
+        with ProcessPoolExecutor(max_workers=1) as pool:
+
+            seconds, peak_memory, size = pool.submit(render_large, width, height, workers, mapped).result()
+
+        print(f"{'memory mapped' if mapped else 'in memory':<14} {seconds:>8.2f}s   peak memory {peak_memory:>7.1f} MB   PNG {size / 1024:>8.1f} KB")
+
+
+if __name__ == "__main__":
+
+    main(*(int(argument) for argument in sys.argv[1:]))
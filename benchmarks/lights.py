@@ -0,0 +1,59 @@
+import sys
+import time
+from lib import Vector, Light, Window, Scene
+from benchmarks.scenes import reflections
+
+# Measures how the render time grows with the amount of lights, once shading every light at every hit, once with the light hierarchy leaving out only the highlights that are provably 0,
+# and once with the default light_threshold of Scene. Prints the lights shaded per hit and the largest channel difference to the image that shades every light
+# Run from the repository root with: python -m benchmarks.lights [width] [largest amount of lights]
+
+LIGHT_COUNTS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+# The reflections scene lit by a grid of lights under the ceiling, dimmer the more there are so that the image stays about as bright
+def build_scene(width: int, amount: int, **options):
+
+    window = Window(width, width * 20 // 27, "benchmark-lights", Vector(0, 0, 0))
+    scene = reflections(window)
+    columns = max(1, round(amount ** 0.5))
+    brightness = min(255, 510 / amount)
+
+    scene["lights"] = [Light(Vector(-1.8 + 3.6 * (k % columns + 0.5) / columns, -0.8, 3.2 * (k // columns + 0.5) / -(-amount // columns)), Vector(brightness, brightness, brightness)) for k in range(amount)]
+
+    return Scene(window, **scene, **options)
+
+
+def render(scene: Scene):
+
+    start = time.perf_counter()
+    scene.ray_trace_sphere(scene.shapes, scene.window.framebuffer)
+
+    return scene.window.framebuffer.tobytes(), time.perf_counter() - start
+
+
+def main(width: int = 108, most_lights: int = 256):
+
+    print(f"{'lights':>6} {'every light s':>13} {'exact tree s':>12} {'lights/hit':>10} {'culled s':>9} {'lights/hit':>10} {'max diff':>8}")
+
+    for amount in (count for count in LIGHT_COUNTS if count <= most_lights):
+
+        reference, every_seconds = render(build_scene(width, amount, light_threshold=0, use_light_tree=False))
+
+        exact_scene = build_scene(width, amount, light_threshold=0, use_light_tree=True)
+        exact, exact_seconds = render(exact_scene)
+
+        culled_scene = build_scene(width, amount)
+        culled, culled_seconds = render(culled_scene)
+
+        assert exact == reference, f"Leaving out the lights that add nothing changed the image with {amount} lights"
+
+        exact_per_hit = exact_scene.light_set.shaded / exact_scene.light_set.queries
+        culled_per_hit = culled_scene.light_set.shaded / culled_scene.light_set.queries
+        difference = max(abs(a - b) for a, b in zip(culled, reference))
+
+        print(f"{amount:>6} {every_seconds:>13.2f} {exact_seconds:>12.2f} {exact_per_hit:>10.1f} {culled_seconds:>9.2f} {culled_per_hit:>10.1f} {difference:>8}")
+
+
+if __name__ == "__main__":
+
+    main(*(int(argument) for argument in sys.argv[1:]))
@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+import time
+from math import cos, pi, sin
+from lib import Vector, Material, Window, Scene
+from mesh import load_obj
+from benchmarks.scenes import reflections
+
+# Measures meshes of growing size in the reflections scene: the seconds to stream the OBJ file into the buffers, to build the hierarchy over the triangles, and to render in the python and the numpy
+# render mode, together with the largest channel difference between the two images. The meshes are tessellated tori written to a temporary OBJ file
+# Run from the repository root with: python -m benchmarks.mesh [width] [largest amount of triangles]
+
+TRIANGLE_COUNTS = (1_000, 10_000, 100_000)
+
+
+# Writes a torus around the y axis with about the given amount of triangles as OBJ, ring by ring so that the file is never held in memory
+def write_torus(path: str, triangles: int, major: float = 0.45, minor: float = 0.18):
+
+    rings = max(3, round((triangles / 2) ** 0.5))
+    sides = max(3, round(triangles / 2 / rings))
+
+    with open(path, "w") as file:
+
+        for ring in range(rings):
+
+            for side in range(sides):
+
+                theta = 2 * pi * ring / rings
+                phi = 2 * pi * side / sides
+                distance = major + minor * cos(phi)
+
+                file.write(f"v {distance * cos(theta):.6f} {minor * sin(phi):.6f} {distance * sin(theta):.6f}\n")
+
+        for ring in range(rings):
+
+            for side in range(sides):
+
+                corners = [(ring + ring_step) % rings * sides + (side + side_step) % sides + 1 for ring_step, side_step in ((0, 0), (1, 0), (1, 1), (0, 1))]
+
+                file.write(f"f {' '.join(map(str, corners))}\n")
+
+    return 2 * rings * sides
+
+
+def render(width: int, mesh, render_mode: str):
+
+    window = Window(width, width * 20 // 27, f"benchmark-mesh-{render_mode}", Vector(0, 0, 0))
+    scene = reflections(window)
+    scene = Scene(window, scene["shapes"] + [mesh], scene["camera"], scene["lights"], scene["max_depth"], render_mode=render_mode)
+
+    start = time.perf_counter()
+    scene.ray_trace_sphere(scene.shapes, window.framebuffer)
+
+    return window.framebuffer.tobytes(), time.perf_counter() - start
+
+
+def main(width: int = 270, most_triangles: int = 100_000):
+
+    print(f"{'triangles':>9} {'load s':>7} {'build s':>7} {'python s':>8} {'numpy s':>7} {'max diff':>8}")
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        for amount in (count for count in TRIANGLE_COUNTS if count <= most_triangles):
+
+            path = os.path.join(directory, f"torus-{amount}.obj")
+            triangles = write_torus(path, amount)
+
+            start = time.perf_counter()
+            mesh = load_obj(path, Vector(220, 160, 40), Material(0.3, 32), offset=(0.6, 0.1, 1.8))
+            load_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            mesh.compile(0)
+            build_seconds = time.perf_counter() - start
+
+            python_image, python_seconds = render(width, mesh, "python")
+            numpy_image, numpy_seconds = render(width, mesh, "numpy")
+            difference = max(abs(a - b) for a, b in zip(python_image, numpy_image))
+
+            print(f"{triangles:>9} {load_seconds:>7.2f} {build_seconds:>7.2f} {python_seconds:>8.2f} {numpy_seconds:>7.2f} {difference:>8}")
+
+
+if __name__ == "__main__":
+
+    main(*(int(argument) for argument in sys.argv[1:]))
@@ -0,0 +1,67 @@
+import sys
+import time
+from PIL import Image
+from lib import Vector, Material, Window, Scene
+from benchmarks.scenes import SCENES
+
+# Times edits of the lights and materials of a scene, once rendered from scratch in the numpy render mode and once shaded from the G-buffer of the deferred render mode
+# Run from the repository root with: python -m benchmarks.relight [scene] [width]
+
+
+def build_scene(name: str, width: int):
+
+    window = Window(width, width * 20 // 27, "benchmark-relight", Vector(0, 0, 0))
+
+    return Scene(window, **SCENES[name](window))
+
+
+def render(scene: Scene, render_mode: str):
+
+    image = Image.new("RGB", (scene.window.size_x, scene.window.size_y))
+    scene.render_mode = render_mode
+
+    start = time.perf_counter()
+    scene.ray_trace_sphere(scene.shapes, image.load())
+
+    return image.tobytes(), time.perf_counter() - start
+
+
+def recolor_light(scene: Scene):
+
+    scene.lights[0].color = Vector(255, 180, 120)
+
+
+def move_light(scene: Scene):
+
+    scene.lights[-1].position = scene.lights[-1].position + Vector(0.3, 0, 0)
+
+
+def change_material(scene: Scene):
+
+    scene.shapes[0].material = Material(0.9, 64)
+
+
+EDITS = {"light color": recolor_light, "light position": move_light, "material": change_material}
+
+
+def main(name: str = "shadows", width: int = 540):
+
+    scene = build_scene(name, width)
+    image, numpy_seconds = render(scene, "numpy")
+    _, capture_seconds = render(scene, "deferred")
+
+    print(f"{name}, {scene.window.size_x}x{scene.window.size_y}: numpy render {numpy_seconds:.3f}s, first deferred render with the G-buffer {capture_seconds:.3f}s")
+
+    for edit, apply in EDITS.items():
+
+        apply(scene)
+
+        image, numpy_seconds = render(scene, "numpy")
+        deferred_image, deferred_seconds = render(scene, "deferred")
+
+        print(f"{edit:<16} numpy {numpy_seconds:>7.3f}s   deferred {deferred_seconds:>7.3f}s   {numpy_seconds / deferred_seconds:>5.1f}x   {'same image' if image == deferred_image else 'DIFFERENT IMAGE'}")
+
+
+if __name__ == "__main__":
+
+    main(*(argument if index == 0 else int(argument) for index, argument in enumerate(sys.argv[1:])))
@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from lib import Vector, Window, Scene
+from benchmarks.scenes import SCENES
+
+# Renders the canonical scenes of benchmarks/scenes.py and reports wall time, rays per second and peak memory of each. The results are compared with a stored baseline,
+# a scene that got slower than the baseline by more than the threshold counts as a regression, and every image is compared with its golden PNG
+# Run from the repository root with: python -m benchmarks.render [--threshold 0.25] [--repeat 3] [--output results.json] [--update-baseline] [--update-golden] [scene ...]
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(DIRECTORY, "baseline.json")
+GOLDEN_DIRECTORY = os.path.join(DIRECTORY, "golden")
+SIZE = (162, 120)                   # Same aspect ratio as the 540x400 images of test.py
+THRESHOLD = 0.25                    # A scene may take this much longer than in the baseline before it counts as a regression
+REPEAT = 3                          # Renders of each scene when timing it
+GOLDEN_TOLERANCE = 2                # Largest difference of a color channel that still counts as the same pixel
+GOLDEN_MISMATCH = 0.001             # Share of pixels that may differ by more than the tolerance, for hits right on an edge that rounding can flip
+
+
+def build_scene(name: str, size: tuple = SIZE):
+
+    window = Window(*size, f"benchmark-{name}", Vector(0, 0, 0))
+
+    return Scene(window, **SCENES[name](window))
+
+
+# Renders the scene inside of a fresh process, so that the peak memory of the process belongs to this scene alone. The fastest of the repeated renders counts, the slower ones were disturbed by something else on the machine.
+# Every ray cast is counted, primary and reflected rays through closest_object and the shadow rays by the scene itself
+def run_scene(name: str, size: tuple = SIZE, repeat: int = 1):
+
+    scene = build_scene(name, size)
+    framebuffer = scene.window.framebuffer      # The buffer renders write into, like Scene.blit_image
+
+    closest_object = scene.closest_object
+    rays = 0
+
+    def counted_closest_object(ray, shapes):
+
+        nonlocal rays
+        rays += 1
+
+        return closest_object(ray, shapes)
+
+    scene.closest_object = counted_closest_object
+    seconds = float("inf")
+
+    for _ in range(repeat):
+
+        rays = 0
+
+        start = time.perf_counter()
+        scene.ray_trace_sphere(scene.shapes, framebuffer)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    rays += scene.shadow_rays
+
+    return {
+        "seconds": seconds,
+        "rays": rays,
+        "rays_per_second": rays / seconds,
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,     # Linux reports kilobytes
+        "image": framebuffer.tobytes(),
+    }
+
+
+def run(names: list, size: tuple = SIZE, repeat: int = 1):
+
+    results = {}
+
+    for name in names:
+
+        with ProcessPoolExecutor(max_workers=1) as pool:
+
+            results[name] = pool.submit(run_scene, name, size, repeat).result()
+
+    return results
+
+
+def golden_path(name: str):
+
+    return os.path.join(GOLDEN_DIRECTORY, f"{name}.png")
+
+
+# Share of the pixels that differ from the golden image by more than GOLDEN_TOLERANCE in any channel, 1 if there is no golden image of the same size
+def golden_mismatch(name: str, image: bytes, size: tuple = SIZE):
+
+    if not os.path.exists(golden_path(name)):
+
+        return 1
+
+    golden = Image.open(golden_path(name)).convert("RGB")
+
+    if golden.size != size:
+
+        return 1
+
+    golden = golden.tobytes()
+    mismatches = sum(max(abs(image[k] - golden[k]), abs(image[k + 1] - golden[k + 1]), abs(image[k + 2] - golden[k + 2])) > GOLDEN_TOLERANCE for k in range(0, len(image), 3))
+
+    return mismatches / (size[0] * size[1])
+
+
+def save_golden(name: str, image: bytes, size: tuple = SIZE):
+
+    os.makedirs(GOLDEN_DIRECTORY, exist_ok=True)
+
+    Image.frombytes("RGB", size, image).save(golden_path(name))
+
+
+def load_baseline(path: str = BASELINE_PATH):
+
+    if not os.path.exists(path):
+
+        return {}
+
+    with open(path) as file:
+
+        return json.load(file)["scenes"]
+
+
+# Names of the scenes that took longer than the baseline allows, scenes missing from the baseline are never regressions
+def regressions(results: dict, baseline: dict, threshold: float = THRESHOLD):
+
+    return [name for name, result in results.items() if name in baseline and result["seconds"] > baseline[name]["seconds"] * (1 + threshold)]
+
+
+def as_json(results: dict, size: tuple = SIZE):
+
+    return {"size": list(size), "scenes": {name: {key: value for key, value in result.items() if key != "image"} for name, result in results.items()}}
+
+
+def main(arguments: list = None):
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.render")
+    parser.add_argument("scenes", nargs="*", help=f"scenes to render, all of them by default: {', '.join(SCENES)}")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="renders of each scene, the fastest one counts")
+    parser.add_argument("--output", default=None, help="where to write the results as JSON")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--update-golden", action="store_true")
+    arguments = parser.parse_args(arguments)
+
+    unknown = [name for name in arguments.scenes if name not in SCENES]
+
+    if unknown:
+
+        parser.error(f"unknown scenes: {', '.join(unknown)}")
+
+    results = run(arguments.scenes or list(SCENES), repeat=arguments.repeat)
+    baseline = load_baseline()
+
+    print(f"{'scene':<18} {'seconds':>8} {'baseline':>9} {'rays/s':>9} {'peak MB':>8} {'golden':>7}")
+
+    failed_golden = []
+
+    for name, result in results.items():
+
+        if arguments.update_golden:
+
+            save_golden(name, result["image"])
+
+        mismatch = golden_mismatch(name, result["image"])
+        result["golden_mismatch"] = mismatch
+
+        if mismatch > GOLDEN_MISMATCH:
+
+            failed_golden.append(name)
+
+        baseline_seconds = f"{baseline[name]['seconds']:.2f}" if name in baseline else "-"
+
+        print(f"{name:<18} {result['seconds']:>8.2f} {baseline_seconds:>9} {result['rays_per_second']:>9.0f} {result['peak_memory_mb']:>8.1f} {'ok' if mismatch <= GOLDEN_MISMATCH else 'differs':>7}")
+
+    slower = regressions(results, baseline, arguments.threshold)
+    report = as_json(results)
+    report["regressions"] = slower
+    report["golden_failures"] = failed_golden
+
+    if arguments.output is not None:
+
+        with open(arguments.output, "w") as file:
+
+            json.dump(report, file, indent=4)
+
+    if arguments.update_baseline:
+
+        with open(BASELINE_PATH, "w") as file:
+
+            json.dump(as_json(results), file, indent=4)
+
+        return 0
+
+    for name in slower:
+
+        print(f"{name} is more than {arguments.threshold:.0%} slower than the baseline")
+
+    for name in failed_golden:
+
+        print(f"{name} does not match its golden image")
+
+    return 1 if slower or failed_golden else 0
+
+
+if __name__ == "__main__":
+
+    sys.exit(main())
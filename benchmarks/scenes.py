@@ -0,0 +1,99 @@
+from lib import Vector, Sphere, Wall, Material, Light
+
+# The canonical scenes of the render benchmark and its golden images. The first three are the scenes test.py renders, the others scale them up in shapes, lights, depth and shadows
+# Each builder gets the window, so that lights can be placed relative to it, and returns the keyword arguments of Scene besides the window
+
+
+def three_spheres(window):
+
+    material = Material(0.5, 32)
+    red_sphere = Sphere(Vector(0, -0.4, 0), 0.1, Vector(255, 0, 0), material)
+    yellow_sphere = Sphere(Vector(0, 0, 0), 0.1, Vector(0, 255, 255), material)
+    green_sphere = Sphere(Vector(0, 0.4, 0), 0.1, Vector(0, 255, 0), material)
+
+    return {"shapes": [red_sphere, yellow_sphere, green_sphere], "camera": Vector(0, 0, -1), "lights": [Light(Vector(1, window.upside, 0), Vector(255, 255, 255))], "max_depth": 3}
+
+
+# The walls of the reflections scene, a matte back wall and floor between a semi reflective and a mirroring side wall
+def room():
+
+    back_wall = Wall(Vector(-3,  2, 4), Vector(-3,  -2, 4), Vector(3, 2, 4), Vector(3, -2, 4), Vector(0, 0, 200), Material(0, 8))
+    left_wall = Wall(Vector(-3,  2, 4), Vector(-3,  -2, 4), Vector(-3, 2, 0), Vector(-3, -2, 0), Vector(255, 80, 80), Material(0.3, 32))
+    right_wall = Wall(Vector(3,  2, 0), Vector(3,  -2, 0), Vector(3, 2, 4), Vector(3, -2, 4), Vector(200, 200, 200), Material(0.7, 64))
+    floor_wall = Wall(Vector(-3,  0.5, 0), Vector(-3,  0.5, 4), Vector(3, 0.5, 0), Vector(3, 0.5, 4), Vector(120, 120, 120), Material(0, 8))
+
+    return [back_wall, left_wall, right_wall, floor_wall]
+
+
+def reflections(window):
+
+    material = Material(0.5, 32)
+    blue_sphere = Sphere(Vector(0.75, -0.1, 1), 0.6, Vector(0, 0, 255), material)
+    pink_sphere = Sphere(Vector(-0.75, -0.1, 2), 0.6, Vector(125, 80, 125), material)
+    lights = [Light(Vector(1, window.upside, 0), Vector(255, 255, 255)), Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))]
+
+    return {"shapes": [blue_sphere, pink_sphere] + room(), "camera": Vector(0, 0, -1), "lights": lights, "max_depth": 8}
+
+
+def one_ball_one_wall(window):
+
+    floor_wall = Wall(Vector(-3,  0.5, 0), Vector(-3,  0.5, 4), Vector(3, 0.5, 0), Vector(3, 0.5, 4), Vector(120, 120, 120), Material(0, 8))
+    blue_sphere = Sphere(Vector(0.75, -0.1, 1), 0.6, Vector(0, 0, 255), Material(0.5, 32))
+
+    return {"shapes": [blue_sphere, floor_wall], "camera": Vector(0, 0, -1), "lights": [Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))], "max_depth": 8}
+
+
+# A grid of 48 small spheres in the room, enough for the bounding volume hierarchy to be used
+def many_spheres(window):
+
+    shapes = []
+
+    for row in range(4):
+
+        for column in range(12):
+
+            color = Vector(40 + 18 * column, 60 * row, 255 - 18 * column)
+            shapes.append(Sphere(Vector(-2.2 + 0.4 * column, -0.6 + 0.35 * row, 1.5 + 0.5 * row), 0.15, color, Material(0.4, 32)))
+
+    lights = [Light(Vector(1, window.upside, 0), Vector(255, 255, 255)), Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))]
+
+    return {"shapes": shapes + room(), "camera": Vector(0, 0, -1), "lights": lights, "max_depth": 8}
+
+
+# The reflections scene lit by eight lights in a row
+def many_lights(window):
+
+    scene = reflections(window)
+    scene["lights"] = [Light(Vector(-1.75 + 0.5 * k, -0.8, 0), Vector(80, 80, 80)) for k in range(8)]
+
+    return scene
+
+
+# Two large mirrors facing each other with a sphere in between, so that most rays bounce until the maximum depth of 12
+def deep_reflections(window):
+
+    front_mirror = Wall(Vector(-20,  20, 4), Vector(-20,  -20, 4), Vector(20, 20, 4), Vector(20, -20, 4), Vector(20, 20, 40), Material(0.95, 64))
+    back_mirror = Wall(Vector(-20,  20, -2), Vector(-20,  -20, -2), Vector(20, 20, -2), Vector(20, -20, -2), Vector(20, 20, 40), Material(0.95, 64))
+    sphere = Sphere(Vector(0, 0, 2), 0.5, Vector(255, 200, 0), Material(0.5, 32))
+
+    return {"shapes": [sphere, front_mirror, back_mirror], "camera": Vector(0, 0, -1), "lights": [Light(Vector(0.5, -0.5, 0), Vector(255, 255, 255))], "max_depth": 12, "min_throughput": 0}
+
+
+# The reflections scene with shadow rays towards both lights
+def shadows(window):
+
+    scene = reflections(window)
+    scene["shadows"] = True
+
+    return scene
+
+
+SCENES = {
+    "three-spheres": three_spheres,
+    "reflections": reflections,
+    "one-ball-one-wall": one_ball_one_wall,
+    "many-spheres": many_spheres,
+    "many-lights": many_lights,
+    "deep-reflections": deep_reflections,
+    "shadows": shadows,
+}
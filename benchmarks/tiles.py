@@ -0,0 +1,43 @@
+import sys
+import time
+from lib import Vector, Window, Scene
+from benchmarks.scenes import SCENES
+
+# Reports how much the screen-space tile bins cull for every benchmark scene: the shapes per tile, the share of the primary rays' intersection tests that are skipped,
+# and the intersection tests and seconds of whole renders with and without the bins. Reflected and shadow rays are not binned, so they are part of both counts
+# Run from the repository root with: python -m benchmarks.tiles [width] [tile size]
+
+
+# Renders the scene with instrumentation and returns its stats, the tile bins and the seconds
+def render(name: str, width: int, tile_size: int):
+
+    window = Window(width, width * 20 // 27, f"benchmark-tiles-{name}", Vector(0, 0, 0))
+    scene = Scene(window, **SCENES[name](window), tile_size=tile_size, instrument=True)
+
+    start = time.perf_counter()
+    scene.ray_trace_sphere(scene.shapes, window.framebuffer)
+    seconds = time.perf_counter() - start
+
+    return scene.stats.as_dict(), scene.tiles.stats(window) if scene.tiles else None, seconds, window.framebuffer.tobytes()
+
+
+def main(width: int = 270, tile_size: int = 32):
+
+    print(f"{'scene':<18} {'shapes':>6} {'per tile':>8} {'culled':>7} {'tests off':>10} {'tests on':>10} {'seconds off':>11} {'seconds on':>10}")
+
+    for name in SCENES:
+
+        stats_off, _, seconds_off, image_off = render(name, width, 0)
+        stats_on, tiles, seconds_on, image_on = render(name, width, tile_size)
+
+        tests_off = sum(value for key, value in stats_off.items() if key.endswith("_tests"))     # Over every kind of shape the scene has
+        tests_on = sum(value for key, value in stats_on.items() if key.endswith("_tests"))
+
+        assert image_on == image_off, f"{name} looks different with tile bins"
+
+        print(f"{name:<18} {tiles['shapes']:>6} {tiles['mean_shapes_per_tile']:>8.1f} {tiles['culled_ratio']:>6.0%} {tests_off:>10} {tests_on:>10} {seconds_off:>11.2f} {seconds_on:>10.2f}")
+
+
+if __name__ == "__main__":
+
+    main(*(int(argument) for argument in sys.argv[1:]))
@@ -0,0 +1,118 @@
+import sys
+import timeit
+from math import sqrt
+from lib import Vector
+
+# Compares the old dictionary based Vector with the slotted one and its fused helpers on the operations the hot paths of Scene use
+# Run from the repository root with: python -m benchmarks.vector [iterations]
+
+
+# The Vector class as it was before it got slots and the fused helpers, kept here only to have something to compare against
+class LegacyVector:
+
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __add__(self, other):
+        return LegacyVector(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+
+        return LegacyVector(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __truediv__(self, other):
+
+        try:
+
+            return LegacyVector(self.x / other, self.y / other, self.z / other)
+
+        except:
+
+            raise ValueError(f"A vector may merely be divided by a scalar, so dividing with {other} does not work")
+
+    def __mul__(self, other):
+
+        try:
+
+            return LegacyVector(self.x * other, self.y * other, self.z * other)
+
+        except:
+
+            raise ValueError(f"A vector may merely be multiplied with a scalar")
+
+    def normalize(self):
+
+        magnitude = sqrt(self.x ** 2 + self.y ** 2 + self.z ** 2)
+
+        return self / magnitude
+
+    def dot_product(self, other):
+
+        return self.x * other.x + self.y * other.y + self.z * other.z
+
+
+# Each case is (name, legacy statement, new statement), the statements see the vectors o, c, d and the scalars r and t
+CASES = (
+    ("add", "o + c", "o + c"),
+    ("scale", "d * t", "d * t"),
+    ("normalize", "c.normalize()", "c.normalize()"),
+    ("normalize in place", "c.normalize()", "c.normalized_into(n)"),
+    ("point along ray", "o + d * t", "o.madd(d, t)"),
+)
+
+
+# Counts how many vectors a statement creates by watching the calls to __init__ of the given class
+def count_allocations(statement: str, namespace: dict, vector_class):
+
+    code = vector_class.__init__.__code__
+    calls = 0
+
+    def profile(frame, event, argument):
+
+        nonlocal calls
+
+        if event == "call" and frame.f_code is code:
+
+            calls += 1
+
+    sys.setprofile(profile)
+    exec(statement, namespace)
+    sys.setprofile(None)
+
+    return calls
+
+
+def size_of(vector):
+
+    return sys.getsizeof(vector) + (sys.getsizeof(vector.__dict__) if hasattr(vector, "__dict__") else 0)
+
+
+def namespace_for(vector_class):
+
+    return {"o": vector_class(0.0, 0.0, -1.0), "c": vector_class(0.75, -0.1, 1.0), "d": vector_class(0.1, 0.2, 0.97), "n": vector_class(0.0, 0.0, 0.0), "r": 0.6, "t": 1.5}
+
+
+def main(iterations: int = 200000):
+
+    print(f"bytes per vector: legacy {size_of(LegacyVector(1, 2, 3))}, slotted {size_of(Vector(1, 2, 3))}")
+    print(f"{'operation':<20} {'legacy ns/op':>13} {'allocs':>7} {'new ns/op':>10} {'allocs':>7}")
+
+    for name, legacy, new in CASES:
+
+        results = []
+
+        for statement, vector_class in ((legacy, LegacyVector), (new, Vector)):
+
+            namespace = namespace_for(vector_class)
+            seconds = min(timeit.repeat(statement, globals=namespace, number=iterations, repeat=3))
+
+            results.append((seconds / iterations * 1e9, count_allocations(statement, namespace, vector_class)))
+
+        print(f"{name:<20} {results[0][0]:>13.0f} {results[0][1]:>7} {results[1][0]:>10.0f} {results[1][1]:>7}")
+
+
+if __name__ == "__main__":
+
+    main(*(int(argument) for argument in sys.argv[1:]))
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import shutil
+from collections import OrderedDict
+from threading import Lock
+
+# Finished renders are kept on disk under the hash of their scene, so a scene that was rendered before is served right away instead of being traced again
+
+
+# Floats and integers that are equal get the same text, so that (1, 0, 0) and (1.0, 0.0, 0.0) end up with the same hash
+def canonical_number(value):
+
+    return repr(float(value))
+
+
+def canonical_vector(vector):
+
+    return [canonical_number(component) for component in vector.as_tuple(False)]
+
+
+# The numbers of a shape's signature as canonical text, nested tuples become lists. Text like the digest of a mesh is kept as it is
+def canonical_value(value):
+
+    if isinstance(value, (tuple, list)):
+
+        return [canonical_value(item) for item in value]
+
+    if isinstance(value, str):
+
+        return value
+
+    return canonical_number(value)
+
+
+# The kind of the shape and its signature, which already holds everything its intersection depends on, followed by its color and material
+def canonical_shape(shape):
+
+    material = [canonical_number(shape.material.reflectivity), canonical_number(shape.material.specular_constant)]
+
+    return [shape.kind] + canonical_value(shape.signature()) + [canonical_vector(shape.color), material]
+
+
+# Everything that decides how the rendered image looks, in a fixed order. The shapes keep their order since it breaks ties between equally distant hits
+def canonical_scene(scene):
+
+    return {
+        "size": [scene.window.size_x, scene.window.size_y],
+        "sky": canonical_vector(scene.window.color),
+        "camera": canonical_vector(scene.camera),
+        "shapes": [canonical_shape(shape) for shape in scene.shapes],
+        "lights": [[canonical_vector(light.position), canonical_vector(light.color)] for light in scene.lights],
+        "max_depth": scene.MAX_DEPTH,
+        "min_throughput": canonical_number(scene.min_throughput),
+        "render_mode": {"progressive": "python", "deferred": "numpy"}.get(scene.render_mode, scene.render_mode),    # The progressive render ends with the same image as the serial one, the deferred render with the one of numpy
+        "shadows": scene.shadows,
+        "light_threshold": canonical_number(scene.light_threshold) if scene.render_mode in ("python", "progressive") else None,      # The numpy render modes shade every light
+        "antialiasing": [scene.max_samples, canonical_number(scene.sample_threshold), scene.seed] if scene.max_samples > 1 else None,
+    }
+
+
+def scene_key(scene):
+
+    text = json.dumps(canonical_scene(scene), separators=(",", ":"), sort_keys=True)
+
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+# Image files named after their scene key, evicting the least recently used ones once there are too many or they take too much space
+class RenderCache:
+
+    def __init__(self, directory: str = "cache", max_entries: int = 500, max_bytes: int = 256 * 1024 * 1024):
+
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Files left from earlier runs, the least recently used first
+        files = [entry for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith(".png")]
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+
+        self.entries = OrderedDict((entry.name[:-4], entry.stat().st_size) for entry in files)
+
+        with self.lock:
+
+            self.evict()
+
+    def path(self, key: str):
+
+        return os.path.join(self.directory, f"{key}.png")
+
+    # Returns the path of the cached image or None, and counts the lookup as a hit or a miss
+    def get(self, key: str):
+
+        with self.lock:
+
+            if key not in self.entries or not os.path.exists(self.path(key)):
+
+                self.entries.pop(key, None)
+                self.misses += 1
+
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            os.utime(self.path(key))    # So that the order survives a restart
+
+            return self.path(key)
+
+    # Copies a finished image into the cache
+    def put(self, key: str, image_path: str):
+
+        with self.lock:
+
+            shutil.copyfile(image_path, self.path(key))
+
+            self.entries[key] = os.path.getsize(self.path(key))
+            self.entries.move_to_end(key)
+
+            self.evict()
+
+            return self.path(key)
+
+    # Writes an encoded image into the cache, for images that only exist in memory
+    def put_data(self, key: str, data: bytes):
+
+        with self.lock:
+
+            with open(self.path(key), "wb") as file:
+
+                file.write(data)
+
+            self.entries[key] = len(data)
+            self.entries.move_to_end(key)
+
+            self.evict()
+
+            return self.path(key)
+
+    def evict(self):
+
+        size = sum(self.entries.values())
+
+        while self.entries and (len(self.entries) > self.max_entries or size > self.max_bytes):
+
+            key, entry_size = self.entries.popitem(last=False)
+            size -= entry_size
+
+            if os.path.exists(self.path(key)):
+
+                os.remove(self.path(key))
+
+    def stats(self):
+
+        with self.lock:
+
+            lookups = self.hits + self.misses
+
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0, "entries": len(self.entries), "bytes": sum(self.entries.values())}
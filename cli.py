@@ -0,0 +1,96 @@
+import argparse
+import os
+import sys
+import time
+from scene_format import SceneFormatError, load_file, build_scene
+from framebuffer import ENCODINGS
+
+# Renders a scene file without the web app. Neither Flask nor Pillow are imported, Pillow is only loaded when the image is encoded as PNG or WebP, so a batch of renders starts quickly
+# Run from the repository root with: python -m cli scene.json -o image.png [--workers 4] [--render-mode numpy] [--framebuffer image.rgb] [--check]
+
+
+def parse_arguments(arguments: list = None):
+
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Renders a JSON or YAML scene file, see scene_format.py for the format")
+    parser.add_argument("scene", help="scene file, .json, .yaml or .yml")
+    parser.add_argument("-o", "--output", help=f"image to write, the extension picks the format out of {', '.join(ENCODINGS)}. Defaults to the scene's name with .png")
+    parser.add_argument("--workers", type=int, default=1, help="processes that trace bands of the image in the python render mode")
+    parser.add_argument("--render-mode", help="overrides the render mode of the scene file")
+    parser.add_argument("--framebuffer", help="keep the image in this memory-mapped file instead of in memory, for images larger than the memory")
+    parser.add_argument("--level", type=int, default=6, choices=range(10), metavar="0-9", help="PNG compression level")
+    parser.add_argument("--quality", type=int, default=80, help="WebP quality from 0 to 100")
+    parser.add_argument("--check", action="store_true", help="only validate the scene file")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not print the summary")
+
+    return parser, parser.parse_args(arguments)
+
+
+def main(arguments: list = None):
+
+    parser, arguments = parse_arguments(arguments)
+    output = arguments.output or os.path.splitext(arguments.scene)[0] + ".png"
+    image_format = output.rsplit(".", 1)[-1].lower()
+
+    if image_format not in ENCODINGS:
+
+        parser.error(f"unknown image format .{image_format}, choose one of {', '.join(ENCODINGS)}")
+
+    try:
+
+        data = load_file(arguments.scene)
+
+        if arguments.render_mode is not None and isinstance(data, dict):
+
+            data["render_mode"] = arguments.render_mode
+
+        scene = build_scene(data, os.path.splitext(os.path.basename(output))[0], framebuffer_path=arguments.framebuffer, directory=os.path.dirname(arguments.scene), workers=arguments.workers)
+
+    except OSError as error:
+
+        print(f"Can not read {arguments.scene}: {error}", file=sys.stderr)
+
+        return 1
+
+    except SceneFormatError as error:
+
+        for message in error.errors:
+
+            print(f"{arguments.scene}: {message}", file=sys.stderr)
+
+        return 2
+
+    if arguments.check:
+
+        return 0
+
+    framebuffer = scene.window.framebuffer
+    start = time.perf_counter()
+
+    scene.ray_trace_sphere(scene.shapes, framebuffer)
+
+    seconds = time.perf_counter() - start
+
+    if image_format == "webp":
+
+        with open(output, "wb") as file:
+
+            file.write(framebuffer.encode("webp", quality=arguments.quality))
+
+    else:
+
+        framebuffer.save(output, arguments.level)
+
+    if arguments.framebuffer is not None:
+
+        framebuffer.close()
+
+    if not arguments.quiet:
+
+        print(f"{output}: {scene.window.size_x}x{scene.window.size_y} in {seconds:.2f}s, {scene.rays_per_pixel:.2f} rays per pixel, {scene.shadow_rays} shadow rays")
+
+    return 0
+
+
+if __name__ == "__main__":
+
+    sys.exit(main())
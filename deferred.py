@@ -0,0 +1,163 @@
+import numpy as np
+from cache import canonical_shape, canonical_vector
+from vectorized import primary_rays, closest_objects, surface_normals, normalize, reflect, as_array, material_values, diffuse, specular_shade, light_visible
+
+# Deferred shading for the "deferred" render mode. The first render traces every ray of the frame like vectorized.py and keeps what the rays hit, bounce by bounce, in a G-buffer.
+# Renders after edits that leave the geometry alone, such as the colors and positions of the lights, the colors and materials of the shapes or the sky, only shade those buffers again.
+# Lights that moved cast their shadow rays again, nothing else is intersected. The paths are kept up to the maximum depth no matter the reflectivity, so that any material edit can be shaded
+
+
+# The rays of one bounce. Every array has a row per ray that hit a shape, missed holds the pixels whose ray left the scene at this bounce
+class GBufferLevel:
+
+    def __init__(self, missed, pixel_indices, directions, hit_positions, normals, shape_indices):
+
+        self.missed = missed
+        self.pixel_indices = pixel_indices
+        self.directions = directions
+        self.hit_positions = hit_positions
+        self.normals = normals              # Outward, as returned by vectorized.surface_normals
+        self.shape_indices = shape_indices
+
+
+class GBuffer:
+
+    def __init__(self, geometry: list, levels: list, escaped):
+
+        self.geometry = geometry            # What the buffers were traced with, see geometry_key
+        self.levels = levels
+        self.escaped = escaped              # Pixels whose path was still bouncing at the maximum depth, they get the sky color
+        self.visibility = {}                # Light position -> which hits of every level the light reaches, for scenes with shadows
+
+    def matches(self, scene):
+
+        return geometry_key(scene) == self.geometry
+
+    # The visibility of the light for every level, computed once per light position
+    def light_visibility(self, scene, light, is_closed):
+
+        position = light.position.as_tuple(False)
+
+        if position not in self.visibility:
+
+            self.visibility[position] = [light_visible(scene, light, level.shape_indices, level.hit_positions, level.normals, is_closed) for level in self.levels]
+
+        return self.visibility[position]
+
+    # Forgets the visibility of light positions the scene does not use anymore
+    def prune_visibility(self, scene):
+
+        positions = {light.position.as_tuple(False) for light in scene.lights}
+
+        for position in [position for position in self.visibility if position not in positions]:
+
+            del self.visibility[position]
+
+
+# Everything that decides where the rays go: the screen, the camera, the shapes without their colors and materials, and the maximum depth
+def geometry_key(scene):
+
+    return [[scene.window.size_x, scene.window.size_y], canonical_vector(scene.camera), [canonical_shape(shape)[:-2] for shape in scene.shapes], scene.MAX_DEPTH]
+
+
+# Traces every path of the frame up to the maximum depth and keeps the hits of every bounce
+def capture(scene):
+
+    origins, directions = primary_rays(scene.window, scene.camera)
+    pixel_indices = np.arange(len(origins))
+    levels = []
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+
+        for depth in range(scene.MAX_DEPTH):
+
+            if not len(pixel_indices):
+
+                break
+
+            scene.progress = 100 * depth // scene.MAX_DEPTH
+
+            distances, shape_indices, parts = closest_objects(scene.geometry, origins, directions)
+            hit = shape_indices != -1
+            missed = pixel_indices[~hit]
+
+            origins, directions, distances, shape_indices, parts, pixel_indices = origins[hit], directions[hit], distances[hit], shape_indices[hit], parts[hit], pixel_indices[hit]
+            hit_positions = origins + directions * distances[:, None]
+            normals = surface_normals(scene.shapes, shape_indices, hit_positions, parts, directions)
+
+            levels.append(GBufferLevel(missed, pixel_indices, directions, hit_positions, normals, shape_indices))
+
+            origins = hit_positions + normals / 1000
+            directions = normalize(reflect(normals, directions))
+
+    return GBuffer(geometry_key(scene), levels, pixel_indices)
+
+
+# Shades the buffers with the scene's current lights, colors and materials. The same operations in the same order as vectorized.render, so the image is exactly the one a full render gives
+def shade(scene, gbuffer: GBuffer):
+
+    size = scene.window.size_x * scene.window.size_y
+    colors = np.zeros((size, 3))
+    throughputs = np.ones(size)
+    active = np.ones(size, dtype=bool)      # Whether the path of the pixel is still followed, it stops once the throughput drops below min_throughput
+    sky = as_array(scene.window.color)
+    is_closed = np.array([shape.closed for shape in scene.shapes], dtype=bool)
+    reflectivities = material_values(scene.shapes, "reflectivity")
+
+    if scene.shadows:
+
+        gbuffer.prune_visibility(scene)
+        visibilities = [gbuffer.light_visibility(scene, light, is_closed) for light in scene.lights]
+
+    for depth, level in enumerate(gbuffer.levels):
+
+        missed = level.missed[active[level.missed]]
+        colors[missed] += sky * throughputs[missed][:, None]
+
+        selected = np.flatnonzero(active[level.pixel_indices])
+
+        if not len(selected):
+
+            break
+
+        pixel_indices, shape_indices, normals, directions, hit_positions = level.pixel_indices[selected], level.shape_indices[selected], level.normals[selected], level.directions[selected], level.hit_positions[selected]
+
+        color = diffuse(scene.shapes, shape_indices, normals, directions)
+        visible = np.stack([visibility[depth][selected] for visibility in visibilities], axis=1) if scene.shadows and scene.lights else np.ones((len(selected), len(scene.lights)), dtype=bool)
+
+        if scene.lights:
+
+            visible_counts = visible.sum(axis=1)
+            shadowed = visible_counts < len(scene.lights)
+
+            color[shadowed] *= (scene.SHADOW_AMBIENT + (1 - scene.SHADOW_AMBIENT) * visible_counts[shadowed] / len(scene.lights))[:, None]     # Same factor as Scene.ray_bounce
+
+        for light_index, light in enumerate(scene.lights):
+
+            color += np.where(visible[:, light_index, None], specular_shade(scene.shapes, shape_indices, normals, light, hit_positions, scene.camera), 0)
+
+        colors[pixel_indices] += color * throughputs[pixel_indices][:, None]
+
+        throughputs[pixel_indices] = throughputs[pixel_indices] * reflectivities[shape_indices]
+        active[pixel_indices] = throughputs[pixel_indices] >= scene.min_throughput
+
+    escaped = gbuffer.escaped[active[gbuffer.escaped]]
+    colors[escaped] += sky * throughputs[escaped][:, None]
+
+    return np.clip(np.rint(colors), 0, 255).astype(np.uint8).reshape(scene.window.size_y, scene.window.size_x, 3)
+
+
+# Renders the scene from its G-buffer, which is traced first if the scene has none yet or its geometry changed. Returns the image as rows of RGB values
+def render(scene):
+
+    if scene.gbuffer is None or not scene.gbuffer.matches(scene):
+
+        scene.gbuffer = capture(scene)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+
+        image = shade(scene, scene.gbuffer)
+
+    scene.progress = 100
+
+    return image
@@ -0,0 +1,378 @@
+import argparse
+import os
+import pickle
+import socket
+import struct
+import time
+from collections import deque
+from multiprocessing import Process
+from threading import Condition, Thread
+from lib import Vector, Window, Scene
+from framebuffer import Framebuffer
+
+# Render farm mode. A coordinator splits the image into tiles and hands them out over TCP to worker processes, which may run on other machines. The scene is pickled once and sent to every
+# worker when it connects, after that only tile rectangles go out and raw RGB rows come back. Tiles of a worker that disconnects or does not answer within the timeout are handed out again.
+# Workers unpickle what the coordinator sends, so they should only connect to a coordinator they trust. The coordinator never unpickles anything it receives
+# Run from the repository root with: python -m farm coordinator --scene many-spheres --size 1080 800 --local 3 and python -m farm worker --host <coordinator> --port <port>
+
+SCENE = b"S"                    # Coordinator -> worker: the pickled scene
+TILE = b"T"                     # Coordinator -> worker: tile id, x, y, width and height of the next tile
+DONE = b"D"                     # Coordinator -> worker: there are no tiles left
+HELLO = b"H"                    # Worker -> coordinator: the worker's name
+RESULT = b"R"                   # Worker -> coordinator: tile id, shadow rays and seconds, followed by the RGB rows of the tile
+
+TILE_FORMAT = ">IIIII"
+RESULT_FORMAT = ">IQd"
+
+
+class WorkerLost(Exception):
+    pass
+
+
+# A message is its length, its kind and its body
+def send_message(connection: socket.socket, kind: bytes, body: bytes = b""):
+
+    connection.sendall(struct.pack(">I", len(body) + 1) + kind + body)
+
+
+def receive_exactly(connection: socket.socket, size: int):
+
+    data = bytearray()
+
+    while len(data) < size:
+
+        chunk = connection.recv(min(size - len(data), 1 << 20))
+
+        if not chunk:
+
+            raise WorkerLost("The connection was closed")
+
+        data += chunk
+
+    return bytes(data)
+
+
+def receive_message(connection: socket.socket):
+
+    size, = struct.unpack(">I", receive_exactly(connection, 4))
+    message = receive_exactly(connection, size)
+
+    return message[:1], message[1:]
+
+
+# Throughput of one worker as the coordinator sees it, the seconds are the ones the worker spent tracing
+class WorkerStats:
+
+    def __init__(self, name: str, address: str):
+
+        self.name = name
+        self.address = address
+        self.tiles = 0
+        self.pixels = 0
+        self.seconds = 0
+        self.lost_tiles = 0             # Tiles handed out to the worker that had to be given to another one
+        self.connected = True
+
+    def as_dict(self):
+
+        return {"name": self.name, "address": self.address, "tiles": self.tiles, "pixels": self.pixels, "seconds": self.seconds, "pixels_per_second": self.pixels / self.seconds if self.seconds else 0, "lost_tiles": self.lost_tiles, "connected": self.connected}
+
+
+class Coordinator:
+
+    def __init__(self, scene: Scene, host: str = "127.0.0.1", port: int = 0, tile_size: int = 64, timeout: float = 60):
+
+        self.scene = scene
+        self.tile_size = tile_size
+        self.timeout = timeout          # Seconds a worker may take for a tile before it counts as dead and its tile is handed out again
+        self.framebuffer = Framebuffer(scene.window.size_x, scene.window.size_y, scene.window.color.as_tuple(True))
+        self.tiles = [(x, y, min(tile_size, scene.window.size_x - x), min(tile_size, scene.window.size_y - y)) for y in range(0, scene.window.size_y, tile_size) for x in range(0, scene.window.size_x, tile_size)]
+        self.pending = deque(range(len(self.tiles)))
+        self.finished = set()
+        self.workers = []
+        self.requeued_tiles = 0
+        self.seconds = None             # Wall time of the render once it is done
+        self.condition = Condition()    # Guards everything above and wakes up the render once a tile is finished
+
+        scene.compile_if_changed()
+        self.scene_data = pickle.dumps(scene)
+
+        self.server = socket.create_server((host, port))
+        self.address = self.server.getsockname()[:2]
+
+    # Accepts workers until the render is done, every worker is served by a thread of its own
+    def accept(self):
+
+        while True:
+
+            try:
+
+                connection, address = self.server.accept()
+
+            except OSError:             # The server socket was closed after the render
+
+                return
+
+            Thread(target=self.serve, args=(connection, f"{address[0]}:{address[1]}"), daemon=True).start()
+
+    def serve(self, connection: socket.socket, address: str):
+
+        tile_id = None
+        worker = None
+
+        try:
+
+            connection.settimeout(self.timeout)
+
+            kind, body = receive_message(connection)
+
+            if kind != HELLO:
+
+                return
+
+            worker = WorkerStats(body.decode(errors="replace"), address)
+
+            with self.condition:
+
+                self.workers.append(worker)
+
+            send_message(connection, SCENE, self.scene_data)
+
+            while True:
+
+                tile_id = self.next_tile()
+
+                if tile_id is None:
+
+                    send_message(connection, DONE)
+
+                    return
+
+                x, y, width, height = self.tiles[tile_id]
+                send_message(connection, TILE, struct.pack(TILE_FORMAT, tile_id, x, y, width, height))
+
+                kind, body = receive_message(connection)
+                header_size = struct.calcsize(RESULT_FORMAT)
+
+                if kind != RESULT or len(body) != header_size + 3 * width * height:
+
+                    raise WorkerLost(f"Unexpected answer from {worker.name}")
+
+                result_id, shadow_rays, seconds = struct.unpack(RESULT_FORMAT, body[:header_size])
+
+                if result_id != tile_id:
+
+                    raise WorkerLost(f"{worker.name} answered with the wrong tile")
+
+                self.finish_tile(tile_id, worker, body[header_size:], shadow_rays, seconds)
+                tile_id = None
+
+        except (OSError, WorkerLost):   # Includes the socket timeout
+
+            pass
+
+        finally:
+
+            connection.close()
+
+            with self.condition:
+
+                if worker is not None:
+
+                    worker.connected = False
+
+                if tile_id is not None and tile_id not in self.finished:
+
+                    self.pending.appendleft(tile_id)
+                    self.requeued_tiles += 1
+
+                    if worker is not None:
+
+                        worker.lost_tiles += 1
+
+                self.condition.notify_all()
+
+    # The id of the next tile that is neither finished nor handed out, None once every tile is finished. While the last tiles are out with other workers it waits,
+    # since one of those workers may still die and leave its tile to this one
+    def next_tile(self):
+
+        with self.condition:
+
+            while len(self.finished) < len(self.tiles):
+
+                if self.pending:
+
+                    tile_id = self.pending.popleft()
+
+                    if tile_id not in self.finished:
+
+                        return tile_id
+
+                else:
+
+                    self.condition.wait()
+
+            return None
+
+    def finish_tile(self, tile_id: int, worker: WorkerStats, data: bytes, shadow_rays: int, seconds: float):
+
+        with self.condition:
+
+            if tile_id in self.finished:
+
+                return
+
+            x, y, width, height = self.tiles[tile_id]
+
+            for row in range(height):
+
+                offset = 3 * ((y + row) * self.framebuffer.width + x)
+                self.framebuffer.data[offset:offset + 3 * width] = data[3 * width * row:3 * width * (row + 1)]
+
+            self.finished.add(tile_id)
+            self.scene.shadow_rays += shadow_rays
+
+            worker.tiles += 1
+            worker.pixels += width * height
+            worker.seconds += seconds
+
+            self.scene.progress = 100 * len(self.finished) // len(self.tiles)
+            self.condition.notify_all()
+
+    # Waits until every tile is finished, supersamples the edges here if the scene uses anti-aliasing and returns the framebuffer
+    def render(self):
+
+        start = time.perf_counter()
+        self.scene.shadow_rays = 0
+
+        Thread(target=self.accept, daemon=True).start()
+
+        with self.condition:
+
+            while len(self.finished) < len(self.tiles):
+
+                self.condition.wait()
+
+        self.seconds = time.perf_counter() - start
+        self.server.close()
+
+        if self.scene.max_samples > 1:  # Needs the neighbours of every pixel, so it runs on the whole image once the tiles are in
+
+            self.scene.antialias(self.scene.shapes, self.framebuffer)
+
+        self.scene.progress = 100
+
+        return self.framebuffer
+
+    def stats(self):
+
+        with self.condition:
+
+            return {"seconds": self.seconds, "tiles": len(self.tiles), "finished_tiles": len(self.finished), "requeued_tiles": self.requeued_tiles, "workers": [worker.as_dict() for worker in self.workers]}
+
+
+# Connects to the coordinator and traces the tiles it hands out until it has none left
+def run_worker(host: str, port: int, name: str = None):
+
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+
+    with socket.create_connection((host, port)) as connection:
+
+        send_message(connection, HELLO, name.encode())
+
+        kind, body = receive_message(connection)
+        scene = pickle.loads(body)
+
+        while True:
+
+            kind, body = receive_message(connection)
+
+            if kind != TILE:
+
+                return
+
+            tile_id, x, y, width, height = struct.unpack(TILE_FORMAT, body)
+            shadow_rays = scene.shadow_rays
+            start = time.perf_counter()
+
+            tile = Framebuffer(width, height)
+            tile.write_rows(0, [[scene.trace_pixel(scene.shapes, j, i) for j in range(x, x + width)] for i in range(y, y + height)])
+
+            send_message(connection, RESULT, struct.pack(RESULT_FORMAT, tile_id, scene.shadow_rays - shadow_rays, time.perf_counter() - start) + bytes(tile.data))
+
+
+# Renders the scene with the given amount of worker processes on this machine, mostly for trying the farm out and for tests. Returns the framebuffer and the coordinator's stats
+def render_locally(scene: Scene, workers: int = 2, tile_size: int = 64, timeout: float = 60):
+
+    coordinator = Coordinator(scene, tile_size=tile_size, timeout=timeout)
+    processes = [Process(target=run_worker, args=(*coordinator.address, f"local-{index}"), daemon=True) for index in range(workers)]
+
+    for process in processes:
+
+        process.start()
+
+    framebuffer = coordinator.render()
+
+    for process in processes:
+
+        process.join()
+
+    return framebuffer, coordinator.stats()
+
+
+def main():
+
+    from benchmarks.scenes import SCENES
+
+    parser = argparse.ArgumentParser(prog="python -m farm", description="Renders a scene on worker processes that connect over TCP")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    coordinator_parser = commands.add_parser("coordinator", help="hand out the tiles of a scene and put the image together")
+    coordinator_parser.add_argument("--scene", default="many-spheres", help=f"one of {', '.join(SCENES)}")
+    coordinator_parser.add_argument("--size", type=int, nargs=2, default=(540, 400), metavar=("WIDTH", "HEIGHT"))
+    coordinator_parser.add_argument("--host", default="127.0.0.1", help="address to listen on, 0.0.0.0 for workers on other machines")
+    coordinator_parser.add_argument("--port", type=int, default=5555)
+    coordinator_parser.add_argument("--tile-size", type=int, default=64)
+    coordinator_parser.add_argument("--timeout", type=float, default=60, help="seconds a worker may take for a tile")
+    coordinator_parser.add_argument("--local", type=int, default=0, help="worker processes to start on this machine")
+    coordinator_parser.add_argument("--output", default="static/farm.png")
+
+    worker_parser = commands.add_parser("worker", help="trace tiles for a coordinator")
+    worker_parser.add_argument("--host", default="127.0.0.1")
+    worker_parser.add_argument("--port", type=int, default=5555)
+    worker_parser.add_argument("--name")
+
+    arguments = parser.parse_args()
+
+    if arguments.command == "worker":
+
+        run_worker(arguments.host, arguments.port, arguments.name)
+
+        return
+
+    if arguments.scene not in SCENES:
+
+        parser.error(f"unknown scene {arguments.scene}, choose from {', '.join(SCENES)}")
+
+    window = Window(*arguments.size, "farm", Vector(0, 0, 0))
+    coordinator = Coordinator(Scene(window, **SCENES[arguments.scene](window)), arguments.host, arguments.port, arguments.tile_size, arguments.timeout)
+
+    for index in range(arguments.local):
+
+        Process(target=run_worker, args=(*coordinator.address, f"local-{index}"), daemon=True).start()
+
+    print(f"Waiting for workers on {coordinator.address[0]}:{coordinator.address[1]}")
+
+    coordinator.render().save(arguments.output)
+    stats = coordinator.stats()
+
+    print(f"{stats['tiles']} tiles in {stats['seconds']:.2f}s, {stats['requeued_tiles']} handed out again, saved to {arguments.output}")
+
+    for worker in stats["workers"]:
+
+        print(f"{worker['name']:<24} {worker['tiles']:>5} tiles {worker['pixels_per_second']:>10.0f} pixels/s {worker['lost_tiles']:>3} lost")
+
+
+if __name__ == "__main__":
+
+    main()
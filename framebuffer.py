@@ -0,0 +1,224 @@
+import io
+import mmap
+import struct
+import zlib
+
+# The image a render writes into, one contiguous bytearray of RGB values row after row. It is indexed like Pillow's PixelAccess, so the renderer can write into it wherever it wrote
+# into a loaded image before, and whole rows are copied in at once. Pillow is only needed for converting it into an image or encoding it as PNG or WebP
+
+ENCODINGS = {"png": "image/png", "webp": "image/webp", "ppm": "image/x-portable-pixmap"}    # Format -> MIME type of the encodings the web app can serve
+
+
+def clamp(channel: int):
+
+    return 0 if channel < 0 else 255 if channel > 255 else channel
+
+
+class Framebuffer:
+
+    def __init__(self, width: int, height: int, color: tuple = (0, 0, 0)):
+
+        self.width = width
+        self.height = height
+        self.data = bytearray(bytes(clamp(channel) for channel in color) * (width * height))
+
+    # Color of the pixel in column j and row i, like PixelAccess
+    def __getitem__(self, position):
+
+        j, i = position
+        offset = 3 * (i * self.width + j)
+
+        return tuple(self.data[offset:offset + 3])
+
+    # Colors are clamped to 0..255 just like Pillow does it
+    def __setitem__(self, position, color):
+
+        j, i = position
+        offset = 3 * (i * self.width + j)
+
+        self.data[offset:offset + 3] = bytes(clamp(channel) for channel in color)
+
+    # Copies whole rows of colors into the buffer, starting with row start
+    def write_rows(self, start: int, rows: list):
+
+        offset = 3 * start * self.width
+
+        self.data[offset:offset + 3 * self.width * len(rows)] = bytes(clamp(channel) for row in rows for color in row for channel in color)
+
+    # The buffer is its own pixel access, so code written for Pillow images can call load on it as well
+    def load(self):
+
+        return self
+
+    def tobytes(self):
+
+        return bytes(self.data)
+
+    def frombytes(self, data: bytes):
+
+        self.data[:] = data
+
+    def image(self):
+
+        from PIL import Image
+
+        return Image.frombuffer("RGB", (self.width, self.height), bytes(self.data), "raw", "RGB", 0, 1)
+
+    # The image as a file in one of ENCODINGS. compress_level is the zlib level of PNG from 0 to 9, quality the lossy quality of WebP from 0 to 100
+    def encode(self, image_format: str = "png", compress_level: int = 6, quality: int = 80):
+
+        if image_format == "ppm":       # Binary PPM is a short header in front of the raw bytes, nothing has to be encoded
+
+            return f"P6\n{self.width} {self.height}\n255\n".encode() + bytes(self.data)
+
+        if image_format not in ENCODINGS:
+
+            raise ValueError(f"Unknown image format {image_format}, choose one of {', '.join(ENCODINGS)}")
+
+        data = io.BytesIO()
+
+        if image_format == "png":
+
+            self.image().save(data, "PNG", compress_level=compress_level)
+
+        else:
+
+            self.image().save(data, "WEBP", quality=quality)
+
+        return data.getvalue()
+
+    # Writes the image to a file, the format comes from the file's extension
+    def save(self, path: str, compress_level: int = 6):
+
+        with open(path, "wb") as file:
+
+            file.write(self.encode(path.rsplit(".", 1)[-1].lower(), compress_level))
+
+
+# A framebuffer kept in a file on disk instead of in memory, for images far larger than the memory. The operating system pages the parts being written in and out,
+# so the memory a render needs depends on the rows it traces at a time and not on the size of the image. Saving streams the rows out one after another as well
+class MappedFramebuffer(Framebuffer):
+
+    ROWS_PER_CHUNK = 64                 # Rows that are read, filtered and compressed together while saving
+
+    def __init__(self, width: int, height: int, color: tuple = (0, 0, 0), path: str = "framebuffer.rgb"):
+
+        self.width = width
+        self.height = height
+        self.path = path                # The raw RGB rows, which stay on disk after the framebuffer is closed
+
+        row = bytes(clamp(channel) for channel in color) * width
+
+        with open(path, "wb") as file:
+
+            for _ in range(height):
+
+                file.write(row)
+
+        self.file = open(path, "r+b")
+        self.data = mmap.mmap(self.file.fileno(), 3 * width * height)
+
+    def tobytes(self):
+
+        return self.data[:]
+
+    def write_rows(self, start: int, rows: list):
+
+        Framebuffer.write_rows(self, start, rows)
+
+        self.release(start, len(rows))
+
+    # Lets the operating system take the pages of the rows out of the process, the pixels stay in the file. Without this every page written would count towards the memory of the process until the end
+    def release(self, start: int, rows: int):
+
+        if hasattr(mmap, "MADV_DONTNEED"):
+
+            offset = 3 * start * self.width // mmap.PAGESIZE * mmap.PAGESIZE
+            end = 3 * (start + rows) * self.width
+
+            self.data.flush(offset, end - offset)
+            self.data.madvise(mmap.MADV_DONTNEED, offset, end - offset)
+
+    # Writes the image to a file without ever holding more than ROWS_PER_CHUNK rows in memory. PNG and PPM are streamed, anything else goes through Pillow and needs the whole image
+    def save(self, path: str, compress_level: int = 6):
+
+        image_format = path.rsplit(".", 1)[-1].lower()
+
+        if image_format not in ("png", "ppm"):
+
+            return Framebuffer.save(self, path, compress_level)
+
+        with open(path, "wb") as file:
+
+            if image_format == "png":
+
+                write_png(file, self.width, self.height, self.row_chunks(), compress_level)
+
+            else:
+
+                file.write(f"P6\n{self.width} {self.height}\n255\n".encode())
+
+                for chunk in self.row_chunks():
+
+                    file.write(chunk)
+
+    # The image's bytes in chunks of ROWS_PER_CHUNK rows
+    def row_chunks(self):
+
+        row_size = 3 * self.width
+
+        for start in range(0, self.height, self.ROWS_PER_CHUNK):
+
+            yield self.data[start * row_size:min(start + self.ROWS_PER_CHUNK, self.height) * row_size]
+
+            self.release(start, min(self.ROWS_PER_CHUNK, self.height - start))
+
+    def close(self):
+
+        self.data.close()
+        self.file.close()
+
+
+def png_chunk(kind: bytes, data: bytes):
+
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+# Writes an 8 bit RGB PNG from chunks of whole rows, compressing them as they come so that the image never has to be in memory at once. Every row uses the Sub filter, which stores each byte
+# as the difference to the same channel of the pixel on its left and turns the flat areas of a render into long runs of zeros
+def write_png(file, width: int, height: int, chunks, compress_level: int = 6):
+
+    import numpy as np
+
+    row_size = 3 * width
+    compressor = zlib.compressobj(compress_level)
+
+    file.write(b"\x89PNG\r\n\x1a\n")
+    file.write(png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+
+    for chunk in chunks:
+
+        rows = np.frombuffer(chunk, dtype=np.uint8).reshape(-1, row_size)
+        filtered = np.empty((len(rows), row_size + 1), dtype=np.uint8)
+
+        filtered[:, 0] = 1                                  # The filter type in front of every row
+        filtered[:, 1:4] = rows[:, :3]
+        filtered[:, 4:] = rows[:, 3:] - rows[:, :-3]        # Wraps around modulo 256 just like the filter expects
+
+        compressed = compressor.compress(filtered.tobytes())
+
+        if compressed:
+
+            file.write(png_chunk(b"IDAT", compressed))
+
+    file.write(png_chunk(b"IDAT", compressor.flush()))
+    file.write(png_chunk(b"IEND", b""))
+
+
+# A framebuffer with the pixels of a Pillow image, for images that were saved to disk
+def from_image(image):
+
+    framebuffer = Framebuffer(image.width, image.height)
+    framebuffer.frombytes(image.convert("RGB").tobytes())
+
+    return framebuffer
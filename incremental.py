@@ -0,0 +1,425 @@
+import hashlib
+import json
+import os
+import pickle
+import time
+from array import array
+from math import inf
+from itertools import islice
+from lib import Vector, Ray, BVHNode, Scene, screen_rectangle
+import lib
+from cache import canonical_scene, canonical_shape
+
+# Re-renders only the pixels an edit of the shapes can reach. A recorded render keeps its image together with what each pixel's ray tree ran into: the shapes it hit or was blocked by,
+# the distance to its primary hit and the segments of its reflected rays and of its shadow rays that reached their light. After an edit a pixel is traced again only if one of its shapes
+# changed or one of its rays passes through the old or new box of a changed shape, every other pixel would come out of a full render exactly as before
+
+MIN_PARALLEL_PIXELS = 2048          # Fewer dirty pixels are traced in this process even if the scene has several workers, starting the pool takes longer than tracing them
+
+
+# Everything besides the shapes that decides how the image looks, a render can only be reused while all of it stays the same
+def settings(scene: Scene):
+
+    canonical = canonical_scene(scene)
+
+    del canonical["shapes"]
+
+    return canonical
+
+
+# Incremental renders trace their pixels one by one like the python render mode, in this process or spread over the scene's workers, so they only stand in for python renders without supersampling
+def applies_to(scene: Scene):
+
+    return scene.max_samples == 1 and scene.render_mode == "python"
+
+
+class RenderRecord:
+
+    def __init__(self, scene: Scene):
+
+        self.settings = settings(scene)
+        self.shapes = [canonical_shape(shape) for shape in scene.shapes]   # What every shape looked like, compared by position in the list
+        self.bounds = [shape.bounds() for shape in scene.shapes]
+        self.width = scene.window.size_x
+        self.height = scene.window.size_y
+
+        size = self.width * self.height
+
+        self.touched = [()] * size                  # Indices of the shapes each pixel's rays hit or were blocked by
+        self.primary = array("d", [inf]) * size     # Distance from the camera to each pixel's first hit
+        self.segments = [None] * size               # Other rays of each pixel as a flat array of origin, direction and length, seven numbers per ray
+        self.image = None                           # RGB bytes of the finished image
+
+    # Whether the scene differs from the recorded one in its shapes only, which is what a partial render can handle. Supersampled pixels depend on their neighbours, so those scenes are always rendered in full
+    def reusable_for(self, scene: Scene):
+
+        return self.image is not None and scene.max_samples == 1 and settings(scene) == self.settings
+
+    # Positions of the shapes that were changed, added or removed since the recording
+    def changed_shapes(self, scene: Scene):
+
+        shapes = [canonical_shape(shape) for shape in scene.shapes]
+
+        return [index for index in range(max(len(shapes), len(self.shapes))) if index >= len(shapes) or index >= len(self.shapes) or shapes[index] != self.shapes[index]]
+
+    # Pixels, as (column, row), that have to be traced again for the scene
+    def dirty_pixels(self, scene: Scene):
+
+        changed = self.changed_shapes(scene)
+
+        if not changed:
+
+            return []
+
+        changed_set = set(changed)
+        boxes = [BVHNode(*self.bounds[index]) for index in changed if index < len(self.bounds)] + [BVHNode(*scene.shapes[index].bounds()) for index in changed if index < len(scene.shapes)]
+        dirty = {pixel for pixel, touched in enumerate(self.touched) if not changed_set.isdisjoint(touched)}
+
+        for box in boxes:
+
+            dirty.update(self.primary_rays_through(box, scene))
+
+        for pixel, segments in enumerate(self.segments):
+
+            if segments is not None and pixel not in dirty and any(passes_through(box, segments[k:k + 7]) for k in range(0, len(segments), 7) for box in boxes):
+
+                dirty.add(pixel)
+
+        return [(pixel % self.width, pixel // self.width) for pixel in sorted(dirty)]
+
+    # The pixels whose primary ray enters the box before reaching its first hit. Only the pixels inside of the box's projection onto the screen are tested
+    def primary_rays_through(self, box: BVHNode, scene: Scene):
+
+        window = scene.window
+        camera = scene.camera
+        columns, rows = screen_rectangle(window, camera, box.lower, box.upper)
+        pixels = []
+
+        for i in rows:
+
+            y = window.upside + window.y_step * i
+
+            for j in columns:
+
+                x = window.left_side + window.x_step * j
+                ray = Ray(camera, Vector(x - camera.x, y - camera.y, -camera.z))     # The same primary ray as in Scene.sample_pixel
+                origin, direction = ray.origin, ray.direction
+
+                if passes_through(box, (origin.x, origin.y, origin.z, direction.x, direction.y, direction.z, self.primary[i * self.width + j])):
+
+                    pixels.append(i * self.width + j)
+
+        return pixels
+
+
+# Whether a ray segment, given as origin, direction and length, enters the box before its end
+def passes_through(box: BVHNode, segment):
+
+    origin_x, origin_y, origin_z, direction_x, direction_y, direction_z, length = segment
+    entry = box.entry_distance(origin_x, origin_y, origin_z, 1 / direction_x if direction_x != 0 else None, 1 / direction_y if direction_y != 0 else None, 1 / direction_z if direction_z != 0 else None)
+
+    return entry is not None and entry <= length * (1 + 1e-9) + 1e-9      # The length was measured from a hit point, so a box right at the end is counted as well
+
+
+# What the rays of the pixels traced by a worker process ran into, keyed by pixel and sent back with their colors to be copied into the RenderRecord
+class PixelRecord:
+
+    def __init__(self, width: int):
+
+        self.width = width
+        self.touched = {}
+        self.primary = {}
+        self.segments = {}
+
+    # Hands what was recorded so far over and starts again empty, the recorder looks the dictionaries up on the record for every pixel
+    def take(self):
+
+        taken = PixelRecord(self.width)
+        taken.touched, taken.primary, taken.segments = self.touched, self.primary, self.segments
+        self.touched, self.primary, self.segments = {}, {}, {}
+
+        return taken
+
+
+# Wraps the scene's sample_pixel, closest_object and occluded so that every traced pixel writes what its rays ran into to the record. Returns a function that removes the wrappers again
+def attach_recorder(scene: Scene, record: RenderRecord):
+
+    sample_pixel = scene.sample_pixel
+    closest_object = scene.closest_object
+    occluded = scene.occluded
+    replaced = {name: scene.__dict__[name] for name in ("sample_pixel", "closest_object", "occluded") if name in scene.__dict__}
+    indices = {id(shape): index for index, shape in enumerate(scene.shapes)}
+    pixel = None
+    primary_pending = False                 # Whether the next closest object query of the pixel is its primary ray
+    touched = set()
+    segments = array("d")
+
+    def recorded_sample_pixel(shapes, j, i):
+
+        nonlocal pixel, primary_pending, touched, segments
+
+        pixel = i * record.width + j
+        primary_pending = True
+        touched = set()
+        segments = array("d")
+
+        color = sample_pixel(shapes, j, i)
+
+        record.touched[pixel] = tuple(sorted(touched))
+        record.segments[pixel] = segments if segments else None
+
+        return color
+
+    def recorded_closest_object(ray, shapes):
+
+        nonlocal primary_pending
+
+        hit = closest_object(ray, shapes)
+        distance = inf if hit is None else hit.distance
+
+        if hit is not None:
+
+            touched.add(indices[id(hit.shape)])
+
+        if primary_pending:
+
+            primary_pending = False
+            record.primary[pixel] = distance
+
+        else:
+
+            segments.extend((ray.origin.x, ray.origin.y, ray.origin.z, ray.direction.x, ray.direction.y, ray.direction.z, distance))
+
+        return hit
+
+    def recorded_occluded(ray, distance, light_index):
+
+        blocked = occluded(ray, distance, light_index)
+
+        if blocked:
+
+            touched.add(scene.last_occluders[light_index].index)
+
+        else:
+
+            segments.extend((ray.origin.x, ray.origin.y, ray.origin.z, ray.direction.x, ray.direction.y, ray.direction.z, distance))
+
+        return blocked
+
+    scene.sample_pixel = recorded_sample_pixel
+    scene.closest_object = recorded_closest_object
+    scene.occluded = recorded_occluded
+
+    def detach():
+
+        for name in ("sample_pixel", "closest_object", "occluded"):
+
+            scene.__dict__.pop(name, None)
+
+        scene.__dict__.update(replaced)       # Methods an instrumented scene had swapped in before
+
+    return detach
+
+
+# Renders the scene into the image, a Framebuffer or a Pillow image, and returns the new record together with the amount of pixels that were traced. With a previous record that fits the scene only the dirty pixels are traced
+# and the rest is copied from the previous image, otherwise the whole image is traced. The pixels are traced one by one like in the python render mode, by the scene's workers if there are enough of them
+def render(scene: Scene, image, previous: RenderRecord = None):
+
+    record = RenderRecord(scene)
+    pixels = image.load()
+
+    scene.progress = 0
+    scene.shadow_rays = 0
+    scene.last_occluders = {}
+    render_start = time.perf_counter()
+
+    if scene.instrument:
+
+        import instrumentation
+
+        instrumentation.attach(scene)
+
+    scene.compile_if_changed()
+
+    if previous is not None and previous.reusable_for(scene):
+
+        dirty = previous.dirty_pixels(scene)
+
+        image.frombytes(previous.image)
+
+        record.touched = list(previous.touched)
+        record.primary = array("d", previous.primary)
+        record.segments = list(previous.segments)
+
+    else:
+
+        dirty = [(j, i) for i in range(record.height) for j in range(record.width)]
+
+    bands = {}
+
+    for j, i in dirty:
+
+        bands.setdefault(i - i % scene.BAND_HEIGHT, []).append((j, i))
+
+    traced = 0
+
+    for start, colors in (trace_parallel if scene.workers > 1 and len(dirty) >= MIN_PARALLEL_PIXELS else trace_serial)(scene, record, bands):
+
+        for (j, i), color in zip(bands[start], colors):
+
+            pixels[j, i] = color
+
+        if scene.on_band is not None:      # The whole band is handed on, its clean pixels come from the previous image
+
+            scene.on_band(start, [[pixels[j, i] for j in range(record.width)] for i in range(start, min(start + scene.BAND_HEIGHT, record.height))])
+
+        traced += len(bands[start])
+        scene.progress = 100 * traced // len(dirty)
+
+    scene.rays_per_pixel = 1
+    scene.progress = 100
+    record.image = image.tobytes()
+
+    if scene.instrument:
+
+        scene.stats.shadow_rays = scene.shadow_rays
+        scene.stats.render_seconds = time.perf_counter() - render_start
+
+    return record, len(dirty)
+
+
+# Traces the pixels of every band in this process and yields the first row of the band together with the colors of its pixels
+def trace_serial(scene: Scene, record: RenderRecord, bands: dict):
+
+    detach = attach_recorder(scene, record)
+
+    try:
+
+        for start in sorted(bands):
+
+            yield start, [scene.trace_pixel(scene.shapes, j, i) for j, i in bands[start]]
+
+    finally:
+
+        detach()
+
+
+# Same as trace_serial with the bands spread over a pool of the scene's workers. Every worker records its own pixels, which are copied into the record as their bands come back
+def trace_parallel(scene: Scene, record: RenderRecord, bands: dict):
+
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+    pending = iter(sorted(bands))
+
+    with ProcessPoolExecutor(max_workers=scene.workers, initializer=_init_worker, initargs=(scene,)) as pool:
+
+        running = {pool.submit(_trace_pixels, start, bands[start]) for start in islice(pending, 2 * scene.workers)}     # Only a few bands are handed out ahead like in Scene.ray_trace_parallel
+
+        while running:
+
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+
+                start, colors, pixel_record, shadow_rays, stats = future.result()
+
+                for pixel, touched in pixel_record.touched.items():
+
+                    record.touched[pixel] = touched
+                    record.primary[pixel] = pixel_record.primary.get(pixel, inf)
+                    record.segments[pixel] = pixel_record.segments[pixel]
+
+                scene.shadow_rays += shadow_rays
+
+                if stats is not None:
+
+                    scene.stats.merge(stats)
+
+                yield start, colors
+
+            running |= {pool.submit(_trace_pixels, start, bands[start]) for start in islice(pending, len(done))}
+
+
+# Every worker process of trace_parallel receives the scene once and keeps a recorder attached to it
+_worker_scene = None
+_worker_record = None
+
+def _init_worker(scene: Scene):
+
+    global _worker_scene, _worker_record
+
+    lib._init_worker(scene)
+
+    _worker_scene = scene
+    _worker_record = PixelRecord(scene.window.size_x)
+
+    attach_recorder(scene, _worker_record)
+
+
+# Returns the first row of the band, the colors of its pixels, what their rays ran into, the shadow rays cast for them and the stats of the band if the scene is instrumented
+def _trace_pixels(start: int, pixels: list):
+
+    shadow_rays = _worker_scene.shadow_rays
+    colors = [_worker_scene.trace_pixel(_worker_scene.shapes, j, i) for j, i in pixels]
+    stats = None
+
+    if _worker_scene.instrument:
+
+        stats = _worker_scene.stats.as_dict()
+        _worker_scene.stats.reset()
+
+    return start, colors, _worker_record.take(), _worker_scene.shadow_rays - shadow_rays, stats
+
+
+# Keeps the record of the last render for each set of settings as a pickle file, so that the next render of a scene that only differs in its shapes can start from it.
+# Only the newest max_records files are kept, a record takes about 150 bytes per pixel
+class RecordStore:
+
+    def __init__(self, directory: str, max_records: int = 8):
+
+        self.directory = directory
+        self.max_records = max_records
+
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, scene: Scene):
+
+        key = hashlib.sha256(json.dumps(settings(scene), separators=(",", ":"), sort_keys=True).encode()).hexdigest()
+
+        return os.path.join(self.directory, f"{key}.pickle")
+
+    # The record of the last render with the scene's settings, or None if there is none or it can not be read
+    def load(self, scene: Scene):
+
+        try:
+
+            with open(self.path(scene), "rb") as file:
+
+                return pickle.load(file)
+
+        except (OSError, pickle.UnpicklingError, EOFError):
+
+            return None
+
+    # Written under a temporary name first, so that a render loading the record at the same time never sees half of it
+    def save(self, scene: Scene, record: RenderRecord):
+
+        path = self.path(scene)
+        temporary = f"{path}.{os.getpid()}.tmp"
+
+        with open(temporary, "wb") as file:
+
+            pickle.dump(record, file, pickle.HIGHEST_PROTOCOL)
+
+        os.replace(temporary, path)
+
+        records = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith(".pickle")), key=lambda entry: entry.stat().st_mtime, reverse=True)
+
+        for entry in records[self.max_records:]:
+
+            try:
+
+                os.remove(entry.path)
+
+            except OSError:             # Another worker removed it first
+                pass
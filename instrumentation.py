@@ -0,0 +1,225 @@
+import time
+
+# Optional counters and timers for a Scene. Nothing in the renderer checks whether they are on, instead attach swaps the methods of one scene instance for counting versions
+# of them, so a scene without instrumentation runs the exact same code as before. The numpy render mode bypasses these methods and only reports the time of the whole frame
+
+
+# The intersection tests and hits are counted per kind of shape, they read like the other counters as sphere_tests, wall_hits and so on
+class RenderStats:
+
+    COUNTERS = ("primary_rays", "closest_queries", "shadow_rays")
+    TIMERS = ("render_seconds", "intersection_seconds", "shading_seconds", "image_write_seconds")
+
+    def __init__(self):
+
+        self.shape_counts = {}          # Kind of shape -> [tests, hits]
+        self.reset()
+
+    # Starts counting from zero again, in place since the instrumented methods and the counted shapes keep a reference to the stats
+    def reset(self):
+
+        for name in self.COUNTERS + self.TIMERS:
+
+            setattr(self, name, 0)
+
+        for counts in self.shape_counts.values():
+
+            counts[:] = [0, 0]
+
+        self.bounce_depths = {}         # Hits along a primary ray's path -> amount of primary rays
+
+    # The [tests, hits] list of a kind of shape, which its counted shapes add to
+    def counts_of(self, kind: str):
+
+        return self.shape_counts.setdefault(kind, [0, 0])
+
+    def __getattr__(self, name: str):
+
+        kind, _, counter = name.rpartition("_")
+
+        if counter in ("tests", "hits") and kind in self.__dict__.get("shape_counts", {}):
+
+            return self.shape_counts[kind][counter == "hits"]
+
+        raise AttributeError(name)
+
+    def as_dict(self):
+
+        stats = {name: getattr(self, name) for name in self.COUNTERS + self.TIMERS}
+
+        for kind, (tests, hits) in self.shape_counts.items():
+
+            stats[f"{kind}_tests"] = tests
+            stats[f"{kind}_hits"] = hits
+
+        stats["reflected_rays"] = self.closest_queries - self.primary_rays
+        stats["bounce_depths"] = {str(depth): count for depth, count in sorted(self.bounce_depths.items())}
+        stats["rays_per_second"] = (self.closest_queries + self.shadow_rays) / self.render_seconds if self.render_seconds else 0
+
+        return stats
+
+    # Adds stats given as returned by as_dict, from a worker process or from another render
+    def merge(self, stats: dict):
+
+        for name in self.COUNTERS + self.TIMERS:
+
+            setattr(self, name, getattr(self, name) + stats[name])
+
+        for name in stats:
+
+            if name.endswith("_tests"):
+
+                counts = self.counts_of(name[:-len("_tests")])
+                counts[0] += stats[name]
+                counts[1] += stats[name[:-len("_tests")] + "_hits"]
+
+        for depth, count in stats["bounce_depths"].items():
+
+            self.bounce_depths[int(depth)] = self.bounce_depths.get(int(depth), 0) + count
+
+
+# Compiled shapes that count their intersection tests. A subclass is made for every compiled type the first time a shape of it is counted, so it keeps the type of the compiled shape
+# it copies and the BVH and the numpy render modes treat it the same. Compiled types -> their counting subclass
+COUNTED_TYPES = {}
+
+
+def counted_type(compiled_type):
+
+    if compiled_type not in COUNTED_TYPES:
+
+        def intersect(self, ray):
+
+            counts = self.counts
+            counts[0] += 1
+            hit = compiled_type.intersect(self, ray)
+
+            if hit is not None:
+
+                counts[1] += 1
+
+            return hit
+
+        # The subclass only exists in the process that made it, so a pickled copy is made again from its compiled type on the other side
+        def reduce(self):
+
+            return copy_counted, (compiled_type, slot_values(self, compiled_type), self.counts)
+
+        COUNTED_TYPES[compiled_type] = type(f"Counted{compiled_type.__name__}", (compiled_type,), {"__slots__": ("counts",), "intersect": intersect, "__reduce__": reduce})
+
+    return COUNTED_TYPES[compiled_type]
+
+
+def slot_values(compiled, compiled_type):
+
+    return {slot: getattr(compiled, slot) for cls in compiled_type.__mro__ for slot in getattr(cls, "__slots__", ())}
+
+
+def copy_counted(compiled_type, values: dict, counts: list):
+
+    copy = counted_type(compiled_type).__new__(counted_type(compiled_type))
+
+    for slot, value in values.items():
+
+        setattr(copy, slot, value)
+
+    copy.counts = counts
+
+    return copy
+
+
+def counted(compiled, stats: RenderStats):
+
+    return copy_counted(type(compiled), slot_values(compiled, type(compiled)), stats.counts_of(compiled.shape.kind))
+
+
+# Adds seconds spent in the method to the timer of the stats
+def timed(method, stats: RenderStats, timer: str):
+
+    def timed_method(*arguments):
+
+        start = time.perf_counter()
+        result = method(*arguments)
+        setattr(stats, timer, getattr(stats, timer) + time.perf_counter() - start)
+
+        return result
+
+    return timed_method
+
+
+INSTRUMENTED_METHODS = ("compile_shape", "sample_pixel", "closest_object", "ray_bounce", "occluded", "diffuse", "shade_lights", "blit_rows")
+
+
+# Gives the scene fresh stats and replaces its hot methods with counting and timing versions, which stay until detach is called. The geometry is compiled again so that its shapes count their tests
+def attach(scene):
+
+    remove_methods(scene)
+
+    stats = RenderStats()
+    scene.stats = stats
+
+    compile_shape = scene.compile_shape
+    sample_pixel = scene.sample_pixel
+    closest_object = timed(scene.closest_object, stats, "intersection_seconds")
+    ray_bounce = scene.ray_bounce
+    path_hits = 0
+
+    def counted_compile_shape(shape, index):
+
+        return counted(compile_shape(shape, index), stats)
+
+    def counted_sample_pixel(shapes, j, i):
+
+        stats.primary_rays += 1
+
+        return sample_pixel(shapes, j, i)
+
+    def counted_closest_object(ray, shapes):
+
+        nonlocal path_hits
+
+        stats.closest_queries += 1
+        hit = closest_object(ray, shapes)
+
+        if hit is not None:
+
+            path_hits += 1
+
+        return hit
+
+    def counted_ray_bounce(ray, shapes, amount_of_calls):
+
+        nonlocal path_hits
+
+        path_hits = 0
+        color = ray_bounce(ray, shapes, amount_of_calls)
+
+        stats.bounce_depths[path_hits] = stats.bounce_depths.get(path_hits, 0) + 1
+
+        return color
+
+    scene.compile_shape = counted_compile_shape
+    scene.sample_pixel = counted_sample_pixel
+    scene.closest_object = counted_closest_object
+    scene.ray_bounce = counted_ray_bounce
+    scene.occluded = timed(scene.occluded, stats, "intersection_seconds")
+    scene.diffuse = timed(scene.diffuse, stats, "shading_seconds")
+    scene.shade_lights = timed(scene.shade_lights, stats, "shading_seconds")
+    scene.blit_rows = timed(scene.blit_rows, stats, "image_write_seconds")
+
+    scene.compile()
+
+    return stats
+
+
+def remove_methods(scene):
+
+    for name in INSTRUMENTED_METHODS:
+
+        scene.__dict__.pop(name, None)
+
+
+# Puts the plain methods of the class back, the stats of the last render stay on the scene
+def detach(scene):
+
+    remove_methods(scene)
+    scene.compile()
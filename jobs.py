@@ -0,0 +1,317 @@
+import base64
+import io
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from threading import Condition, Lock, Thread
+from PIL import Image
+from instrumentation import RenderStats
+import incremental
+
+# Render jobs of the web app. Every submitted scene becomes a job with its own ID that waits in a bounded queue until one of the worker processes renders it,
+# so several users can render at once and the Flask process itself never spends its time tracing rays
+
+QUEUED = "queued"
+RENDERING = "rendering"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+# The state of a single render as the web app sees it, the scene itself only lives in the worker process that renders it
+class RenderJob:
+
+    def __init__(self, job_id: str, path: str = None, key: str = None):
+
+        self.id = job_id
+        self.path = path                # Where the finished image is on disk, if the worker saves it or it comes from the cache
+        self.framebuffer = None         # The finished image in memory, which is what the web app serves
+        self.key = key                  # Hash of the scene when the render cache is used
+        self.cached = False
+        self.state = QUEUED
+        self.progress = 0
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.bands = []                 # (first row, base64 PNG) of every band finished so far, for streaming them to the browser while the render runs
+        self.render_stats = None        # Counters and timings of the render when the scene was instrumented, see instrumentation.RenderStats
+
+    def as_dict(self):
+
+        return {"id": self.id, "state": self.state, "progress": self.progress, "error": self.error, "cached": self.cached}
+
+
+class JobManager:
+
+    MAX_FINISHED_JOBS = 100             # Older finished jobs are forgotten and their images deleted so that the server does not fill up over time
+
+    def __init__(self, workers: int = 2, max_queued: int = 16, output_dir: str = "static/renders", cache = None, records = None, save_images: bool = False):
+
+        self.workers = workers
+        self.max_queued = max_queued    # Jobs waiting on top of the ones being rendered, anything beyond is refused
+        self.output_dir = output_dir
+        self.cache = cache              # Optional RenderCache, finished images are stored in it and identical scenes are served from it
+        self.records = records          # Optional incremental.RecordStore, a scene whose settings were rendered before only traces the pixels its shape edits reach
+        self.save_images = save_images  # Whether the workers also write every finished image to output_dir, they are kept in memory either way
+        self.jobs = {}
+        self.in_flight = {}             # Scene key -> ID of the job rendering it, so identical scenes submitted at once share one render
+        self.shared_renders = 0
+        self.lock = Lock()
+        self.changed = Condition(self.lock)     # Notified whenever a job gets a band, new progress or finishes, streams wait on it instead of polling
+
+        os.makedirs(output_dir, exist_ok=True)
+
+        self.manager = Manager()
+        self.events = self.manager.Queue()      # The worker processes report their progress through this queue
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+
+        Thread(target=self.listen, daemon=True).start()
+
+    def new_job_id(self):
+
+        return uuid.uuid4().hex
+
+    # The path a job's image is written to, it is also the name of the job's Window inside of ./static
+    def image_name(self, job_id: str):
+
+        return f"{os.path.relpath(self.output_dir, 'static')}/{job_id}"
+
+    # Queues the scene for rendering, the scene's window has to be named after image_name(job_id) so that a saved image ends up at the job's path.
+    # With a key (see cache.scene_key) a cached image or a render of the same scene that is already running is used instead, so the returned ID may belong to another job
+    def submit(self, job_id: str, scene, key: str = None):
+
+        path = f"static/{scene.window.name}.png" if self.save_images else None
+
+        with self.lock:
+
+            if key is not None and key in self.in_flight:
+
+                self.shared_renders += 1
+                self.discard(path)
+
+                return self.in_flight[key]
+
+            cached_path = self.cache.get(key) if key is not None and self.cache is not None else None
+
+            if cached_path is not None:
+
+                job = RenderJob(job_id, cached_path, key)
+                job.state = DONE
+                job.progress = 100
+                job.cached = True
+                job.finished = time.time()
+
+                self.jobs[job_id] = job
+                self.discard(path)
+
+                return job_id
+
+            active = sum(job.state in (QUEUED, RENDERING) for job in self.jobs.values())
+
+            if active >= self.workers + self.max_queued:
+
+                raise JobQueueFull(f"There are already {active} renders waiting, try again later")
+
+            job = RenderJob(job_id, path, key)
+            self.jobs[job_id] = job
+
+            if key is not None:
+
+                self.in_flight[key] = job_id
+
+        future = self.pool.submit(render_job, job_id, scene, self.events, self.records, self.save_images)
+        future.add_done_callback(lambda future: self.finish(job, future))
+
+        return job_id
+
+    def get(self, job_id: str):
+
+        with self.lock:
+
+            return self.jobs.get(job_id)
+
+    # The bands after the first sent ones together with the job's state and progress, read at once so that they fit together. With a timeout it first waits
+    # up to that many seconds for something the caller has not seen yet: another band, a progress other than the given one, or the end of the job
+    def updates(self, job: RenderJob, sent: int, progress = None, timeout: float = None):
+
+        with self.changed:
+
+            if timeout is not None:
+
+                self.changed.wait_for(lambda: len(job.bands) > sent or job.progress != progress or job.finished is not None, timeout)
+
+            return job.bands[sent:], job.state, job.progress
+
+    # The lock is only held to update the job, encoding the image and writing it to the cache can take seconds for large images and would block every request meanwhile.
+    # The key stays in flight until the image is in the cache, so an identical scene submitted in between shares the finished job instead of rendering again
+    def finish(self, job: RenderJob, future):
+
+        error = future.exception()
+        framebuffer, render_stats = future.result() if not error else (None, None)
+        data = framebuffer.encode("png") if job.key is not None and self.cache is not None and not error else None
+
+        with self.lock:
+
+            job.state = FAILED if error else DONE
+            job.error = str(error) if error else None
+            job.framebuffer, job.render_stats = framebuffer, render_stats
+            job.progress = 100 if not error else job.progress
+            job.finished = time.time()
+            job.bands = []              # Anyone still streaming loads the finished image instead
+
+            self.forget_old_jobs()
+            self.changed.notify_all()
+
+        if job.key is None:
+
+            return
+
+        if data is not None:
+
+            self.cache.put_data(job.key, data)
+
+        with self.lock:
+
+            self.in_flight.pop(job.key, None)
+
+    def forget_old_jobs(self):
+
+        finished = sorted((job for job in self.jobs.values() if job.finished is not None), key=lambda job: job.finished)
+
+        for job in finished[:max(0, len(finished) - self.MAX_FINISHED_JOBS)]:
+
+            del self.jobs[job.id]
+
+            if not job.cached:          # Cached images belong to the cache
+
+                self.discard(job.path)
+
+    def discard(self, path: str):
+
+        if path is not None and os.path.exists(path):
+
+            os.remove(path)
+
+    def stats(self):
+
+        with self.lock:
+
+            states = [job.state for job in self.jobs.values()]
+            stats = {state: states.count(state) for state in (QUEUED, RENDERING, DONE, FAILED)}
+            stats["shared_renders"] = self.shared_renders
+
+            renders = RenderStats()         # Summed over the instrumented renders of the jobs that are still known
+            instrumented = [job.render_stats for job in self.jobs.values() if job.render_stats is not None]
+
+            for render_stats in instrumented:
+
+                renders.merge(render_stats)
+
+            stats["renders"] = dict(renders.as_dict(), count=len(instrumented))
+
+        if self.cache is not None:
+
+            stats["cache"] = self.cache.stats()
+
+        return stats
+
+    # Applies the events the workers send, runs in a background thread for as long as the manager exists
+    def listen(self):
+
+        while True:
+
+            try:
+
+                job_id, kind, value = self.events.get()
+
+            except (EOFError, OSError, TypeError):     # The manager process is gone or shutting down and answered None, so no more events can arrive
+
+                return
+
+            with self.lock:
+
+                job = self.jobs.get(job_id)
+
+                if job is None or job.finished is not None:
+
+                    continue
+
+                if kind == "progress":
+
+                    job.state = RENDERING
+                    job.progress = value
+
+                if kind == "band":
+
+                    job.bands.append(value)
+
+                self.changed.notify_all()
+
+    def shutdown(self):
+
+        self.pool.shutdown(wait=True)
+        self.manager.shutdown()
+
+
+# Runs inside a worker process, the window's image does not travel with the scene so a fresh one is created here. Returns the framebuffer, which is small enough to be sent back
+# as it is, together with the stats of the render if the scene is instrumented. With a record store, scenes that would be traced pixel by pixel anyway, without supersampling and in the python
+# render mode, are rendered incrementally by their workers and their record is stored for the next edit. Every other scene keeps its render mode
+def render_job(job_id: str, scene, events, records = None, save: bool = False):
+
+    scene.window.clear()
+    events.put((job_id, "progress", 0))
+
+    done = False
+
+    # The scene only updates its progress attribute, so a thread of this process passes it on while the render runs
+    def report_progress():
+
+        while not done:
+
+            events.put((job_id, "progress", min(scene.progress, 99)))
+            time.sleep(0.25)
+
+    reporter = Thread(target=report_progress, daemon=True)
+    reporter.start()
+
+    scene.on_band = lambda start, rows: events.put((job_id, "band", (start, encode_band(rows))))
+
+    try:
+
+        if records is not None and incremental.applies_to(scene):
+
+            record, _ = incremental.render(scene, scene.window.framebuffer, records.load(scene))
+
+            records.save(scene, record)
+
+            if save:
+
+                scene.window.framebuffer.save(f"static/{scene.window.name}.png")
+
+        else:
+
+            scene.blit_image(save)
+
+    finally:
+
+        done = True
+        reporter.join()
+
+    return scene.window.framebuffer, scene.stats.as_dict() if scene.instrument else None
+
+
+# A band of rows as a base64 encoded PNG, which is far smaller than the raw colors and can be drawn by the browser directly
+def encode_band(rows: list):
+
+    band = Image.new("RGB", (len(rows[0]), len(rows)))
+    band.putdata([color for row in rows for color in row])
+
+    data = io.BytesIO()
+    band.save(data, "PNG")
+
+    return base64.b64encode(data.getvalue()).decode()
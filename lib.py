@@ -1,10 +1,15 @@
-from PIL import Image
-import os
-from math import sqrt
-
-# Vector class defines basic vector properties and operations
+import random
+import time
+from math import ceil, sqrt
+from itertools import islice
+from framebuffer import Framebuffer, MappedFramebuffer
+from lights import LightSet
+
+# Vector class defines basic vector properties and operations. The renderer creates millions of them, so the coordinates live in slots instead of a per instance dictionary
 class Vector:
 
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, x, y, z):
         self.x = x
         self.y = y
@@ -17,47 +22,28 @@ class Vector:
 
         return Vector(self.x - other.x, self.y - other.y, self.z - other.z)
     
+    # A vector may merely be divided by or multiplied with a scalar, anything else raises a TypeError from the arithmetic itself
     def __truediv__(self, other):
 
-        try:
-
-            new_x = self.x / other
-            new_y = self.y / other
-            new_z = self.z / other
-
-            return Vector(new_x, new_y, new_z)
-        
-        except:
-
-            raise ValueError(f"A vector may merely be divided by a scalar, so dividing with {other} does not work")
+        return Vector(self.x / other, self.y / other, self.z / other)
 
     def __mul__(self, other):
 
-        try:
-
-            new_x = self.x * other
-            new_y = self.y * other
-            new_z = self.z * other
-
-            return Vector(new_x, new_y, new_z)
-
-        except:
-
-            raise ValueError(f"A vector may merely be multiplied with a scalar")
+        return Vector(self.x * other, self.y * other, self.z * other)
 
     def magnitude(self):
 
-        return sqrt(self.x ** 2 + self.y ** 2 + self.z ** 2)
+        return sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
 
     def normalize(self):
 
-        magnitude = sqrt(self.x ** 2 + self.y ** 2 + self.z ** 2)
+        magnitude = sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
 
-        return self / magnitude
+        return Vector(self.x / magnitude, self.y / magnitude, self.z / magnitude)
     
     def dot_product(self, other):
 
-        return self. x * other.x + self.y * other.y + self.z * other.z
+        return self.x * other.x + self.y * other.y + self.z * other.z
     
     def as_tuple(self, rounded: bool):
 
@@ -71,14 +57,32 @@ class Vector:
 
         return Vector(self.y * other.z - self.z * other.y, self.z * other.x - self.x * other.z, self.x * other.y - self.y * other.x)
 
+    # The fused helpers below do the work of two operations without creating the vector in between, they are meant for the hot paths of Scene
+
+    # self + direction * t, the point at distance t along a ray
+    def madd(self, direction, t):
+
+        return Vector(self.x + direction.x * t, self.y + direction.y * t, self.z + direction.z * t)
+
+    # Writes the normalized vector into out instead of creating a new one, out may be the vector itself
+    def normalized_into(self, out):
+
+        magnitude = sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+        out.x = self.x / magnitude
+        out.y = self.y / magnitude
+        out.z = self.z / magnitude
+
+        return out
+
 # Window class determines the FOV and image properties of the raytraced image
 class Window:
 
-    def __init__(self, size_x: int, size_y: int, name: str, color: Vector):
+    def __init__(self, size_x: int, size_y: int, name: str, color: Vector, framebuffer_path: str = None):
 
         self.size_x = size_x                                    # Width of the image
         self.size_y = size_y                                    # Height of the image
-        self.name = name                                        # Image's name to be recorded inside /static
+        self.name = name                                        # Image's name when it is saved inside /static
         self.aspect_ratio = float(self.size_x / self.size_y)    # This is calculated for defining y_min and y_max in the image
         self.color = color                                      # Backrgound color of the image (color of the sky)
 
@@ -90,23 +94,63 @@ class Window:
         self.x_step = (self.right_side - self.left_side) / (self.size_x - 1)    # Calculating how much x and y step it takes to proceed the next pixel
         self.y_step = (self.downside - self.upside) / ((self.size_y - 1))
          
-        files = os.listdir("./static")                          # Opening the /static directory for seeing if an image with the same name is created, if yes, choose that image, else create a new one
+        self.framebuffer_path = framebuffer_path                # With a path the image is a MappedFramebuffer in that file, for images too large for the memory
+        self.clear()                                            # The image, nothing is written to disk until blit_image saves it
 
-        if  name not in files:
+    # The image as a Pillow image, converted from the framebuffer on every access
+    @property
+    def img(self):
 
-            self.filename = name
-            
-            self.img = Image.new("RGB", (size_x, size_y), color.as_tuple(True))
-            self.img.save(f"static/{name}.png")
+        return self.framebuffer.image()
+
+    # Starts over with an image filled with the sky color
+    def clear(self):
+
+        if isinstance(getattr(self, "framebuffer", None), MappedFramebuffer):      # The file is about to be written again
+
+            self.framebuffer.close()
+
+        if self.framebuffer_path is not None:
+
+            self.framebuffer = MappedFramebuffer(self.size_x, self.size_y, self.color.as_tuple(True), self.framebuffer_path)
+
+        else:
+
+            self.framebuffer = Framebuffer(self.size_x, self.size_y, self.color.as_tuple(True))
+
+    # The image stays in the main process when a scene is sent to worker processes, the workers only need the pixel mapping
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state["framebuffer"] = None
+
+        return state
 
 # Rays, that are being sent out from the "camera", is an instance of this class
 class Ray:
 
+    __slots__ = ("origin", "direction")
+
     def __init__(self, origin: Vector, direction: Vector):
 
         self.origin = origin
         self.direction = direction.normalize()
 
+# What the closest hit of a ray is, found once by Scene.closest_object and handed to every step of the shading. The normal is normalized and points to the side of the surface the ray is shaded on.
+# part is the piece of the shape that was hit as the shape's intersect reported it, like the triangle of a mesh, and None for shapes made of one piece
+class HitRecord:
+
+    __slots__ = ("distance", "position", "normal", "shape", "material", "part")
+
+    def __init__(self, distance: float, position: Vector, normal: Vector, shape, material, part = None):
+
+        self.distance = distance
+        self.position = position
+        self.normal = normal
+        self.shape = shape
+        self.material = material
+        self.part = part
+
 # Material is for defining the reflectivity and specular constants of the shapes
 class Material:
 
@@ -115,23 +159,85 @@ class Material:
         self.reflectivity = reflectivity
         self.specular_constant = specular_constant
 
-# A parent class for class Wall and Sphere
+# A parent class for class Wall, Sphere and mesh.Mesh. Besides bounds, signature and compile for the geometry, a shape gives the outward normal at a point of its surface with normal_at, from the part hit
+# and the direction of the ray, which is all the shading needs to know about it.
+# The numpy render modes ask for the normals of many hits at once with normals_at, and the scene format for the fields of the shape with format_fields. kind names the shape in the scene format, in cache keys and in the stats
 class Shape:
 
+    kind = None
+    closed = False      # Closed shapes block the lights behind their own surface, see Scene.visible_lights
+
     def __init__(self, color, material):
 
         self.color = color
         self.material = material
 
+    # A subclass that leaves out one of the methods can not be rendered, compared or saved, which is better said right away than by a missing attribute somewhere in the renderer
+    def unsupported(self, what: str):
+
+        raise TypeError(f"{type(self).__name__} does not support {what}")
+
+    def signature(self):
+
+        self.unsupported("signature")
+
+    def compile(self, index: int):
+
+        self.unsupported("compile")
+
+    def normals_at(self, positions, parts, directions):
+
+        self.unsupported("normals_at, which the numpy render modes need")
+
+    def format_fields(self):
+
+        self.unsupported("format_fields, which the scene format needs")
+
 # Sphere class for defining the spheres, the class inherits the Shape class
 class Sphere(Shape):
 
+    kind = "sphere"
+    closed = True
+
     def __init__(self, center: Vector, radius, color: Vector, material: Material):
 
         super().__init__(color=color, material=material)
         self.center = center
         self.radius = radius
 
+    # The smallest axis aligned box that contains the sphere, used by the bounding volume hierarchy
+    def bounds(self):
+
+        return (self.center.x - self.radius, self.center.y - self.radius, self.center.z - self.radius), (self.center.x + self.radius, self.center.y + self.radius, self.center.z + self.radius)
+
+    # Everything the intersection depends on, a scene compares these to find out if the sphere changed since it was compiled
+    def signature(self):
+
+        return self.center.as_tuple(False), self.radius
+
+    # The radius vector of the hit, normalized
+    def normal_at(self, position: Vector, part = None, direction: Vector = None):
+
+        normal_vector = position - self.center
+        normal_vector.normalized_into(normal_vector)    # The difference is a new vector, so it is normalized in place
+
+        return normal_vector
+
+    # The numpy form of normal_at, for rows of hit positions. A sphere has a single part and is closed, so the directions do not matter
+    def normals_at(self, positions, parts, directions):
+
+        import vectorized
+
+        return vectorized.sphere_normals(self, positions)
+
+    def format_fields(self):
+
+        return {"center": list(self.center.as_tuple(False)), "radius": self.radius}
+
+    def compile(self, index: int):
+
+        return CompiledSphere(index, self)
+
 # Lights are defined via this class,the reason both the color and position is a vector is because vectors' addition rules goes hand in hand with what we want to do on lights' attributes
 class Light:
 
@@ -143,6 +249,8 @@ class Light:
 
 class Wall(Shape): 
 
+    kind = "wall"
+
     # The user defines the corners of the wall, and then the program calculates vectors between these points to take the cross product for finding the normal of the wall to see it as a 3D plane.
     def __init__(self, left_upper_corner: Vector, left_lower_corner: Vector, right_upper_corner: Vector, right_lower_corner: Vector, color: Vector, material: Material):
 
@@ -153,30 +261,479 @@ class Wall(Shape):
         self.right_upper = right_upper_corner
         self.right_lower = right_lower_corner
 
+        self.normal_vector = self.calculate_normal()
+        self.outward_normal = self.facing_normal(self.normal_vector)
+
+    def calculate_normal(self):
+
         vector_1 = self.left_upper - self.left_lower
         vector_2 = self.right_upper - self.left_upper
 
-        self.normal_vector = vector_1.cross_product(vector_2).normalize()
+        return vector_1.cross_product(vector_2).normalize()
+
+    # A wall is shaded on one side only, the side the normal points to once it is turned to have a negative component. That is the side the diffuse term has always lit
+    def facing_normal(self, normal_vector: Vector):
+
+        if normal_vector.x < 0 or normal_vector.y < 0 or normal_vector.z < 0:
+
+            return normal_vector
+
+        return normal_vector * -1
+
+    # The same for every point of the wall, so it is only derived when the corners change
+    def normal_at(self, position: Vector, part = None, direction: Vector = None):
+
+        return self.outward_normal
+
+    def normals_at(self, positions, parts, directions):
+
+        import vectorized
+
+        return vectorized.wall_normals(self, positions)
+
+    def format_fields(self):
+
+        return {"corners": [list(corner.as_tuple(False)) for corner in (self.left_upper, self.left_lower, self.right_upper, self.right_lower)]}
     
     # The calculations later on will be made assuming that the walls are 3D planes, but although the wall and the hit point might be on the same plane they of course do not have to intercept, which this method checks if they do
     def check_hit_point(self, point: Vector):
         
+        lower, upper = self.bounds()
+
+        return (lower[1] <= point.y <= upper[1]) and (lower[0] <= point.x <= upper[0]) and (lower[2] <= point.z <= upper[2])
+
+    # The same box check_hit_point accepts, so every hit point of the wall lies inside of it
+    def bounds(self):
+
         error_margin = 1 / 1000
-        x_min = min(self.left_upper.x, self.right_upper.x, self.left_lower.x, self.right_lower.x)
-        x_max = max(self.left_upper.x, self.right_upper.x, self.left_lower.x, self.right_lower.x)
+        corners = (self.left_upper, self.left_lower, self.right_upper, self.right_lower)
+
+        lower = tuple(min(corner.as_tuple(False)[axis] for corner in corners) - error_margin for axis in range(3))
+        upper = tuple(max(corner.as_tuple(False)[axis] for corner in corners) + error_margin for axis in range(3))
+
+        return lower, upper
+
+    def signature(self):
+
+        return tuple(corner.as_tuple(False) for corner in (self.left_upper, self.left_lower, self.right_upper, self.right_lower))
+
+    # The normal is derived again from the corners, so a wall whose corners were moved gets a fresh normal for the shading as well
+    def compile(self, index: int):
+
+        normal_vector = self.calculate_normal()
+
+        if normal_vector.as_tuple(False) != self.normal_vector.as_tuple(False):
+
+            self.normal_vector = normal_vector
+            self.outward_normal = self.facing_normal(normal_vector)
+
+        return CompiledWall(index, self)
+
+# The compiled forms of the shapes hold everything closest_object needs as plain floats that are derived once per compile instead of once per ray.
+# Each of them carries its own intersect kernel, which returns the distance along the ray together with the part of the shape hit, or None if the ray misses the shape, and intersect_rays, its numpy form for rows of rays.
+# intersect_rays returns the distances, np.inf where a ray misses, together with the part of the shape each ray hits, or None for shapes that only have one part
+
+class CompiledShape:
+
+    __slots__ = ()
+
+    def intersect_rays(self, origins, directions):
+
+        self.shape.unsupported("intersect_rays, which the numpy render modes need")
+
+
+class CompiledSphere(CompiledShape):
+
+    __slots__ = ("index", "shape", "signature", "lower", "upper", "center", "radius_squared")
+
+    def __init__(self, index: int, sphere: Sphere):
+
+        self.index = index                      # Position of the shape in Scene.shapes, used for breaking ties
+        self.shape = sphere
+        self.signature = sphere.signature()
+        self.lower, self.upper = sphere.bounds()
+        self.center = sphere.center.as_tuple(False)
+        self.radius_squared = sphere.radius ** 2
+
+    # A sphere has the equation of x ** 2 + y ** 2 = r, and to calculate a potential intercept we are using the quadratic formula with some other parameters
+    def intersect(self, ray: Ray):
+
+        origin = ray.origin
+        direction = ray.direction
+        center_x, center_y, center_z = self.center
+
+        x = origin.x - center_x
+        y = origin.y - center_y
+        z = origin.z - center_z
+
+        b = 2 * (x * direction.x + y * direction.y + z * direction.z)
+        c = x * x + y * y + z * z - self.radius_squared
+        discriminant = b * b - 4 * c
+
+        if discriminant < 0:
+
+            return None
+
+        distance = (-b - sqrt(discriminant)) / 2
+
+        if distance < 0:
+
+            return None
+
+        return distance, None
+
+    def intersect_rays(self, origins, directions):
+
+        import vectorized
+
+        return vectorized.sphere_distances(self, origins, directions), None
+
+class CompiledWall(CompiledShape):
+
+    __slots__ = ("index", "shape", "signature", "lower", "upper", "normal", "plane_offset")
+
+    def __init__(self, index: int, wall: Wall):
+
+        self.index = index
+        self.shape = wall
+        self.signature = wall.signature()
+        self.lower, self.upper = wall.bounds()      # Already widened by the error margin of check_hit_point
+        self.normal = wall.normal_vector.as_tuple(False)
+        self.plane_offset = wall.right_lower.dot_product(wall.normal_vector)     # Every point p on the wall's plane satisfies p . normal = plane_offset
+
+    # For finding if a point is on a surface or not we can create a vector from a point on the wall to that point and see if that vector is orthogonal to the normal, and then the hit point is checked against the corners
+    def intersect(self, ray: Ray):
+
+        origin = ray.origin
+        direction = ray.direction
+        normal_x, normal_y, normal_z = self.normal
+
+        direction_and_normal = direction.x * normal_x + direction.y * normal_y + direction.z * normal_z
+
+        if direction_and_normal == 0:
+
+            return None
+
+        t = (self.plane_offset - (origin.x * normal_x + origin.y * normal_y + origin.z * normal_z)) / direction_and_normal
+
+        if t < 0:
+
+            return None
+
+        lower = self.lower
+        upper = self.upper
+
+        if not (lower[0] <= origin.x + direction.x * t <= upper[0] and lower[1] <= origin.y + direction.y * t <= upper[1] and lower[2] <= origin.z + direction.z * t <= upper[2]):
+
+            return None
+
+        return t, None
+
+    def intersect_rays(self, origins, directions):
+
+        import vectorized
+
+        return vectorized.wall_distances(self, origins, directions), None
+
+# A node of the bounding volume hierarchy, either a leaf holding a few shapes or an inner node with two children. Both kinds know the box around everything below them
+class BVHNode:
+
+    __slots__ = ("lower", "upper", "shapes", "left", "right", "box")
+
+    def __init__(self, lower, upper, shapes = None, left = None, right = None):
+
+        self.lower = lower
+        self.upper = upper
+        self.shapes = shapes            # Compiled shapes, their index is the position in Scene.shapes and breaks ties the same way the linear search does
+        self.left = left
+        self.right = right
+        self.box = (*lower, *upper)     # Flat copy of the corners for the slab test
+
+    # Slab test, returns the distance where the ray enters the box or None if it misses the box. An inverse direction of None means the ray is parallel to that pair of slabs, so it has to start in between them
+    def entry_distance(self, origin_x, origin_y, origin_z, inverse_x, inverse_y, inverse_z):
+
+        x_min, y_min, z_min, x_max, y_max, z_max = self.box
+        near = 0
+        far = float("inf")
+
+        if inverse_x is None:
+
+            if not x_min <= origin_x <= x_max:
+
+                return None
+
+        else:
+
+            t_1 = (x_min - origin_x) * inverse_x
+            t_2 = (x_max - origin_x) * inverse_x
+
+            near, far = (t_1, t_2) if t_1 < t_2 else (t_2, t_1)
+            near = max(near, 0)
+
+        if inverse_y is None:
+
+            if not y_min <= origin_y <= y_max:
+
+                return None
+
+        else:
+
+            t_1 = (y_min - origin_y) * inverse_y
+            t_2 = (y_max - origin_y) * inverse_y
+
+            if t_1 > t_2:
+
+                t_1, t_2 = t_2, t_1
+
+            near = t_1 if t_1 > near else near
+            far = t_2 if t_2 < far else far
+
+        if inverse_z is None:
+
+            if not z_min <= origin_z <= z_max:
+
+                return None
+
+        else:
+
+            t_1 = (z_min - origin_z) * inverse_z
+            t_2 = (z_max - origin_z) * inverse_z
+
+            if t_1 > t_2:
+
+                t_1, t_2 = t_2, t_1
+
+            near = t_1 if t_1 > near else near
+            far = t_2 if t_2 < far else far
+
+        if near > far:
+
+            return None
+
+        return near
+
+# Bounding volume hierarchy over the compiled shapes of a scene, built once so that a ray only has to be tested against the shapes whose boxes it passes through
+class BVH:
+
+    LEAF_SIZE = 4
+    MIN_SHAPES = 16     # Below this amount testing every shape is faster than walking the hierarchy
+
+    def __init__(self, geometry: list):
+
+        items = [(compiled.index, compiled, (compiled.lower, compiled.upper)) for compiled in geometry]
+
+        self.root = self.build(items) if items else None
+
+    # Splits the shapes at the median of their box centers along the longest axis until only a few shapes remain in each node
+    def build(self, items: list):
+
+        lower = tuple(min(bounds[0][axis] for _, _, bounds in items) for axis in range(3))
+        upper = tuple(max(bounds[1][axis] for _, _, bounds in items) for axis in range(3))
+
+        if len(items) <= self.LEAF_SIZE:
+
+            return BVHNode(lower, upper, shapes=[compiled for _, compiled, _ in items])
+
+        centers = [[(bounds[0][axis] + bounds[1][axis]) / 2 for axis in range(3)] for _, _, bounds in items]
+        extents = [max(center[axis] for center in centers) - min(center[axis] for center in centers) for axis in range(3)]
+        axis = extents.index(max(extents))
+
+        items = [item for _, item in sorted(zip(centers, items), key=lambda pair: (pair[0][axis], pair[1][0]))]
+        middle = len(items) // 2
+
+        return BVHNode(lower, upper, left=self.build(items[:middle]), right=self.build(items[middle:]))
+
+    # Finds the closest shape along the ray and returns its distance, the shape and the part of it hit. Each compiled shape brings its own intersect kernel so that the hierarchy does not need to know about the shape types
+    def closest(self, ray: Ray):
+
+        min_distance = -1
+        min_shape = None
+        min_index = None
+        min_part = None
+
+        if self.root is None:
+
+            return min_distance, min_shape, min_part
+
+        origin = ray.origin.as_tuple(False)
+        direction = ray.direction
+        slab = (*origin, 1 / direction.x if direction.x != 0 else None, 1 / direction.y if direction.y != 0 else None, 1 / direction.z if direction.z != 0 else None)
+        stack = [(self.root, 0 if self.root.shapes is not None else self.root.entry_distance(*slab))]     # A root that is a leaf is searched directly, its box would not rule anything out
+
+        while stack:
+
+            node, entry = stack.pop()
+
+            if entry is None or (min_shape is not None and entry > min_distance):   # Nothing inside of this box can be closer than what is already found
+
+                continue
+
+            if node.shapes is not None:
+
+                for compiled in node.shapes:
+
+                    hit = compiled.intersect(ray)
+
+                    if hit is None:
+
+                        continue
+
+                    distance = hit[0]
+
+                    if min_shape is None or distance < min_distance or (distance == min_distance and compiled.index < min_index):
+
+                        min_distance = distance
+                        min_shape = compiled.shape
+                        min_index = compiled.index
+                        min_part = hit[1]
+
+                continue
+
+            left_entry = node.left.entry_distance(*slab)
+            right_entry = node.right.entry_distance(*slab)
+
+            if left_entry is None or (right_entry is not None and right_entry < left_entry):    # The nearer child is pushed last so that it is searched first
+
+                stack.append((node.left, left_entry))
+                stack.append((node.right, right_entry))
+
+            else:
+
+                stack.append((node.right, right_entry))
+                stack.append((node.left, left_entry))
+
+        return min_distance, min_shape, min_part
+
+    # Returns the first compiled shape found in front of max_distance along the ray, or None. Unlike closest it stops at the first hit and does not care about the order of the children
+    def any_hit(self, ray: Ray, max_distance: float):
+
+        if self.root is None:
+
+            return None
+
+        origin = ray.origin.as_tuple(False)
+        direction = ray.direction
+        slab = (*origin, 1 / direction.x if direction.x != 0 else None, 1 / direction.y if direction.y != 0 else None, 1 / direction.z if direction.z != 0 else None)
+        stack = [self.root]
+
+        while stack:
+
+            node = stack.pop()
+
+            if node.shapes is not None:
+
+                for compiled in node.shapes:
+
+                    hit = compiled.intersect(ray)
+
+                    if hit is not None and hit[0] < max_distance:
+
+                        return compiled
+
+                continue
+
+            for child in (node.left, node.right):
+
+                entry = child.entry_distance(*slab)
+
+                if entry is not None and entry < max_distance:
+
+                    stack.append(child)
+
+        return None
+
+# The pixels between the smallest and largest of the screen coordinates, one more on each side against rounding
+def pixel_range(coordinates: list, size: int):
+
+    return range(max(int(min(coordinates)) - 1, 0), min(int(max(coordinates)) + 2, size))
+
+# The columns and rows of the pixels whose primary rays can reach the box from lower to upper. The corners of the box are projected through the camera onto the screen at z = 0,
+# which is where Scene.sample_pixel aims its primary rays. A box that reaches level with or behind the camera could show up anywhere, so all pixels are returned for it
+def screen_rectangle(window: Window, camera: Vector, lower, upper):
+
+    columns, rows = range(window.size_x), range(window.size_y)
+    corners = [(x, y, z) for x in (lower[0], upper[0]) for y in (lower[1], upper[1]) for z in (lower[2], upper[2])]
+
+    if camera.z < 0 and all(z > camera.z for _, _, z in corners):
+
+        screen = [(camera.x + (x - camera.x) * -camera.z / (z - camera.z), camera.y + (y - camera.y) * -camera.z / (z - camera.z)) for x, y, z in corners]
+        columns = pixel_range([(x - window.left_side) / window.x_step for x, _ in screen], window.size_x)
+        rows = pixel_range([(y - window.upside) / window.y_step for _, y in screen], window.size_y)
+
+    return columns, rows
+
+# Screen-space bins of the compiled shapes for primary rays. Every shape is listed in the tiles its projected box overlaps, so the primary ray of a pixel is only tested against the shapes
+# of its tile. Reflected rays can go anywhere and keep searching all shapes
+class TileBins:
+
+    def __init__(self, geometry: list, window: Window, camera: Vector, tile_size: int):
+
+        self.tile_size = tile_size
+        self.view = (window.size_x, window.size_y, camera.as_tuple(False))     # What the bins were projected with, see matches
+        self.columns = ceil(window.size_x / tile_size)
+        self.rows = ceil(window.size_y / tile_size)
+        self.tiles = [[] for _ in range(self.columns * self.rows)]
+        self.shapes = len(geometry)
+
+        for compiled in geometry:           # In the order of the shapes, so a tile breaks ties like the search over every shape does
 
-        y_min = min(self.left_upper.y, self.left_lower.y, self.right_upper.y, self.right_lower.y)
-        y_max = max(self.left_upper.y, self.left_lower.y, self.right_upper.y, self.right_lower.y)
+            columns, rows = screen_rectangle(window, camera, compiled.lower, compiled.upper)
 
-        z_min = min(self.left_upper.z, self.left_lower.z, self.right_upper.z, self.right_lower.z)
-        z_max = max(self.left_upper.z, self.left_lower.z, self.right_upper.z, self.right_lower.z)
+            if not columns or not rows:     # Off the screen
 
-        return (y_min - error_margin <= point.y <= y_max + error_margin) and (x_min - error_margin <= point.x <= x_max + error_margin) and (z_min - error_margin <= point.z <= z_max + error_margin)
+                continue
+
+            for row in range(rows.start // tile_size, (rows.stop - 1) // tile_size + 1):
+
+                for column in range(columns.start // tile_size, (columns.stop - 1) // tile_size + 1):
+
+                    self.tiles[row * self.columns + column].append(compiled)
+
+    # Bins only stay valid while the camera and the size of the image are the ones they were projected with, the shapes are checked by Scene.compile_if_changed
+    def matches(self, window: Window, camera: Vector):
+
+        return self.view == (window.size_x, window.size_y, camera.as_tuple(False))
+
+    # The compiled shapes a primary ray through the point j, i of the screen in pixel units can hit. Jittered samples lie less than half a pixel away from their pixel, so int keeps them in the image
+    # and the margin of pixel_range covers them
+    def candidates(self, j: float, i: float):
+
+        return self.tiles[int(i) // self.tile_size * self.columns + int(j) // self.tile_size]
+
+    # How much of the work of the primary rays the bins save: the shapes per tile, and the share of the intersection tests of one primary ray per pixel that are skipped
+    def stats(self, window: Window):
+
+        tests = 0
+
+        for index, tile in enumerate(self.tiles):
+
+            row, column = divmod(index, self.columns)
+            pixels = (min(self.tile_size, window.size_x - column * self.tile_size)) * (min(self.tile_size, window.size_y - row * self.tile_size))
+            tests += pixels * len(tile)
+
+        all_tests = window.size_x * window.size_y * self.shapes
+
+        return {
+            "tile_size": self.tile_size,
+            "tiles": len(self.tiles),
+            "shapes": self.shapes,
+            "empty_tiles": sum(1 for tile in self.tiles if not tile),
+            "mean_shapes_per_tile": sum(len(tile) for tile in self.tiles) / len(self.tiles),
+            "max_shapes_per_tile": max(len(tile) for tile in self.tiles),
+            "culled_ratio": 1 - tests / all_tests if all_tests else 0,
+        }
 
 # The class where all the objects, lights and the window is assembled for rendering the wished raytraced image
 class Scene:
 
-    def __init__(self, window: Window, shapes: list, camera: Vector, lights: list, max_depth):
+    BAND_HEIGHT = 16                        # Rows that are traced and handed to on_band together in the serial render
+    MAX_BAND_PIXELS = 1 << 16               # Bands of very wide images have fewer rows, so that the colors of a band in flight take a few megabytes no matter the size of the image
+    RENDER_MODES = ("python", "numpy", "progressive", "deferred")
+    PREVIEW_SPACINGS = (8, 4, 2, 1)         # Pixel spacing of the passes of the progressive render, every spacing has to be half of the one before
+    SAMPLE_BATCH = 4                        # Extra samples added to an edge pixel at a time before its variance is checked again
+    SHADOW_AMBIENT = 0.2                    # Share of the diffuse color a point keeps when every light is blocked
+
+    def __init__(self, window: Window, shapes: list, camera: Vector, lights: list, max_depth, render_mode = "python", workers = 1, use_bvh = None, min_throughput = 0.01, max_samples = 1, sample_threshold = 8, seed = 0, shadows = False, instrument = False, tile_size = 32, light_threshold = 0.5, use_light_tree = None):
 
         self.window = window
         self.shapes = shapes
@@ -184,190 +741,617 @@ class Scene:
         self.lights = lights
         self.progress = 0                   # In order to let the user know about the rendering progress this attribute keeps having a look over the process
         self.MAX_DEPTH = max_depth          # Determines the maximum amount of light bouncings to occur
+        self.min_throughput = min_throughput    # A reflected ray is only traced while the product of the reflectivities along its path stays above this value
+        self.render_mode = render_mode      # "python" traces the pixels one by one, "numpy" traces the whole frame at once in vectorized.py, "progressive" traces a coarse preview first and refines it, "deferred" shades the hits kept by the last render again if only lights and materials changed
+        self.workers = workers              # With more than one worker the python render mode splits the image into bands of rows and traces them in a process pool
+        self.use_bvh = use_bvh              # None builds the hierarchy only for scenes large enough to profit from it
+        self.on_band = None                 # Optional function called with the first row and the colors of every finished band of rows
+        self.max_samples = max_samples      # Cap of the samples per pixel of the adaptive anti-aliasing, 1 turns it off
+        self.sample_threshold = sample_threshold    # Color difference between neighbouring pixels, and standard deviation between the samples of a pixel, above which more samples are taken
+        self.seed = seed                    # Seed of the jitter, so that the same scene always gets the same samples
+        self.rays_per_pixel = 1             # Primary rays cast per pixel by the last render
+        self.shadows = shadows              # Whether lights blocked by a shape are left out when shading a hit
+        self.shadow_rays = 0                # Shadow rays cast by the last render
+        self.last_occluders = {}            # Light index -> compiled shape that blocked the light last time, tested first since neighbouring pixels tend to be blocked by the same shape
+        self.instrument = instrument        # Whether renders collect counters and timings into stats, see instrumentation.py
+        self.stats = None                   # RenderStats of the last instrumented render
+        self.gbuffer = None                 # Hits of every bounce kept by the deferred render mode, see deferred.py
+        self.tile_size = tile_size          # Pixels along the side of a tile of the screen-space bins of primary rays, 0 turns the bins off
+        self.primary_position = None        # Screen position of the primary ray sample_pixel is casting, the next closest object query uses its tile
+        self.light_threshold = light_threshold  # How much a color channel of a pixel may change at most by leaving out highlights too faint to see, 0 only leaves out the ones that provably add nothing
+        self.use_light_tree = use_light_tree    # None builds the light hierarchy only for scenes with many lights, see lights.py
 
-    # Saves the changed pixels of the image object
-    def blit_image(self):
-        
-        pixels = self.window.img.load()
+        self.compile()
 
-        self.ray_trace_sphere(self.shapes, pixels)
-    
-        self.window.img.save(f"static/{self.window.name}.png")
+        if render_mode not in self.RENDER_MODES:
+
+            raise ValueError(f"Unknown render mode {render_mode}, choose one of {', '.join(self.RENDER_MODES)}")
+
+    # Freezes the shapes into the geometry table closest_object works with, together with the bounding volume hierarchy over it. Has to be called again after shapes are changed, which happens on its own before every render, see compile_if_changed
+    def compile(self):
+
+        self.geometry = [self.compile_shape(shape, index) for index, shape in enumerate(self.shapes)]
+        use_bvh = len(self.geometry) > BVH.MIN_SHAPES if self.use_bvh is None else self.use_bvh
+        self.bvh = BVH(self.geometry) if use_bvh else None     # Used for every primary and reflected ray in closest_object
+        self.compiled_shapes = list(self.shapes)
+        self.last_occluders = {}            # The cached occluders belong to the old geometry
+
+        self.compile_tiles()
+        self.compile_lights()
+
+    # Bins the geometry for the primary rays of the current camera, again whenever the camera or the size of the image changes. The numpy and deferred render modes trace their primary rays
+    # without them, so they get none
+    def compile_tiles(self):
+
+        self.tiles = TileBins(self.geometry, self.window, self.camera, self.tile_size) if self.uses_tiles() else None      # Used for primary rays instead of the hierarchy when their tile has few shapes
+
+    def uses_tiles(self):
+
+        return bool(self.tile_size) and self.render_mode not in ("numpy", "deferred")
+
+    def tiles_match(self):
+
+        if not self.uses_tiles():
+
+            return self.tiles is None
+
+        return self.tiles is not None and self.tiles.tile_size == self.tile_size and self.tiles.matches(self.window, self.camera)
+
+    # Prepares the lights for shading, again whenever a light is moved or recolored
+    def compile_lights(self):
+
+        self.light_set = LightSet(self.lights, self.use_light_tree)
+
+    def compile_shape(self, shape: Shape, index: int):
+
+        return shape.compile(index)
+
+    # Called before every render. Compares every shape of this scene with its compiled form, which notices attributes that were assigned again as well as changes made inside of a shape's vectors.
+    # Nothing is checked per ray, and edits to the shapes of another scene never make this one compile again. A moved camera or moved lights only rebuild the bins or the lights, so the frames
+    # of an animation keep the geometry and its hierarchy
+    def compile_if_changed(self):
+
+        changed = len(self.shapes) != len(self.compiled_shapes) or any(shape is not compiled.shape or shape.signature() != compiled.signature for shape, compiled in zip(self.shapes, self.geometry))
+
+        if changed:
+
+            self.compile()
+            return changed
+
+        if not self.tiles_match():
+
+            self.compile_tiles()
+
+        if not self.light_set.matches(self.lights):
+
+            self.compile_lights()
+
+        return changed
+
+    # Worker processes get the scene without on_band, the bands are handed to it in the process that blits them. Methods replaced by the instrumentation are left out as well, workers attach their own
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state["on_band"] = None
+        state["gbuffer"] = None             # Far larger than the scene itself and rebuilt on the first deferred render
+
+        for name in [name for name in state if callable(getattr(type(self), name, None))]:
+
+            del state[name]
+
+        return state
+
+    # Renders the scene into the window's framebuffer. With save the image is written to directory as well, ./static unless the caller picks another one, named after the window
+    def blit_image(self, save: bool = True, directory: str = "static"):
+
+        self.ray_trace_sphere(self.shapes, self.window.framebuffer)
+
+        if save:
+
+            start = time.perf_counter()
+            self.window.framebuffer.save(f"{directory}/{self.window.name}.png")
+
+            if self.instrument:
+
+                self.stats.image_write_seconds += time.perf_counter() - start
 
     # Goes through every single pixel by also matching it with their coordinates
     def ray_trace_sphere(self, shapes: list, pixels):
         
         self.progress = 0
-        screen_size = self.window.size_y * self.window.size_x
+        self.shadow_rays = 0
+        self.last_occluders = {}
+        render_start = time.perf_counter()
+
+        if self.instrument:
+
+            import instrumentation
+
+            instrumentation.attach(self)
+
+        self.compile_if_changed()
+
+        if self.render_mode == "numpy":
 
-        for i in range(self.window.size_y):
+            self.ray_trace_numpy(pixels)
 
-            y = self.window.upside + self.window.y_step * i
+        elif self.render_mode == "deferred":
 
-            for j in range(self.window.size_x):
-                
-                x = self.window.left_side + self.window.x_step * j
+            self.ray_trace_deferred(pixels)
 
-                ray = Ray(self.camera, Vector(x, y, 0) - self.camera)
+        elif self.render_mode == "progressive":
 
-                color = self.ray_bounce(ray, shapes, 0) 
+            self.ray_trace_progressive(shapes, pixels)
 
-                pixels[j, i] = color.as_tuple(True)
-                
-                self.progress = 100 * (i  * self.window.size_x + j) // screen_size
+        elif self.workers > 1:
+
+            self.ray_trace_parallel(pixels)
+
+        else:
+
+            band_height = self.band_height(self.BAND_HEIGHT)
+
+            for start in range(0, self.window.size_y, band_height):
+
+                end = min(start + band_height, self.window.size_y)
+
+                self.blit_rows(pixels, start, self.trace_rows(shapes, start, end))
+
+                self.progress = 100 * end // self.window.size_y
                 #print(f"{self.window.name}: {self.progress}", end="%\r")
 
+        screen_size = self.window.size_x * self.window.size_y
+        extra_samples = self.antialias(shapes, pixels) if self.max_samples > 1 else 0
+
+        self.rays_per_pixel = (screen_size + extra_samples) / screen_size
         self.progress = 100
+
+        if self.instrument:
+
+            self.stats.shadow_rays = self.shadow_rays
+            self.stats.render_seconds = time.perf_counter() - render_start
+
+    # The given rows per band, fewer if a band would have more than MAX_BAND_PIXELS pixels
+    def band_height(self, rows: int):
+
+        return max(1, min(rows, self.MAX_BAND_PIXELS // self.window.size_x))
+
+    # Writes finished rows into the pixels and hands them to on_band, which is how finished parts of the image can be shown before the whole render is done
+    def blit_rows(self, pixels, start: int, rows: list):
+
+        if isinstance(pixels, Framebuffer):
+
+            pixels.write_rows(start, rows)
+
+        else:
+
+            for i, row in enumerate(rows, start):
+
+                for j in range(self.window.size_x):
+
+                    pixels[j, i] = row[j]
+
+        if self.on_band is not None:
+
+            self.on_band(start, rows)
+
+    # Traces the rows from start up to (but not including) end and returns the pixel colors of each row, this is the unit of work both the serial and the parallel render share
+    def trace_rows(self, shapes: list, start: int, end: int):
+
+        return [[self.trace_pixel(shapes, j, i) for j in range(self.window.size_x)] for i in range(start, end)]
+
+    # Casts the ray from the camera through the pixel in column j and row i and returns the pixel's color
+    def trace_pixel(self, shapes: list, j: int, i: int):
+
+        return self.sample_pixel(shapes, j, i).as_tuple(True)
+
+    # Same as trace_pixel but for any point of the screen given in pixel units, the unrounded color is returned so that samples can be averaged
+    def sample_pixel(self, shapes: list, j: float, i: float):
+
+        x = self.window.left_side + self.window.x_step * j
+        y = self.window.upside + self.window.y_step * i
+
+        ray = Ray(self.camera, Vector(x - self.camera.x, y - self.camera.y, -self.camera.z))
+        self.primary_position = (j, i)
+
+        return self.ray_bounce(ray, shapes, 0)
+
+    # Adaptive supersampling on top of a finished render with one sample per pixel. Pixels that differ from a neighbour by more than sample_threshold get SAMPLE_BATCH jittered samples at a time
+    # until their samples agree or max_samples is reached, so only edges pay for the extra rays. The samples are stratified over a grid inside of the pixel. Returns the amount of extra samples
+    def antialias(self, shapes: list, pixels):
+
+        width, height = self.window.size_x, self.window.size_y
+        generator = random.Random(self.seed)
+        grid = ceil(sqrt(self.max_samples))
+        extra_samples = 0
+        changed_rows = set()
+        following = [pixels[j, 0] for j in range(width)]
+        marked_below = set()            # Columns of the next row that differ from the pixel above them
+
+        for i in range(height):         # Only the colors of the row and the one below it are kept, each row is read before the row above it is changed
+
+            colors, following = following, [pixels[j, i + 1] for j in range(width)] if i + 1 < height else None
+            edges, marked_below = marked_below, set()
+
+            for j in range(width):
+
+                if j + 1 < width and self.is_edge(colors[j], colors[j + 1]):
+
+                    edges.update((j, j + 1))
+
+                if following is not None and self.is_edge(colors[j], following[j]):
+
+                    edges.add(j)
+                    marked_below.add(j)
+
+            for j in sorted(edges):
+
+                samples = [Vector(*colors[j])]
+
+                while len(samples) < self.max_samples:
+
+                    for stratum in range(len(samples), min(len(samples) + self.SAMPLE_BATCH, self.max_samples)):
+
+                        offset_j = (stratum % grid + generator.random()) / grid - 0.5
+                        offset_i = (stratum // grid % grid + generator.random()) / grid - 0.5
+
+                        color = self.sample_pixel(shapes, j + offset_j, i + offset_i)
+
+                        samples.append(Vector(*(min(max(component, 0), 255) for component in color.as_tuple(False))))    # Clipped like the image clips them, so that an overexposed sample does not outweigh the others
+
+                    if self.sample_deviation(samples) <= self.sample_threshold:
+
+                        break
+
+                extra_samples += len(samples) - 1
+                color = (sum(samples, Vector(0, 0, 0)) / len(samples)).as_tuple(True)
+
+                if color != colors[j]:
+
+                    pixels[j, i] = color
+                    changed_rows.add(i)
+
+        if self.on_band is not None:
+
+            for start in sorted({i - i % self.BAND_HEIGHT for i in changed_rows}):
+
+                self.on_band(start, [[pixels[j, i] for j in range(width)] for i in range(start, min(start + self.BAND_HEIGHT, height))])
+
+        return extra_samples
+
+    # Whether two neighbouring pixels differ by more than the sample threshold in any channel
+    def is_edge(self, color: tuple, other: tuple):
+
+        return max(abs(a - b) for a, b in zip(color, other)) > self.sample_threshold
+
+    # The largest standard deviation of a color channel over the samples
+    def sample_deviation(self, samples: list):
+
+        mean = sum(samples, Vector(0, 0, 0)) / len(samples)
+
+        return sqrt(max(sum((getattr(sample, axis) - getattr(mean, axis)) ** 2 for sample in samples) / len(samples) for axis in "xyz"))
+
+    # Traces every PREVIEW_SPACINGS[0]th pixel first and paints it as a block, then halves the spacing pass by pass. A pass only traces the pixels the coarser passes skipped,
+    # so every pixel is traced exactly once and the last pass leaves the same image as the serial render. After every pass the whole image is handed to on_band as a preview
+    def ray_trace_progressive(self, shapes: list, pixels):
+
+        traced = 0
+        screen_size = self.window.size_x * self.window.size_y
+        coarser = None
+
+        for spacing in self.PREVIEW_SPACINGS:
+
+            for i in range(0, self.window.size_y, spacing):
+
+                for j in range(0, self.window.size_x, spacing):
+
+                    if coarser is not None and i % coarser == 0 and j % coarser == 0:    # Already traced in an earlier pass
+
+                        continue
+
+                    color = self.trace_pixel(shapes, j, i)
+
+                    for block_i in range(i, min(i + spacing, self.window.size_y)):
+
+                        for block_j in range(j, min(j + spacing, self.window.size_x)):
+
+                            pixels[block_j, block_i] = color
+
+                    traced += 1
+
+                self.progress = 100 * traced // screen_size
+
+            coarser = spacing
+
+            if self.on_band is not None:
+
+                for start in range(0, self.window.size_y, self.BAND_HEIGHT):
+
+                    self.on_band(start, [[pixels[j, i] for j in range(self.window.size_x)] for i in range(start, min(start + self.BAND_HEIGHT, self.window.size_y))])
+
+        self.progress = 100
+
+    # Splits the image into bands of rows and lets a process pool trace them, each band is blitted as soon as it arrives so the progress keeps moving
+    def ray_trace_parallel(self, pixels, band_height = None):
+
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED     # Imported here since it takes longer than the rest of the module, and serial renders never need it
+
+        if band_height is None:
+
+            band_height = self.band_height(max(1, self.window.size_y // (self.workers * 8)))     # Several bands per worker so that a slow band does not keep the other workers idle
+
+        bands = ((start, min(start + band_height, self.window.size_y)) for start in range(0, self.window.size_y, band_height))
+        finished_rows = 0
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self,)) as pool:
+
+            running = {pool.submit(_trace_band, start, end) for start, end in islice(bands, 2 * self.workers)}     # Only a few bands are handed out ahead, so finished bands never pile up in memory
+
+            while running:
+
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+
+                    start, rows, shadow_rays, stats = future.result()
+
+                    self.blit_rows(pixels, start, rows)
+
+                    self.shadow_rays += shadow_rays
+
+                    if stats is not None:
+
+                        self.stats.merge(stats)
+
+                    finished_rows += len(rows)
+                    self.progress = 100 * finished_rows // self.window.size_y
+
+                running |= {pool.submit(_trace_band, start, end) for start, end in islice(bands, len(done))}
+
+        self.progress = 100
+
+    # Traces the whole frame with numpy arrays and copies the result into the pixels, numpy is only imported when this mode is used
+    def ray_trace_numpy(self, pixels):
+
+        import vectorized
+
+        self.blit_array(pixels, vectorized.render(self))
+
+    def ray_trace_deferred(self, pixels):
+
+        import deferred
+
+        self.blit_array(pixels, deferred.render(self))
+
+    # Writes an image given as a numpy array of rows of RGB values into the pixels, band by band
+    def blit_array(self, pixels, image):
+
+        for start in range(0, self.window.size_y, self.BAND_HEIGHT):
+
+            self.blit_rows(pixels, start, [[tuple(color) for color in row] for row in image[start:start + self.BAND_HEIGHT].tolist()])
     
-    # Recursively applying shading and reflection by calculating where the light will end up and what color the objects in the path of the light has
+    # Applies shading and reflection by following the ray from hit to hit and calculating what color the objects in the path of the light have. Every hit is shaded with all lights once and only a single reflected ray continues, weighted by the reflectivity of the material it bounced off
     def ray_bounce(self, ray: Ray, shapes: list, amount_of_calls: int):
-        
-        if amount_of_calls == self.MAX_DEPTH:               # Break if maximum amount of bounces is made
 
-            return self.window.color
-        
-        hit_position, shape = self.closest_object(ray, shapes)  # Check first closest object to avoid choosing another object that the light hits after another
-        
-        if hit_position is None:
-
-            return self.window.color                            # Return the background/sky color if there is no object that the light hit
-        
-        for light in self.lights:                               # To include the colors of the all lights present in the environment
+        color = Vector(0, 0, 0)
+        throughput = 1                                          # How much the next hit still contributes to the pixel after all the reflections so far
+        budget = self.light_threshold                           # How much the highlights left out along the path may still change the pixel
 
-            color_diffused = self.diffuse(shape, ray, hit_position, shape.color)            # Diffuse and shade colors
-            color_specular_shaded = self.specular_shade(shape, ray, light, hit_position)
+        for _ in range(amount_of_calls, self.MAX_DEPTH):
 
-            color = color_diffused + color_specular_shaded
+            hit = self.closest_object(ray, shapes)              # Check first closest object to avoid choosing another object that the light hits after another
             
-            if isinstance(shape, Sphere):               # Normal ray calculation differs, because a normal ray for a sphere is its radius vector while for wall it is the cross product of two present vectors on the wall
+            if hit is None:
 
-                normal_ray = hit_position - shape.center
+                return color + self.window.color * throughput       # Add the background/sky color if there is no object that the light hit
             
-            elif isinstance(shape, Wall):
+            lights = self.visible_lights(hit) if self.shadows else self.lights
+            local_color = self.diffuse(hit, ray)                    # Diffuse and shade colors
 
-                normal_ray = shape.normal_vector
+            if len(lights) < len(self.lights):                      # The point is in the shadow of some of the lights
 
-            normal_ray = normal_ray.normalize()
-            reflected_ray = Ray(hit_position + normal_ray * 1 / 1000 , self.reflect_ray(normal_ray, ray.direction).normalize()) # Reflect ray by using reflection law
-            
-            color += self.ray_bounce(reflected_ray, shapes, amount_of_calls + 1) # Recursion till the end
+                local_color *= self.SHADOW_AMBIENT + (1 - self.SHADOW_AMBIENT) * len(lights) / len(self.lights)
+
+            skipped = self.shade_lights(hit, local_color, lights, budget / throughput if throughput > 0 else float("inf"))     # To include the colors of the all lights present in the environment
+            budget -= skipped * throughput
+
+            color += local_color * throughput
+            throughput *= hit.material.reflectivity
+
+            if throughput < self.min_throughput:                    # The rest of the path could not change the pixel noticeably anymore, matte surfaces stop right away
+
+                return color
+
+            ray = Ray(hit.position.madd(hit.normal, 1 / 1000), self.reflect_ray(hit.normal, ray.direction))    # Reflect ray by using reflection law, moved off the surface to the side the ray came from. Ray normalizes the direction
      
-        return color
+        return color + self.window.color * throughput           # The sky color is used once the maximum amount of bounces is made
     
 
+    # Returns the HitRecord of the closest shape along the ray, or None if the ray misses everything. The first query after sample_pixel is the primary ray, which only has to search the shapes binned into its tile
     def closest_object(self, ray: Ray, shapes: list):
-        
-        min_distance = -1
-        min_shape = None
-        hit_position = None
 
-        for shape in shapes:
+        candidates = None
+
+        if shapes is self.shapes:
+
+            geometry = self.geometry                # Compiled before the render, see compile_if_changed
+
+            if self.primary_position is not None and self.tiles is not None:
+
+                candidates = self.tiles.candidates(*self.primary_position)
+
+        else:
+
+            geometry = [shape.compile(index) for index, shape in enumerate(shapes)]    # Any other list is compiled on the spot and searched one by one
+
+        self.primary_position = None
+
+        if candidates is not None and (self.bvh is None or len(candidates) <= BVH.MIN_SHAPES):
+
+            min_distance, min_shape, part = self.closest_object_linear(ray, candidates)
 
-            if isinstance(shape, Sphere): # A sphere has the equation of x ** 2 + y ** 2 = r, and to calculate a potential intercept we are using the quadratic formula with some other parameters
+        elif self.bvh is not None and geometry is self.geometry:
+
+            min_distance, min_shape, part = self.bvh.closest(ray)
+
+        else:
+
+            min_distance, min_shape, part = self.closest_object_linear(ray, geometry)
+
+        if min_shape is None:  # Checks if there is a shape hit or not
+
+            return None
+
+        hit_position = ray.origin.madd(ray.direction, min_distance)
+
+        return HitRecord(min_distance, hit_position, min_shape.normal_at(hit_position, part, ray.direction), min_shape, min_shape.material, part)
+
+    # The lights that reach the hit position, found with one shadow ray per light. A closed shape blocks the lights behind its own surface without any ray being cast
+    def visible_lights(self, hit: HitRecord):
+
+        lights = []
+        hit_position = hit.position
+
+        for light_index, light in enumerate(self.lights):
+
+            to_light = light.position - hit_position
+
+            if hit.shape.closed and hit.normal.dot_product(to_light) < 0:
+
+                continue
 
-                sphere_to_ray = ray.origin - shape.center
-                b = 2 * ray.direction.dot_product(sphere_to_ray)
-                c = sphere_to_ray.dot_product(sphere_to_ray) - shape.radius ** 2
-                discriminant = b ** 2 - 4 * c
+            distance = to_light.magnitude()
+            ray = Ray(hit_position.madd(to_light, 1 / 1000 / distance), to_light)     # Moved off the surface so that the shape does not block its own light
 
-                if discriminant < 0:
+            if not self.occluded(ray, distance - 1 / 1000, light_index):
 
-                    continue
+                lights.append(light)
 
-                distance = (-b - sqrt(discriminant)) / 2
+        return lights
 
-                if distance < 0:
+    # Any-hit query of a shadow ray, the shape that blocked the same light last time is tried before the rest of the geometry
+    def occluded(self, ray: Ray, distance: float, light_index: int):
 
-                    continue
+        self.shadow_rays += 1
 
-            elif isinstance(shape, Wall): 
-                
-                
-                direction_and_normal = ray.direction.dot_product(shape.normal_vector)
+        last_occluder = self.last_occluders.get(light_index)
 
+        if last_occluder is not None:
 
-                if direction_and_normal == 0:
+            last_hit = last_occluder.intersect(ray)
 
-                    continue
+            if last_hit is not None and last_hit[0] < distance:
 
-                t = (shape.right_lower - ray.origin).dot_product(shape.normal_vector) / direction_and_normal        # For finding if a point is on a surface or not we can create a vector from a point on the wall to that point and see if that vector is orthogonal to the normal, and later on find the distance by this derived formula
+                return True
 
-                if t < 0:
+        if self.bvh is not None:
 
-                    continue
-                
-                hit_point = ray.origin + ray.direction * t
+            occluder = self.bvh.any_hit(ray, distance)
 
-                if not shape.check_hit_point(hit_point): # See if the point and the plane intercepts with each other
+        else:
 
-                    continue
+            occluder = self.any_hit_linear(ray, self.geometry, distance)
 
-                distance = t
+        self.last_occluders[light_index] = occluder
+
+        return occluder is not None
+
+    def any_hit_linear(self, ray: Ray, geometry: list, max_distance: float):
+
+        for compiled in geometry:
+
+            hit = compiled.intersect(ray)
+
+            if hit is not None and hit[0] < max_distance:
+
+                return compiled
+
+        return None
+
+    # Tests the ray against every compiled shape and returns the smallest distance together with the shape and the part of it hit, the earlier shape wins if two shapes are hit at the same distance
+    def closest_object_linear(self, ray: Ray, geometry: list):
+        
+        min_distance = -1
+        min_shape = None
+        min_part = None
+
+        for compiled in geometry:
+
+            hit = compiled.intersect(ray)
+
+            if hit is None:
+
+                continue
+
+            distance = hit[0]
 
             if min_distance == -1:
 
                 min_distance = distance
-                min_shape = shape
+                min_shape = compiled.shape
+                min_part = hit[1]
 
                 continue
 
             if distance < min_distance: # If a new smaller point is found, choose it
 
                 min_distance = distance
-                min_shape = shape
+                min_shape = compiled.shape
+                min_part = hit[1]
 
                 continue
 
-        if min_shape is not None:  # Checks if there is a shape hit or not
-
-            hit_position = ray.origin + ray.direction * min_distance
-
-            return hit_position, min_shape
-        
-        return None, None
+        return min_distance, min_shape, min_part
 
     def reflect_ray(self, normal: Vector, incident: Vector):
 
-        return incident - normal * 2 * incident.dot_product(normal) # Calculating the reflected vector
+        scale = 2 * incident.dot_product(normal)
+
+        return Vector(incident.x - normal.x * scale, incident.y - normal.y * scale, incident.z - normal.z * scale) # Calculating the reflected vector, incident - normal * 2 * (incident . normal)
     
-    def diffuse(self, shape: Shape, ray: Vector, hit_position, color: Vector):
-        
-        if isinstance(shape, Sphere):
+    # The normal of the hit faces the ray, so the ray direction is turned around to get the cosine of the angle of incidence
+    def diffuse(self, hit: HitRecord, ray: Ray):
 
-            normal_vector = (shape.center - hit_position).normalize()
+        return hit.shape.color * max(-hit.normal.dot_product(ray.direction), 0)
 
-        elif isinstance(shape, Wall):
+    # Adds the specular highlights of the lights that are not in shadow to the color of the hit. The normal and the direction to the viewer are the same for every light, so they are found once
+    # per hit and the prepared lights do the rest, see lights.py. Highlights that add up to less than allowance may be left out, returns how much they could have added at most
+    def shade_lights(self, hit: HitRecord, color: Vector, lights: list, allowance: float):
 
-            normal_vector = shape.normal_vector
+        viewer_vector = self.camera - hit.position
+        viewer_vector.normalized_into(viewer_vector)
 
-            if normal_vector.x < 0 or normal_vector.y < 0 or normal_vector.z < 0:
+        visible = None if len(lights) == len(self.lights) else set(lights)
 
-                normal_vector *= -1 # So that if the normal vector is negative the diffuse constant does not become negative
-                
-        return color * max(normal_vector.dot_product(ray.direction), 0)
+        return self.light_set.shade(color, hit.position.as_tuple(False), hit.normal.as_tuple(False), viewer_vector.as_tuple(False), hit.material.specular_constant, visible, allowance)
 
-    # Shades the colors by the reflection amount
-    def specular_shade(self, shape: Sphere, ray: Vector, light: Light, hit_position):
 
-        if isinstance(shape, Sphere):
 
-            normal_vector = shape.center - hit_position
+# Every worker process of Scene.ray_trace_parallel receives the scene once when it starts instead of once per band
+_worker_scene = None
 
-        elif isinstance(shape, Wall):
+def _init_worker(scene: Scene):
 
-            normal_vector = shape.normal_vector
+    global _worker_scene
+    _worker_scene = scene
 
-        light_to_plane = hit_position - light.position
-        viewer_vector = self.camera - hit_position
+    if scene.instrument:
 
-        normal_vector = normal_vector.normalize()
-        light_to_plane = light_to_plane.normalize()
-        viewer_vector = viewer_vector.normalize()
+        import instrumentation
 
-        reflected = self.reflect_ray(normal_vector, light_to_plane)
-        light_to_plane *= -1
-        halfway_vector = (light_to_plane + viewer_vector).normalize()
-        blinn_term = max(halfway_vector.dot_product(reflected), 0) ** shape.material.specular_constant
-    
-        return light.color * blinn_term
+        instrumentation.attach(scene)
+
+
+# Returns the first row, the traced rows, the shadow rays cast for them and the stats of the band if the scene is instrumented. The worker's scene keeps counting shadow rays across the bands it traces
+def _trace_band(start: int, end: int):
+
+    shadow_rays = _worker_scene.shadow_rays
+    rows = _worker_scene.trace_rows(_worker_scene.shapes, start, end)
+    stats = None
+
+    if _worker_scene.instrument:
+
+        stats = _worker_scene.stats.as_dict()
+        _worker_scene.stats.reset()
 
+    return start, rows, _worker_scene.shadow_rays - shadow_rays, stats
@@ -0,0 +1,197 @@
+from math import sqrt
+
+# The lights of a scene prepared for shading, see Scene.shade_lights. The positions and colors are copied into plain floats once instead of being read from their vectors at every hit.
+# Scenes with more than MIN_LIGHTS lights also get a hierarchy of bounding spheres over the light positions. At a hit every branch gets a bound on the angle between the mirror direction
+# and its lights, and a branch whose highlights stay below what the hit may leave out is skipped as a whole, so a hit only shades the few lights whose highlight can show up
+
+
+# A branch of the hierarchy, a leaf if it holds the indices of its lights
+class LightNode:
+
+    __slots__ = ("center", "radius", "color_bound", "indices", "left", "right")
+
+    def __init__(self, center: tuple, radius: float, color_bound: float, indices: list = None, left = None, right = None):
+
+        self.center = center
+        self.radius = radius                # Every light of the branch is within this distance of the center
+        self.color_bound = color_bound      # Largest channel of the summed colors, the most the branch can add to a channel of a hit
+        self.indices = indices
+        self.left = left
+        self.right = right
+
+
+# Positions and colors of the lights as tuples, for noticing lights that were moved or recolored since they were prepared
+def light_signature(lights: list):
+
+    return [(light.position.as_tuple(False), light.color.as_tuple(False)) for light in lights]
+
+
+class LightSet:
+
+    MIN_LIGHTS = 16                         # Up to this amount checking the bounds costs more than shading every light
+    LEAF_SIZE = 16
+    MARGIN = 1e-9                           # Added to every bound against rounding, so that a skipped light can never have been lit
+
+    def __init__(self, lights: list, use_tree = None):
+
+        self.lights = list(lights)
+        self.signature = light_signature(lights)
+        self.positions = [position for position, _ in self.signature]
+        self.colors = [color for _, color in self.signature]
+
+        use_tree = len(lights) > self.MIN_LIGHTS if use_tree is None else use_tree
+
+        self.root = self.build(list(range(len(lights)))) if use_tree and lights else None
+        self.queries = 0                    # Hits shaded since the lights were prepared
+        self.shaded = 0                     # Lights those hits actually shaded, the rest were skipped or in shadow
+
+    def matches(self, lights: list):
+
+        return light_signature(lights) == self.signature
+
+    # Splits the lights at the median along the axis they spread the most on, like BVH.build does with the shapes
+    def build(self, indices: list):
+
+        positions = [self.positions[index] for index in indices]
+        lower = [min(position[axis] for position in positions) for axis in range(3)]
+        upper = [max(position[axis] for position in positions) for axis in range(3)]
+        center = tuple((lower[axis] + upper[axis]) / 2 for axis in range(3))
+        radius = max(sqrt(sum((position[axis] - center[axis]) ** 2 for axis in range(3))) for position in positions)
+        color_bound = max(sum(abs(self.colors[index][channel]) for index in indices) for channel in range(3))
+
+        if len(indices) <= self.LEAF_SIZE:
+
+            return LightNode(center, radius, color_bound, indices=indices)
+
+        extents = [upper[axis] - lower[axis] for axis in range(3)]
+        axis = extents.index(max(extents))
+        indices = sorted(indices, key=lambda index: (self.positions[index][axis], index))
+        middle = len(indices) // 2
+
+        return LightNode(center, radius, color_bound, left=self.build(indices[:middle]), right=self.build(indices[middle:]))
+
+    # Adds the Blinn highlight of every light that is not skipped to color, in the order of the lights. visible is the set of lights that are not in shadow, None if all of them count.
+    # Branches are skipped while the sum of their bounds stays within allowance, and that sum is returned
+    def shade(self, color, hit: tuple, normal: tuple, viewer: tuple, specular_constant, visible, allowance: float):
+
+        hit_x, hit_y, hit_z = hit
+        normal_x, normal_y, normal_z = normal
+        viewer_x, viewer_y, viewer_z = viewer
+
+        if self.root is None:
+
+            indices, skipped = range(len(self.positions)), 0
+
+        else:
+
+            indices, skipped = self.cull(hit, normal, viewer, specular_constant, allowance)
+
+        self.queries += 1
+
+        for index in indices:
+
+            if visible is not None and self.lights[index] not in visible:
+
+                continue
+
+            self.shaded += 1
+
+            position_x, position_y, position_z = self.positions[index]
+
+            x = hit_x - position_x          # From the light to the hit, the same operations in the same order as the vectors of the shading took before
+            y = hit_y - position_y
+            z = hit_z - position_z
+            magnitude = sqrt(x * x + y * y + z * z)
+            x, y, z = x / magnitude, y / magnitude, z / magnitude
+
+            scale = 2 * (x * normal_x + y * normal_y + z * normal_z)
+            reflected_x, reflected_y, reflected_z = x - normal_x * scale, y - normal_y * scale, z - normal_z * scale
+
+            halfway_x, halfway_y, halfway_z = viewer_x - x, viewer_y - y, viewer_z - z
+            magnitude = sqrt(halfway_x * halfway_x + halfway_y * halfway_y + halfway_z * halfway_z)
+            halfway_x, halfway_y, halfway_z = halfway_x / magnitude, halfway_y / magnitude, halfway_z / magnitude
+
+            blinn_term = max(halfway_x * reflected_x + halfway_y * reflected_y + halfway_z * reflected_z, 0) ** specular_constant
+            red, green, blue = self.colors[index]
+
+            color.x += red * blinn_term
+            color.y += green * blinn_term
+            color.z += blue * blinn_term
+
+        return skipped
+
+    # The indices of the lights in the branches that could not be skipped, sorted, and the sum of the bounds of the skipped branches
+    def cull(self, hit: tuple, normal: tuple, viewer: tuple, specular_constant, allowance: float):
+
+        indices = []
+        skipped = 0
+        stack = [self.root]
+
+        while stack:
+
+            node = stack.pop()
+            bound = node.color_bound * highlight_bound(node, hit, normal, viewer, specular_constant)
+
+            if skipped + bound <= allowance:
+
+                skipped += bound
+
+            elif node.indices is not None:
+
+                indices.extend(node.indices)
+
+            else:
+
+                stack.append(node.right)
+                stack.append(node.left)
+
+        indices.sort()
+
+        return indices, skipped
+
+
+# The cosines of the angles between a fixed direction and the directions within a cone, given the cosine to the cone's axis and the sine and cosine of the cone's half angle. Returns the smallest and the largest
+def cosine_range(cosine: float, sin_spread: float, cos_spread: float):
+
+    sine = sqrt(max(0, 1 - cosine * cosine))
+    low = -1 if cosine <= -cos_spread else cosine * cos_spread - sine * sin_spread
+    high = 1 if cosine >= cos_spread else cosine * cos_spread + sine * sin_spread
+
+    return low, high
+
+
+# Upper bound of the Blinn term of every light inside the node's sphere. With u the direction to a light, p = u . normal, q = viewer . normal and w = viewer . u, the halfway vector dotted with the reflected
+# light direction is (2 p ** 2 + 2 p q - w - 1) / sqrt(2 + 2 w). Over the cone of directions to the sphere p and w stay within ranges, and wherever the term is positive it grows with 2 p ** 2 + 2 p q and
+# shrinks with w, so the largest of the first at the ends of the range of p and the smallest w bound it. For a single light the ranges are points and the bound is the term itself
+def highlight_bound(node: LightNode, hit: tuple, normal: tuple, viewer: tuple, specular_constant):
+
+    x, y, z = node.center[0] - hit[0], node.center[1] - hit[1], node.center[2] - hit[2]
+    distance = sqrt(x * x + y * y + z * z)
+
+    if distance <= node.radius:         # The hit is inside of the sphere, its lights can come from any direction
+
+        return 1
+
+    x, y, z = x / distance, y / distance, z / distance
+    normal_x, normal_y, normal_z = normal
+    viewer_x, viewer_y, viewer_z = viewer
+
+    sin_spread = node.radius / distance
+    cos_spread = sqrt(1 - sin_spread * sin_spread)
+    facing = viewer_x * normal_x + viewer_y * normal_y + viewer_z * normal_z
+
+    incidence_low, incidence_high = cosine_range(x * normal_x + y * normal_y + z * normal_z, sin_spread, cos_spread)
+    viewer_low, _ = cosine_range(viewer_x * x + viewer_y * y + viewer_z * z, sin_spread, cos_spread)
+
+    lift = max(2 * incidence * incidence + 2 * incidence * facing for incidence in (incidence_low, incidence_high))
+    numerator = lift - viewer_low - 1 + LightSet.MARGIN
+
+    if numerator <= 0:                  # The halfway vector points away from the reflection, max(..., 0) makes the term 0 unless the constant is 0
+
+        return 0 if specular_constant > 0 else 1
+
+    if numerator * numerator >= 2 + 2 * viewer_low:
+
+        return 1
+
+    return (numerator / sqrt(2 + 2 * viewer_low)) ** specular_constant
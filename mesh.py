@@ -0,0 +1,321 @@
+import hashlib
+from array import array
+from lib import Vector, Ray, Material, Shape, CompiledShape, BVHNode
+
+# Triangle meshes. The vertices and the triangles live in flat arrays, three floats per vertex and three vertex indices per triangle, so a mesh with 100k triangles takes a few megabytes
+# instead of hundreds of thousands of Vector objects. Compiling a mesh builds a hierarchy of its own over the triangles, which the scene sees as a single shape with a single box,
+# so the scene's hierarchy and tile bins do not grow with the amount of triangles. Meshes are shaded on both sides, the normal of a triangle is turned towards the ray that hits it
+
+
+# Every triangle as its first corner and the two edges leaving it, nine floats in the order of the leaves of the hierarchy, together with the hierarchy itself.
+# Kept by the mesh between compiles, so that a scene that is compiled again because another shape changed does not build it again
+class TriangleTree:
+
+    LEAF_SIZE = 4
+
+    def __init__(self, vertices: array, indices: array):
+
+        self.triangles = array("d")
+        self.normals = array("d")           # The normalized cross product of the edges, three floats per triangle
+        self.order = array("I")             # Triangle -> its position in the indices of the mesh
+        self.arrays = None                  # Flat numpy copy of the hierarchy, made by vectorized.py on the first numpy render
+
+        count = len(indices) // 3
+        coordinates = [vertices[axis::3].tolist() for axis in range(3)]
+        corners = [list(map(coordinates[axis].__getitem__, indices[corner::3])) for corner in range(3) for axis in range(3)]    # x, y and z of the first corners, then of the second and the third
+        lowers = [list(map(min, corners[axis], corners[axis + 3], corners[axis + 6])) for axis in range(3)]
+        uppers = [list(map(max, corners[axis], corners[axis + 3], corners[axis + 6])) for axis in range(3)]
+        centers = [[(low + high) / 2 for low, high in zip(lowers[axis], uppers[axis])] for axis in range(3)]
+
+        self.root = self.build(list(range(count)), lowers, uppers, centers) if count else None
+
+        for triangle in self.order:
+
+            x_0, y_0, z_0, x_1, y_1, z_1, x_2, y_2, z_2 = (corner[triangle] for corner in corners)
+            edge_1_x, edge_1_y, edge_1_z = x_1 - x_0, y_1 - y_0, z_1 - z_0
+            edge_2_x, edge_2_y, edge_2_z = x_2 - x_0, y_2 - y_0, z_2 - z_0
+
+            normal = Vector(edge_1_x, edge_1_y, edge_1_z).cross_product(Vector(edge_2_x, edge_2_y, edge_2_z))
+            length = normal.magnitude()
+
+            self.triangles.extend((x_0, y_0, z_0, edge_1_x, edge_1_y, edge_1_z, edge_2_x, edge_2_y, edge_2_z))
+            self.normals.extend((normal / length).as_tuple(False) if length > 0 else (0, 0, 0))     # A triangle without area is never hit, its normal does not matter
+
+    # Worker processes get the tree without the numpy copy, which is made again if they need it
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state["arrays"] = None
+
+        return state
+
+    # Splits the triangles at the median of their box centers along the longest axis like BVH.build. A leaf holds the range of its triangles in the order they are stored in.
+    # The boxes are put together from the boxes of the children, so only the leaves look at the triangles
+    def build(self, triangles: list, lowers: list, uppers: list, centers: list):
+
+        if len(triangles) <= self.LEAF_SIZE:
+
+            start = len(self.order)
+            self.order.extend(triangles)
+
+            lower = tuple(min(map(lowers[axis].__getitem__, triangles)) for axis in range(3))
+            upper = tuple(max(map(uppers[axis].__getitem__, triangles)) for axis in range(3))
+
+            return BVHNode(lower, upper, shapes=range(start, len(self.order)))
+
+        extents = [max(map(centers[axis].__getitem__, triangles)) - min(map(centers[axis].__getitem__, triangles)) for axis in range(3)]
+        axis = extents.index(max(extents))
+
+        triangles.sort(key=centers[axis].__getitem__)
+        middle = len(triangles) // 2
+
+        left = self.build(triangles[:middle], lowers, uppers, centers)
+        right = self.build(triangles[middle:], lowers, uppers, centers)
+
+        return BVHNode(tuple(map(min, left.lower, right.lower)), tuple(map(max, left.upper, right.upper)), left=left, right=right)
+
+    # Returns the distance to the closest triangle along the ray and the triangle, or None. The triangles of a leaf are tested one after another over the flat array with the Moller-Trumbore test
+    def closest(self, ray: Ray):
+
+        if self.root is None:
+
+            return None
+
+        origin_x, origin_y, origin_z = origin = ray.origin.as_tuple(False)
+        direction_x, direction_y, direction_z = direction = ray.direction.as_tuple(False)
+        slab = (*origin, *(1 / component if component != 0 else None for component in direction))
+        triangles = self.triangles
+
+        min_distance = float("inf")
+        min_triangle = None
+        stack = [(self.root, self.root.entry_distance(*slab))]
+
+        while stack:
+
+            node, entry = stack.pop()
+
+            if entry is None or entry > min_distance:   # Nothing inside of this box can be closer than what is already found
+
+                continue
+
+            if node.shapes is not None:
+
+                for triangle in node.shapes:
+
+                    first_x, first_y, first_z, edge_1_x, edge_1_y, edge_1_z, edge_2_x, edge_2_y, edge_2_z = triangles[9 * triangle:9 * triangle + 9]
+
+                    p_x = direction_y * edge_2_z - direction_z * edge_2_y
+                    p_y = direction_z * edge_2_x - direction_x * edge_2_z
+                    p_z = direction_x * edge_2_y - direction_y * edge_2_x
+                    determinant = edge_1_x * p_x + edge_1_y * p_y + edge_1_z * p_z
+
+                    if determinant == 0:        # The ray runs along the triangle's plane
+
+                        continue
+
+                    inverse = 1 / determinant
+                    t_x = origin_x - first_x
+                    t_y = origin_y - first_y
+                    t_z = origin_z - first_z
+                    u = (t_x * p_x + t_y * p_y + t_z * p_z) * inverse
+
+                    if u < 0 or u > 1:
+
+                        continue
+
+                    q_x = t_y * edge_1_z - t_z * edge_1_y
+                    q_y = t_z * edge_1_x - t_x * edge_1_z
+                    q_z = t_x * edge_1_y - t_y * edge_1_x
+                    v = (direction_x * q_x + direction_y * q_y + direction_z * q_z) * inverse
+
+                    if v < 0 or u + v > 1:
+
+                        continue
+
+                    distance = (edge_2_x * q_x + edge_2_y * q_y + edge_2_z * q_z) * inverse
+
+                    if 0 <= distance < min_distance:
+
+                        min_distance = distance
+                        min_triangle = triangle
+
+                continue
+
+            left_entry = node.left.entry_distance(*slab)
+            right_entry = node.right.entry_distance(*slab)
+
+            if left_entry is None or (right_entry is not None and right_entry < left_entry):    # The nearer child is pushed last so that it is searched first
+
+                stack.append((node.left, left_entry))
+                stack.append((node.right, right_entry))
+
+            else:
+
+                stack.append((node.right, right_entry))
+                stack.append((node.left, left_entry))
+
+        if min_triangle is None:
+
+            return None
+
+        return min_distance, min_triangle
+
+    def normal(self, triangle: int):
+
+        return Vector(*self.normals[3 * triangle:3 * triangle + 3])
+
+
+class Mesh(Shape):
+
+    kind = "mesh"
+
+    def __init__(self, vertices, indices, color: Vector, material: Material, source: dict = None):
+
+        super().__init__(color=color, material=material)
+
+        self.vertices = vertices if isinstance(vertices, array) and vertices.typecode == "d" else array("d", vertices)
+        self.indices = indices if isinstance(indices, array) and indices.typecode == "I" else array("I", indices)
+        self.source = source                # Path, scale and offset of the OBJ file the mesh was loaded from, see load_obj
+
+        if len(self.vertices) % 3 or len(self.indices) % 3:
+
+            raise ValueError("A mesh needs three coordinates per vertex and three vertex indices per triangle")
+
+        if self.indices and max(self.indices) >= len(self.vertices) // 3:
+
+            raise ValueError(f"A triangle of the mesh uses vertex {max(self.indices)}, but there are only {len(self.vertices) // 3} vertices")
+
+        self.tree = None
+        self.tree_signature = None
+
+    def triangle_count(self):
+
+        return len(self.indices) // 3
+
+    # The box around every vertex, including vertices no triangle uses
+    def bounds(self):
+
+        if not self.vertices:
+
+            return (0, 0, 0), (0, 0, 0)
+
+        return tuple(min(self.vertices[axis::3]) for axis in range(3)), tuple(max(self.vertices[axis::3]) for axis in range(3))
+
+    # A digest of the buffers instead of the buffers themselves, so comparing it before every render stays cheap. Vertices edited in place are noticed as well
+    def signature(self):
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(memoryview(self.vertices).cast("B"))
+        digest.update(memoryview(self.indices).cast("B"))
+
+        return len(self.vertices), len(self.indices), digest.hexdigest()
+
+    # The normal of the triangle hit, the part of the hit record. Turned towards the ray, so both sides of a mesh are shaded
+    def normal_at(self, position: Vector, part: int, direction: Vector):
+
+        normal_vector = self.tree.normal(part)
+
+        if normal_vector.dot_product(direction) > 0:
+
+            normal_vector *= -1
+
+        return normal_vector
+
+    # The numpy form of normal_at, parts are the triangles hit
+    def normals_at(self, positions, parts, directions):
+
+        import vectorized
+
+        return vectorized.mesh_normals(self, parts, directions)
+
+    # Loaded from a file, the path is saved as it was given to load_obj. Otherwise the buffers are written out as lists
+    def format_fields(self):
+
+        if self.source is not None:
+
+            return dict(self.source)
+
+        vertices = self.vertices.tolist()
+        indices = self.indices.tolist()
+
+        return {"vertices": [vertices[k:k + 3] for k in range(0, len(vertices), 3)], "triangles": [indices[k:k + 3] for k in range(0, len(indices), 3)]}
+
+    # The hierarchy over the triangles is only built again when the buffers changed
+    def compile(self, index: int):
+
+        signature = self.signature()
+
+        if signature != self.tree_signature:
+
+            self.tree = TriangleTree(self.vertices, self.indices)
+            self.tree_signature = signature
+
+        return CompiledMesh(index, self, signature)
+
+
+class CompiledMesh(CompiledShape):
+
+    __slots__ = ("index", "shape", "signature", "lower", "upper", "tree")
+
+    def __init__(self, index: int, mesh: Mesh, signature: tuple):
+
+        self.index = index
+        self.shape = mesh
+        self.signature = signature
+        self.lower, self.upper = mesh.bounds()
+        self.tree = mesh.tree
+
+    # The distance and the triangle hit, which is the part of the mesh the normal is taken from
+    def intersect(self, ray: Ray):
+
+        return self.tree.closest(ray)
+
+    def intersect_rays(self, origins, directions):
+
+        import vectorized
+
+        return vectorized.mesh_distances(self, origins, directions)
+
+
+# Reads a Wavefront OBJ file line by line into a Mesh, the vertex positions go straight into the arrays without a Vector per vertex. Only v and f lines matter, faces with more than three
+# corners are split into a fan of triangles and v/vt/vn corners as well as negative indices are understood. scale and offset place the model in the scene, every vertex becomes vertex * scale + offset
+def load_obj(path: str, color: Vector, material: Material, scale: float = 1, offset: tuple = (0, 0, 0)):
+
+    vertices = array("d")
+    indices = array("I")
+
+    with open(path) as file:
+
+        for line_number, line in enumerate(file, 1):
+
+            parts = line.split()
+
+            if not parts or parts[0] not in ("v", "f"):
+
+                continue
+
+            try:
+
+                if parts[0] == "v":
+
+                    vertices.extend(float(parts[axis + 1]) * scale + offset[axis] for axis in range(3))
+
+                    continue
+
+                count = len(vertices) // 3
+                corners = [int(part.split("/")[0]) for part in parts[1:]]
+                corners = [corner - 1 if corner > 0 else count + corner for corner in corners]
+
+            except (ValueError, IndexError):
+
+                raise ValueError(f"{path}:{line_number} is not a valid {parts[0]} line")
+
+            if len(corners) < 3 or not all(0 <= corner < count for corner in corners):
+
+                raise ValueError(f"{path}:{line_number} needs at least three vertices that are defined before it")
+
+            for corner in range(1, len(corners) - 1):
+
+                indices.extend((corners[0], corners[corner], corners[corner + 1]))
+
+    return Mesh(vertices, indices, color, material, {"path": path, "scale": scale, "offset": list(offset)})
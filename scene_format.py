@@ -0,0 +1,298 @@
+import json
+import os
+from math import isfinite
+from lib import Vector, Window, Sphere, Wall, Material, Light, Scene
+from mesh import Mesh, load_obj
+
+# The scene file format of the command line renderer and of /api/render, JSON or YAML with the same structure:
+#
+#   {
+#     "window": {"width": 540, "height": 400, "sky": [0, 0, 0]},
+#     "camera": [0, 0, -1],
+#     "max_depth": 8,
+#     "lights": [{"position": [1, -0.74, 0], "color": [255, 255, 255]}],
+#     "shapes": [
+#       {"type": "sphere", "center": [0, 0, 1], "radius": 0.5, "color": [0, 0, 255], "material": {"reflectivity": 0.5, "specular": 32}},
+#       {"type": "wall", "corners": [[-3, 0.5, 0], [-3, 0.5, 4], [3, 0.5, 0], [3, 0.5, 4]], "color": [120, 120, 120], "material": {"reflectivity": 0, "specular": 8}},
+#       {"type": "mesh", "path": "bunny.obj", "scale": 1, "offset": [0, 0, 2], "color": [200, 200, 200], "material": {"reflectivity": 0, "specular": 16}},
+#       {"type": "mesh", "vertices": [[0, 0, 2], [1, 0, 2], [0, -1, 2]], "triangles": [[0, 1, 2]], "color": [0, 200, 0], "material": {"reflectivity": 0, "specular": 16}}
+#     ],
+#     "render_mode": "python", "shadows": false, "max_samples": 1, "min_throughput": 0.01, "light_threshold": 0.5
+#   }
+#
+# Wall corners are given as left upper, left lower, right upper and right lower corner like for Wall. A mesh is either read from a Wavefront OBJ file, whose path is relative to the scene file,
+# or given by its vertices and the vertex indices of its triangles. Paths are only allowed where files may be read, so not in scenes from the web. Everything after the shapes is optional and has the defaults of Scene.
+# validate collects every problem of a scene at once with the path to the value, so that a user sees all of them after one try
+
+MAX_DEPTH = 8
+MAX_SAMPLES = 64
+SHAPE_KEYS = {"sphere": {"type", "center", "radius", "color", "material"}, "wall": {"type", "corners", "color", "material"}, "mesh": {"type", "path", "scale", "offset", "vertices", "triangles", "color", "material"}}
+SCENE_KEYS = {"window", "camera", "max_depth", "lights", "shapes", "render_mode", "shadows", "max_samples", "sample_threshold", "seed", "min_throughput", "light_threshold"}
+
+
+class SceneFormatError(ValueError):
+
+    def __init__(self, errors: list):
+
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def is_number(value):
+
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and isfinite(value)
+
+
+def is_integer(value):
+
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# Checks a scene given as parsed JSON or YAML and returns the list of problems, empty if there are none. max_pixels limits the size of the image, max_depth the reflection depth, max_shapes the amount of shapes
+# and max_vertices the vertices as well as the triangles of all meshes given as lists together. These limits and allow_files=False, which rejects meshes read from files, are meant for scenes from the web
+def validate(data, max_pixels: int = None, allow_files: bool = True, max_depth: int = None, max_shapes: int = None, max_vertices: int = None):
+
+    errors = []
+
+    def check(condition: bool, message: str):
+
+        if not condition:
+
+            errors.append(message)
+
+        return condition
+
+    def check_vector(value, path: str, color: bool = False):
+
+        if check(isinstance(value, list) and len(value) == 3 and all(is_number(component) for component in value), f"{path} must be a list of three numbers"):
+
+            check(not color or all(0 <= component <= 255 for component in value), f"{path} must be a color with components from 0 to 255")
+
+    def check_keys(value: dict, allowed: set, path: str):
+
+        for key in sorted(set(value) - allowed):
+
+            errors.append(f"{path}.{key} is not a known setting")
+
+    def check_material(value, path: str):
+
+        if check(isinstance(value, dict), f"{path} must be an object with reflectivity and specular"):
+
+            check_keys(value, {"reflectivity", "specular"}, path)
+            check(is_number(value.get("reflectivity")) and 0 <= value.get("reflectivity") <= 1, f"{path}.reflectivity must be a number from 0 to 1")
+            check(is_number(value.get("specular")) and value.get("specular") >= 0, f"{path}.specular must be a number of at least 0")
+
+    if not check(isinstance(data, dict), "The scene must be an object"):
+
+        return errors
+
+    check_keys(data, SCENE_KEYS, "scene")
+
+    window = data.get("window")
+
+    if check(isinstance(window, dict), "window must be an object with width, height and sky"):
+
+        check_keys(window, {"width", "height", "sky"}, "window")
+
+        if check(is_integer(window.get("width")) and is_integer(window.get("height")) and window["width"] >= 2 and window["height"] >= 2, "window.width and window.height must be integers of at least 2") and max_pixels is not None:
+
+            check(window["width"] * window["height"] <= max_pixels, f"The image may have at most {max_pixels} pixels")
+
+        check_vector(window.get("sky", [0, 0, 0]), "window.sky", True)
+
+    check_vector(data.get("camera"), "camera")
+    if check(is_integer(data.get("max_depth", MAX_DEPTH)) and data.get("max_depth", MAX_DEPTH) >= 1, "max_depth must be an integer of at least 1") and max_depth is not None:
+
+        check(data.get("max_depth", MAX_DEPTH) <= max_depth, f"max_depth may be at most {max_depth}")
+
+    lights = data.get("lights")
+
+    if check(isinstance(lights, list) and len(lights) >= 1, "lights must be a list with at least one light"):
+
+        for index, light in enumerate(lights):
+
+            path = f"lights[{index}]"
+
+            if check(isinstance(light, dict), f"{path} must be an object with position and color"):
+
+                check_keys(light, {"position", "color"}, path)
+                check_vector(light.get("position"), f"{path}.position")
+                check_vector(light.get("color"), f"{path}.color", True)
+
+    shapes = data.get("shapes", [])
+
+    if check(isinstance(shapes, list), "shapes must be a list"):
+
+        if max_shapes is not None and not check(len(shapes) <= max_shapes, f"The scene may have at most {max_shapes} shapes"):
+
+            shapes = []         # Too many to check one by one
+
+        meshes = [shape for shape in shapes if isinstance(shape, dict) and shape.get("type") == "mesh" and isinstance(shape.get("vertices"), list) and isinstance(shape.get("triangles"), list)]
+        vertex_count = sum(len(shape["vertices"]) for shape in meshes)
+        triangle_count = sum(len(shape["triangles"]) for shape in meshes)
+        check_meshes = max_vertices is None or check(vertex_count <= max_vertices and triangle_count <= max_vertices, f"The meshes may have at most {max_vertices} vertices and {max_vertices} triangles together")
+
+        for index, shape in enumerate(shapes):
+
+            path = f"shapes[{index}]"
+
+            if not check(isinstance(shape, dict) and shape.get("type") in SHAPE_KEYS, f"{path}.type must be one of {', '.join(SHAPE_KEYS)}"):
+
+                continue
+
+            check_keys(shape, SHAPE_KEYS[shape["type"]], path)
+            check_vector(shape.get("color"), f"{path}.color", True)
+            check_material(shape.get("material"), f"{path}.material")
+
+            if shape["type"] == "sphere":
+
+                check_vector(shape.get("center"), f"{path}.center")
+                check(is_number(shape.get("radius")) and shape.get("radius") > 0, f"{path}.radius must be a number greater than 0")
+
+            elif shape["type"] == "wall":
+
+                if check(isinstance(shape.get("corners"), list) and len(shape["corners"]) == 4, f"{path}.corners must be a list of four corners"):
+
+                    for corner, value in enumerate(shape["corners"]):
+
+                        check_vector(value, f"{path}.corners[{corner}]")
+
+            elif "path" in shape:
+
+                check(allow_files, f"{path}.path is not allowed here, give the vertices and triangles of the mesh instead")
+                check(isinstance(shape["path"], str) and shape["path"] != "", f"{path}.path must be the path of an OBJ file")
+                check(is_number(shape.get("scale", 1)) and shape.get("scale", 1) > 0, f"{path}.scale must be a number greater than 0")
+                check_vector(shape.get("offset", [0, 0, 0]), f"{path}.offset")
+                check("vertices" not in shape and "triangles" not in shape, f"{path} must have either a path or vertices and triangles, not both")
+
+            elif check(isinstance(shape.get("vertices"), list) and isinstance(shape.get("triangles"), list), f"{path} must have a path to an OBJ file or lists of vertices and triangles") and check_meshes:     # Too many to check one by one otherwise
+
+                for vertex, value in enumerate(shape["vertices"]):
+
+                    check_vector(value, f"{path}.vertices[{vertex}]")
+
+                for triangle, value in enumerate(shape["triangles"]):
+
+                    check(isinstance(value, list) and len(value) == 3 and all(is_integer(corner) and 0 <= corner < len(shape["vertices"]) for corner in value), f"{path}.triangles[{triangle}] must be a list of three vertex indices")
+
+                check("scale" not in shape and "offset" not in shape, f"{path}.scale and {path}.offset only apply to meshes read from a file")
+
+    check(data.get("render_mode", "python") in Scene.RENDER_MODES, f"render_mode must be one of {', '.join(Scene.RENDER_MODES)}")
+    check(isinstance(data.get("shadows", False), bool), "shadows must be true or false")
+    check(is_integer(data.get("max_samples", 1)) and 1 <= data.get("max_samples", 1) <= MAX_SAMPLES, f"max_samples must be an integer from 1 to {MAX_SAMPLES}")
+    check(is_number(data.get("sample_threshold", 8)) and data.get("sample_threshold", 8) >= 0, "sample_threshold must be a number of at least 0")
+    check(is_integer(data.get("seed", 0)), "seed must be an integer")
+    check(is_number(data.get("min_throughput", 0.01)) and 0 <= data.get("min_throughput", 0.01) <= 1, "min_throughput must be a number from 0 to 1")
+    check(is_number(data.get("light_threshold", 0.5)) and data.get("light_threshold", 0.5) >= 0, "light_threshold must be a number of at least 0")
+
+    return errors
+
+
+def vector(value: list):
+
+    return Vector(*value)
+
+
+def material(value: dict):
+
+    return Material(value["reflectivity"], value["specular"])
+
+
+# Builds the Scene of a scene given as parsed JSON or YAML, after validating it with the limits of validate. The window gets the name and the framebuffer path, mesh paths are relative to directory,
+# the other keyword arguments are passed on to Scene, like workers or instrument
+def build_scene(data, name: str = "render", max_pixels: int = None, framebuffer_path: str = None, directory: str = "", allow_files: bool = True, max_depth: int = None, max_shapes: int = None, max_vertices: int = None, **scene_options):
+
+    errors = validate(data, max_pixels, allow_files, max_depth, max_shapes, max_vertices)
+
+    if errors:
+
+        raise SceneFormatError(errors)
+
+    window = Window(data["window"]["width"], data["window"]["height"], name, vector(data["window"].get("sky", [0, 0, 0])), framebuffer_path)
+    shapes = []
+
+    for index, shape in enumerate(data.get("shapes", [])):
+
+        if shape["type"] == "sphere":
+
+            shapes.append(Sphere(vector(shape["center"]), shape["radius"], vector(shape["color"]), material(shape["material"])))
+
+        elif shape["type"] == "wall":
+
+            shapes.append(Wall(*(vector(corner) for corner in shape["corners"]), vector(shape["color"]), material(shape["material"])))
+
+        elif "path" in shape:
+
+            try:
+
+                shapes.append(load_obj(os.path.join(directory, shape["path"]), vector(shape["color"]), material(shape["material"]), shape.get("scale", 1), shape.get("offset", [0, 0, 0])))
+
+            except (OSError, ValueError) as error:     # Missing files as well as broken lines of the file
+
+                raise SceneFormatError([f"shapes[{index}].path could not be loaded: {error}"])
+
+        else:
+
+            shapes.append(Mesh([component for vertex in shape["vertices"] for component in vertex], [corner for triangle in shape["triangles"] for corner in triangle], vector(shape["color"]), material(shape["material"])))
+
+    lights = [Light(vector(light["position"]), vector(light["color"])) for light in data["lights"]]
+    options = {key: data[key] for key in ("render_mode", "shadows", "max_samples", "sample_threshold", "seed", "min_throughput", "light_threshold") if key in data}
+
+    return Scene(window, shapes, vector(data["camera"]), lights, data.get("max_depth", MAX_DEPTH), **dict(options, **scene_options))
+
+
+# The scene in the file format, for saving scenes that were built in Python
+def scene_to_dict(scene: Scene):
+
+    def shape_to_dict(shape):
+
+        common = {"color": list(shape.color.as_tuple(False)), "material": {"reflectivity": shape.material.reflectivity, "specular": shape.material.specular_constant}}
+
+        return dict(type=shape.kind, **shape.format_fields(), **common)
+
+    return {
+        "window": {"width": scene.window.size_x, "height": scene.window.size_y, "sky": list(scene.window.color.as_tuple(False))},
+        "camera": list(scene.camera.as_tuple(False)),
+        "max_depth": scene.MAX_DEPTH,
+        "lights": [{"position": list(light.position.as_tuple(False)), "color": list(light.color.as_tuple(False))} for light in scene.lights],
+        "shapes": [shape_to_dict(shape) for shape in scene.shapes],
+        "render_mode": scene.render_mode,
+        "shadows": scene.shadows,
+        "max_samples": scene.max_samples,
+        "sample_threshold": scene.sample_threshold,
+        "seed": scene.seed,
+        "min_throughput": scene.min_throughput,
+        "light_threshold": scene.light_threshold,
+    }
+
+
+# Reads a scene file, YAML for .yaml and .yml files and JSON for everything else. PyYAML is only imported for YAML files
+def load_file(path: str):
+
+    with open(path) as file:
+
+        if path.lower().endswith((".yaml", ".yml")):
+
+            try:
+
+                import yaml
+
+            except ImportError:
+
+                raise SceneFormatError(["Reading YAML scene files needs PyYAML, install it with pip install pyyaml"])
+
+            try:
+
+                return yaml.safe_load(file)
+
+            except yaml.YAMLError as error:
+
+                raise SceneFormatError([f"{path} is not valid YAML: {error}"])
+
+        try:
+
+            return json.load(file)
+
+        except json.JSONDecodeError as error:
+
+            raise SceneFormatError([f"{path} is not valid JSON: {error}"])
@@ -1,6 +1,9 @@
+import os
 import pytest
 from lib import Vector, Window, Ray, Sphere, Scene, Light, Material, Wall
 from PIL import Image
+import numpy as np
+from benchmarks.scenes import SCENES
 
 def test_is_addition_working():
 
@@ -49,7 +52,24 @@ def test_is_dot_product_working():
 
     assert product == 11
 
-def test_render():
+def test_are_fused_helpers_working():
+
+    vector_a = Vector(1, 2, 3)
+    direction = Vector(0, 1, 2)
+
+    assert vector_a.madd(direction, 2).as_tuple(False) == (vector_a + direction * 2).as_tuple(False)
+
+    vector_c = Vector(3, 4, 0)
+
+    assert vector_c.normalized_into(vector_c) is vector_c and vector_c.as_tuple(False) == (3 / 5, 4 / 5, 0)
+
+def test_vectors_have_no_dictionary():
+
+    with pytest.raises(AttributeError):
+
+        Vector(1, 2, 3).w = 4
+
+def test_render(tmp_path):
 
     window = Window(540, 400, "test-1", Vector(0, 0, 0))
     material = Material(0.5, 32)
@@ -60,10 +80,10 @@ def test_render():
     objects = [red_sphere, yellow_sphere, green_sphere]
     camera = Vector(0, 0, -1)
     scene = Scene(window, objects, camera, lights, 3)
-    scene.blit_image()
+    scene.blit_image(directory=str(tmp_path))
 
 
-def test_render_with_reflections_and_walls():
+def test_render_with_reflections_and_walls(tmp_path):
 
     window = Window(540, 400, "test-3", Vector(0, 0, 0))
 
@@ -84,11 +104,11 @@ def test_render_with_reflections_and_walls():
     objects = [blue_sphere, pink_sphere, black_wall, left_wall, right_wall, floor_wall]
     camera = Vector(0, 0, -1)
     scene = Scene(window, objects, camera, lights, 8)
-    scene.blit_image()
+    scene.blit_image(directory=str(tmp_path))
 
 
 
-def test_one_ball_one_wall():
+def test_one_ball_one_wall(tmp_path):
 
     window = Window(540, 400, "test-5", Vector(0, 0, 0))
 
@@ -103,15 +123,1037 @@ def test_one_ball_one_wall():
     objects = [blue_sphere, floor_wall]
     camera = Vector(0, 0, -1)
     scene = Scene(window, objects, camera, lights, 8)
-    scene.blit_image()
-
-
-test_is_addition_working()
-test_is_subtraction_working()
-test_is_multiplication_working()
-test_is_magnitude_correct()
-test_is_normalization_working()
-test_is_dot_product_working()
-test_render()
-test_render_with_reflections_and_walls()
-test_one_ball_one_wall()
\ No newline at end of file
+    scene.blit_image(directory=str(tmp_path))
+
+def test_numpy_render_matches_python_render(tmp_path):
+
+    images = []
+
+    for mode in ("python", "numpy"):
+
+        window = Window(108, 80, f"test-{mode}", Vector(0, 0, 0))
+
+        material = Material(0.5, 32)
+        mat_wall_mirror = Material(0.7, 64)
+
+        right_wall = Wall(Vector(3,  2, 0), Vector(3,  -2, 0), Vector(3, 2, 4), Vector(3, -2, 4), Vector(200, 200, 200), mat_wall_mirror)
+        floor_wall = Wall(Vector(-3,  0.5, 0), Vector(-3,  0.5, 4), Vector(3, 0.5, 0), Vector(3, 0.5, 4), Vector(120, 120, 120), mat_wall_mirror)
+        blue_sphere = Sphere(Vector(0.75, -0.1, 1), 0.6, Vector(0, 0, 255), material)
+        pink_sphere = Sphere(Vector(-0.75, -0.1, 2), 0.6, Vector(125, 80, 125), material)
+
+        lights = [Light(Vector(1, window.upside, 0), Vector(255, 255, 255)), Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))]
+        scene = Scene(window, [blue_sphere, pink_sphere, right_wall, floor_wall], Vector(0, 0, -1), lights, 3, render_mode=mode)
+        scene.blit_image(directory=str(tmp_path))
+
+        images.append(np.asarray(scene.window.img, dtype=int))
+
+    difference = np.abs(images[0] - images[1])
+
+    assert difference.mean() < 0.5 and (difference > 2).mean() < 0.01
+
+def test_parallel_render_matches_serial_render(tmp_path):
+
+    images = []
+
+    for workers in (1, 3):
+
+        window = Window(60, 44, f"test-workers-{workers}", Vector(0, 0, 0))
+
+        material = Material(0.5, 32)
+        mat_wall_matte = Material(0, 8)
+
+        floor_wall = Wall(Vector(-3,  0.5, 0), Vector(-3,  0.5, 4), Vector(3, 0.5, 0), Vector(3, 0.5, 4), Vector(120, 120, 120), mat_wall_matte)
+        blue_sphere = Sphere(Vector(0.75, -0.1, 1), 0.6, Vector(0, 0, 255), material)
+
+        lights = [Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))]
+        scene = Scene(window, [blue_sphere, floor_wall], Vector(0, 0, -1), lights, 3, workers=workers)
+        scene.blit_image(directory=str(tmp_path))
+
+        assert scene.progress == 100
+
+        images.append(scene.window.img.tobytes())
+
+    assert images[0] == images[1]
+
+def test_bvh_finds_the_same_objects_as_linear_search():
+
+    import random
+    from benchmarks.bvh import random_shapes, random_rays
+
+    generator = random.Random(7)
+    shapes = random_shapes(60, generator)
+    window = Window(2, 2, "test-bvh", Vector(0, 0, 0))
+    scene = Scene(window, shapes, Vector(0, 0, -1), [], 3)
+
+    for ray in random_rays(500, generator):
+
+        distance, shape, part = scene.closest_object_linear(ray, scene.geometry)
+
+        assert scene.bvh.closest(ray) == (distance, shape, part)
+
+        for max_distance in (1, 4, float("inf")):         # The any-hit query of the shadow rays agrees on whether something is in the way
+
+            assert (scene.bvh.any_hit(ray, max_distance) is None) == (scene.any_hit_linear(ray, scene.geometry, max_distance) is None)
+
+def test_reflections_stop_when_throughput_is_too_low():
+
+    from lib import Ray
+
+    window = Window(2, 2, "test-throughput", Vector(0, 0, 0))
+
+    matte_wall = Wall(Vector(-3,  2, 4), Vector(-3,  -2, 4), Vector(3, 2, 4), Vector(3, -2, 4), Vector(0, 0, 200), Material(0, 8))
+    front_mirror = Wall(Vector(-3,  2, 4), Vector(-3,  -2, 4), Vector(3, 2, 4), Vector(3, -2, 4), Vector(0, 0, 200), Material(0.5, 8))
+    back_mirror = Wall(Vector(-3,  2, -2), Vector(-3,  -2, -2), Vector(3, 2, -2), Vector(3, -2, -2), Vector(0, 0, 200), Material(0.5, 8))
+    lights = [Light(Vector(1, 1, 0), Vector(255, 255, 255)), Light(Vector(-1, 1, 0), Vector(255, 255, 255))]
+
+    traced = []
+
+    for shapes, min_throughput in (([matte_wall], 0.01), ([front_mirror, back_mirror], 0.2)):
+
+        scene = Scene(window, shapes, Vector(0, 0, -1), lights, 8, min_throughput=min_throughput)
+        closest_object = scene.closest_object
+        calls = []
+        scene.closest_object = lambda ray, shapes: calls.append(ray) or closest_object(ray, shapes)
+
+        scene.ray_bounce(Ray(Vector(0, 0, -1), Vector(0, 0, 1)), scene.shapes, 0)
+        traced.append(len(calls))
+
+    assert traced == [1, 3]       # A matte wall is never reflected, and 0.5 ** 3 drops below 0.2 after the third hit
+
+def test_changed_shapes_are_compiled_again():
+
+    from lib import Ray
+
+    window = Window(2, 2, "test-compile", Vector(0, 0, 0))
+    sphere = Sphere(Vector(0, 0, 2), 0.5, Vector(255, 0, 0), Material(0.5, 32))
+    wall = Wall(Vector(-3,  2, 4), Vector(-3,  -2, 4), Vector(3, 2, 4), Vector(3, -2, 4), Vector(0, 0, 200), Material(0, 8))
+    scene = Scene(window, [sphere, wall], Vector(0, 0, -1), [], 3)
+
+    ray = Ray(Vector(0, 0, -1), Vector(0, 0, 1))
+
+    assert scene.closest_object(ray, scene.shapes).shape is sphere
+
+    sphere.center = Vector(0, 5, 2)                 # Assigning an attribute is noticed before the next render
+
+    assert scene.compile_if_changed()
+    assert scene.closest_object(ray, scene.shapes).shape is wall
+
+    other_scene = Scene(window, [Sphere(Vector(0, 0, 2), 0.5, Vector(255, 0, 0), Material(0.5, 32))], Vector(0, 0, -1), [], 3)
+    geometry = scene.geometry
+    other_scene.shapes[0].radius = 0.25             # Edits to the shapes of another scene leave this one alone
+
+    assert not scene.compile_if_changed() and scene.geometry is geometry
+
+    sphere.center.y = 0                             # Changes inside of a vector are noticed before the next render
+    wall.right_lower.z = wall.left_lower.z = 3
+
+    assert scene.compile_if_changed()
+    assert scene.closest_object(ray, scene.shapes).shape is sphere and not scene.compile_if_changed()
+
+def test_hit_records_carry_an_outward_normal_facing_the_ray():
+
+    from lib import Ray
+
+    window = Window(2, 2, "test-hit-record", Vector(0, 0, 0))
+    sphere = Sphere(Vector(0, 0, 2), 0.5, Vector(255, 0, 0), Material(0.5, 32))
+    right_mirror = Wall(Vector(3, 2, 0), Vector(3, -2, 0), Vector(3, 2, 4), Vector(3, -2, 4), Vector(0, 0, 200), Material(1, 8))
+    scene = Scene(window, [sphere, right_mirror], Vector(0, 0, -1), [], 3)
+
+    hit = scene.closest_object(Ray(Vector(0, 0, -1), Vector(0, 0, 1)), scene.shapes)
+
+    assert hit.shape is sphere and hit.material is sphere.material
+    assert abs(hit.distance - 2.5) < 1e-9 and hit.position.as_tuple(True) == (0, 0, 2)
+    assert hit.normal.as_tuple(False) == (0, 0, -1)
+
+    assert right_mirror.normal_vector.x > 0     # Has no negative component, so it faces the other way, into the room
+    assert scene.closest_object(Ray(Vector(0, 0, 1), Vector(1, 0, 0)), scene.shapes).normal.as_tuple(False) == (-1, 0, 0)
+    assert scene.closest_object(Ray(Vector(0, 0, -1), Vector(0, 0, -1)), scene.shapes) is None
+
+    closest_object = scene.closest_object
+    hits = []
+    scene.closest_object = lambda ray, shapes: hits.append(closest_object(ray, shapes)) or hits[-1]
+
+    scene.ray_bounce(Ray(Vector(2, 0, 1), Vector(1, 0, -0.5)), scene.shapes, 0)
+
+    assert hits[0].shape is right_mirror and hits[1] is None    # The reflection leaves the mirror into the room instead of hitting the mirror again
+
+def test_job_manager_renders_submitted_scenes():
+
+    import time
+    from jobs import JobManager, JobQueueFull, DONE
+
+    jobs = JobManager(workers=1, max_queued=0)
+
+    try:
+
+        job_id = jobs.new_job_id()
+        window = Window(60, 60, jobs.image_name(job_id), Vector(0, 0, 0))
+        sphere = Sphere(Vector(0, 0, 1), 0.5, Vector(0, 0, 255), Material(0.5, 32))
+        lights = [Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))]
+
+        jobs.submit(job_id, Scene(window, [sphere], Vector(0, 0, -1), lights, 3))
+
+        with pytest.raises(JobQueueFull):   # The only worker is busy and nothing may wait
+
+            jobs.submit(jobs.new_job_id(), Scene(window, [sphere], Vector(0, 0, -1), lights, 3))
+
+        while jobs.get(job_id).state != DONE:
+
+            time.sleep(0.1)
+
+        assert jobs.get(job_id).framebuffer.image().size == (60, 60)
+        assert jobs.get(job_id).path is None            # Images are only written to disk with save_images
+        assert jobs.get("unknown") is None
+
+    finally:
+
+        jobs.shutdown()
+
+# Requests keep being answered while a finished image is encoded, and an identical scene submitted meanwhile shares the finished job
+def test_finished_renders_are_encoded_outside_of_the_lock(tmp_path):
+
+    from concurrent.futures import Future
+    from jobs import JobManager, RenderJob, DONE
+    from cache import RenderCache
+
+    jobs = JobManager(workers=1, output_dir=str(tmp_path / "renders"), cache=RenderCache(str(tmp_path / "cache")))
+
+    class SlowFramebuffer:
+
+        def encode(self, format: str):
+
+            assert not jobs.lock.locked()
+
+            return b"png"
+
+    try:
+
+        job = RenderJob("job", key="key")
+        jobs.jobs["job"] = job
+        jobs.in_flight["key"] = "job"
+
+        future = Future()
+        future.set_result((SlowFramebuffer(), None))
+        original_put_data = jobs.cache.put_data
+        jobs.cache.put_data = lambda key, data: (jobs.submit("other", None, key) == "job" and jobs.get("job").state == DONE) and original_put_data(key, data)
+
+        jobs.finish(job, future)
+
+        assert jobs.cache.get("key") is not None and "key" not in jobs.in_flight and jobs.shared_renders == 1
+
+    finally:
+
+        jobs.shutdown()
+
+def test_framebuffer_matches_pillow_and_encodes(tmp_path):
+
+    import io
+    from framebuffer import Framebuffer
+
+    window = Window(30, 20, "test-framebuffer", Vector(0, 0, 0))
+    sphere = Sphere(Vector(0, 0, 1), 0.5, Vector(0, 0, 255), Material(0.5, 32))
+    scene = Scene(window, [sphere], Vector(0, 0, -1), [Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))], 3)
+
+    scene.blit_image(save=False)
+    image = Image.new("RGB", (30, 20))
+    scene.ray_trace_sphere(scene.shapes, image.load())
+
+    assert window.framebuffer.tobytes() == image.tobytes() == window.img.tobytes()
+    assert not os.path.exists("static/test-framebuffer.png")
+
+    framebuffer = window.framebuffer
+    framebuffer[0, 0] = (300, -5, 128)        # Clamped like Pillow clamps
+
+    assert framebuffer[0, 0] == (255, 0, 128)
+    assert framebuffer.encode("ppm") == b"P6\n30 20\n255\n" + framebuffer.tobytes()
+
+    for image_format in ("png", "webp"):
+
+        encoded = Image.open(io.BytesIO(framebuffer.encode(image_format, compress_level=1, quality=100)))
+
+        assert encoded.format == image_format.upper() and encoded.size == (30, 20)
+
+    assert Image.open(io.BytesIO(framebuffer.encode("png"))).tobytes() == framebuffer.tobytes()
+
+    framebuffer.save(str(tmp_path / "saved.png"))
+
+    assert Image.open(tmp_path / "saved.png").tobytes() == framebuffer.tobytes()
+
+    with pytest.raises(ValueError):
+
+        framebuffer.encode("gif")
+
+def test_memory_mapped_framebuffer_matches_the_image_in_memory(tmp_path):
+
+    sphere = Sphere(Vector(0, 0, 1), 0.5, Vector(0, 0, 255), Material(0.5, 32))
+    lights = [Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))]
+    images = []
+
+    for path, workers in ((None, 1), (str(tmp_path / "serial.rgb"), 1), (str(tmp_path / "parallel.rgb"), 2)):
+
+        window = Window(50, 40, "test-mapped", Vector(20, 20, 20), path)
+        scene = Scene(window, [sphere], Vector(0, 0, -1), lights, 3, workers=workers, max_samples=4)
+        scene.MAX_BAND_PIXELS = 120                     # Bands of two rows
+        scene.ray_trace_sphere(scene.shapes, window.framebuffer)
+
+        images.append(window.framebuffer.tobytes())
+
+        if path is not None:
+
+            window.framebuffer.save(str(tmp_path / "streamed.png"))
+            window.framebuffer.close()
+
+            assert Image.open(tmp_path / "streamed.png").tobytes() == images[0]
+            assert open(path, "rb").read() == images[0]     # The raw rows stay in the file
+
+    assert images[0] == images[1] == images[2]
+
+def test_render_cache_keys_and_eviction(tmp_path):
+
+    from cache import RenderCache, scene_key
+
+    window = Window(2, 2, "test-cache", Vector(0, 0, 0))
+    lights = [Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))]
+
+    scene_a = Scene(window, [Sphere(Vector(0, 0, 1), 0.5, Vector(0, 0, 255), Material(0.5, 32))], Vector(0, 0, -1), lights, 8)
+    scene_b = Scene(window, [Sphere(Vector(0.0, 0.0, 1.0), 0.5, Vector(0, 0, 255.0), Material(0.5, 32.0))], Vector(0, 0, -1), lights, 8)
+    scene_c = Scene(window, [Sphere(Vector(0, 0, 1), 0.6, Vector(0, 0, 255), Material(0.5, 32))], Vector(0, 0, -1), lights, 8)
+
+    assert scene_key(scene_a) == scene_key(scene_b) and scene_key(scene_a) != scene_key(scene_c)
+
+    image_path = tmp_path / "image.png"
+    Image.new("RGB", (2, 2)).save(image_path)
+
+    cache = RenderCache(str(tmp_path / "cache"), max_entries=2)
+
+    assert cache.get("a") is None
+
+    cache.put("a", image_path)
+    cache.put("b", image_path)
+
+    assert cache.get("a") is not None       # Makes "b" the least recently used entry
+
+    cache.put("c", image_path)
+
+    assert cache.get("b") is None and cache.get("c") is not None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2 and cache.stats()["entries"] == 2
+
+def test_tile_bins_cull_primary_rays_without_changing_the_image():
+
+    window = Window(80, 60, "tiles", Vector(0, 0, 0))
+    images = []
+
+    for tile_size in (0, 16):
+
+        scene = Scene(window, **SCENES["many-spheres"](window), tile_size=tile_size, max_samples=4, instrument=True)
+        image = Image.new("RGB", (80, 60))
+
+        scene.ray_trace_sphere(scene.shapes, image.load())
+        scene.camera = Vector(0.2, -0.1, -1.2)      # The bins have to follow the camera
+        scene.ray_trace_sphere(scene.shapes, image.load())
+
+        images.append((image.tobytes(), scene.stats.sphere_tests + scene.stats.wall_tests))
+
+    stats = scene.tiles.stats(window)
+
+    assert images[0][0] == images[1][0]
+    assert images[1][1] < images[0][1]
+    assert stats["tiles"] == 20 and stats["shapes"] == 52 and 0.5 < stats["culled_ratio"] < 1
+    assert scene.tiles.matches(window, scene.camera)
+
+
+def test_light_hierarchy_only_leaves_out_faint_highlights():
+
+    from benchmarks.lights import build_scene
+
+    def render(**options):
+
+        scene = build_scene(40, 48, **options)
+        scene.ray_trace_sphere(scene.shapes, scene.window.framebuffer)
+
+        return scene, scene.window.framebuffer.tobytes()
+
+    for shadows in (False, True):
+
+        _, reference = render(light_threshold=0, use_light_tree=False, shadows=shadows)
+        exact_scene, exact = render(light_threshold=0, use_light_tree=True, shadows=shadows)
+        culled_scene, culled = render(light_threshold=0.5, shadows=shadows)
+
+        assert exact == reference                   # Only highlights that are provably 0 are left out
+        assert max(abs(a - b) for a, b in zip(culled, reference)) <= 1
+        assert culled_scene.light_set.shaded < exact_scene.light_set.shaded <= exact_scene.light_set.queries * 48
+
+    culled_scene.lights[0].position = Vector(0, 0, 0)       # Moved lights are prepared again before the next render
+
+    assert not culled_scene.light_set.matches(culled_scene.lights)
+
+    culled_scene.compile_if_changed()
+
+    assert culled_scene.light_set.positions[0] == (0, 0, 0)
+
+
+def test_finished_bands_are_handed_to_on_band(tmp_path):
+
+    import base64
+    import io
+    from jobs import encode_band
+
+    window = Window(30, 40, "test-bands", Vector(0, 0, 0))
+    sphere = Sphere(Vector(0, 0, 1), 0.5, Vector(0, 0, 255), Material(0.5, 32))
+    scene = Scene(window, [sphere], Vector(0, 0, -1), [Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))], 3)
+
+    bands = []
+    scene.on_band = lambda start, rows: bands.append((start, rows))
+    scene.blit_image(directory=str(tmp_path))
+
+    assert [start for start, _ in bands] == [0, 16, 32] and sum(len(rows) for _, rows in bands) == 40
+
+    start, rows = bands[1]
+    band = Image.open(io.BytesIO(base64.b64decode(encode_band(rows))))
+
+    assert band.size == (30, 16) and band.tobytes() == window.img.crop((0, 16, 30, 32)).tobytes()
+
+def test_progressive_render_traces_every_pixel_once(tmp_path):
+
+    images = []
+
+    for mode in ("python", "progressive"):
+
+        window = Window(45, 30, f"test-{mode}", Vector(0, 0, 0))
+        sphere = Sphere(Vector(0, 0, 1), 0.5, Vector(0, 0, 255), Material(0.5, 32))
+        floor_wall = Wall(Vector(-3,  0.5, 0), Vector(-3,  0.5, 4), Vector(3, 0.5, 0), Vector(3, 0.5, 4), Vector(120, 120, 120), Material(0, 8))
+        scene = Scene(window, [sphere, floor_wall], Vector(0, 0, -1), [Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))], 3, render_mode=mode)
+
+        trace_pixel = scene.trace_pixel
+        traced = []
+        scene.trace_pixel = lambda shapes, j, i: traced.append((j, i)) or trace_pixel(shapes, j, i)
+
+        previews = []
+        scene.on_band = lambda start, rows: previews.append(start)
+        scene.blit_image(directory=str(tmp_path))
+
+        assert sorted(traced) == [(j, i) for j in range(45) for i in range(30)]
+
+        images.append(window.img.tobytes())
+
+    assert images[0] == images[1]
+    assert previews == [0, 16] * len(Scene.PREVIEW_SPACINGS)     # The whole image is handed over after every pass
+
+def test_antialiasing_only_samples_edges_again():
+
+    window = Window(40, 30, "test-antialias", Vector(0, 0, 0))
+    sphere = Sphere(Vector(0, 0, 1), 0.5, Vector(0, 0, 255), Material(0, 32))
+    scene = Scene(window, [sphere], Vector(0, 0, -1), [Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))], 1)
+
+    single = Image.new("RGB", (40, 30))
+    scene.ray_trace_sphere(scene.shapes, single.load())
+
+    assert scene.rays_per_pixel == 1
+
+    images = []
+
+    for _ in range(2):
+
+        scene.max_samples = 16
+
+        image = Image.new("RGB", (40, 30))
+        scene.ray_trace_sphere(scene.shapes, image.load())
+
+        images.append(image.tobytes())
+
+    assert images[0] == images[1]                   # The jitter is seeded
+    assert 1 < scene.rays_per_pixel < 4             # Only the silhouette of the sphere gets more samples
+
+    assert images[0] != single.tobytes()
+
+    for j, i in ((0, 0), (39, 0), (0, 29), (39, 29)):   # The sky stays as it was
+
+        assert image.getpixel((j, i)) == single.getpixel((j, i))
+
+def test_shadows_darken_the_floor_under_a_sphere(tmp_path):
+
+    images = {}
+
+    for mode, shadows in (("python", False), ("python", True), ("numpy", True)):
+
+        window = Window(30, 30, f"test-shadows-{mode}", Vector(0, 0, 0))
+        sphere = Sphere(Vector(0, 0, 2), 0.4, Vector(0, 0, 255), Material(0, 32))
+        floor_wall = Wall(Vector(-3,  0.5, 0), Vector(-3,  0.5, 4), Vector(3, 0.5, 0), Vector(3, 0.5, 4), Vector(120, 120, 120), Material(0, 8))
+        scene = Scene(window, [sphere, floor_wall], Vector(0, 0, -1), [Light(Vector(0, -1, 4), Vector(255, 255, 255))], 3, render_mode=mode, shadows=shadows)
+
+        scene.blit_image(directory=str(tmp_path))
+
+        assert (scene.shadow_rays > 0) == shadows
+
+        images[mode, shadows] = window.img
+
+    lit, shadowed = images["python", False], images["python", True]
+
+    darker = [shadowed_value < lit_value for shadowed_value, lit_value in zip(shadowed.tobytes(), lit.tobytes())]
+
+    assert any(darker)                                                        # The floor around the foot of the sphere
+    assert all(shadowed_value <= lit_value for shadowed_value, lit_value in zip(shadowed.tobytes(), lit.tobytes()))
+    assert shadowed.getpixel((1, 20)) == lit.getpixel((1, 20))                # The floor far to the side
+    assert shadowed.tobytes() == images["numpy", True].tobytes()
+
+
+def test_instrumented_render_counts_rays_and_tests(tmp_path):
+
+    import instrumentation
+
+    results = []
+
+    for instrument, workers in ((False, 1), (True, 1), (True, 2)):
+
+        window = Window(30, 20, "test-stats", Vector(0, 0, 0))
+        sphere = Sphere(Vector(0, 0, 1), 0.5, Vector(0, 0, 255), Material(0.5, 32))
+        floor_wall = Wall(Vector(-3,  0.5, 0), Vector(-3,  0.5, 4), Vector(3, 0.5, 0), Vector(3, 0.5, 4), Vector(120, 120, 120), Material(0.5, 8))
+        scene = Scene(window, [sphere, floor_wall], Vector(0, 0, -1), [Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))], 3, workers=workers, shadows=True, instrument=instrument)
+
+        scene.blit_image(directory=str(tmp_path))
+
+        results.append((window.img.tobytes(), scene.stats.as_dict() if instrument else None))
+
+    assert results[0][0] == results[1][0] == results[2][0]
+
+    stats = results[1][1]
+
+    assert stats["primary_rays"] == 30 * 20
+    assert sum(stats["bounce_depths"].values()) == stats["primary_rays"]
+    assert stats["reflected_rays"] > 0
+    assert stats["sphere_hits"] + stats["wall_hits"] >= sum(int(depth) * count for depth, count in stats["bounce_depths"].items())
+    assert stats["sphere_tests"] >= stats["closest_queries"] and stats["wall_tests"] >= stats["closest_queries"]     # Without a BVH every query tests every shape
+    assert 0 < stats["intersection_seconds"] < stats["render_seconds"]
+
+    parallel_stats = results[2][1]
+
+    for name in ("primary_rays", "closest_queries", "shadow_rays", "sphere_tests", "sphere_hits", "wall_tests", "wall_hits", "bounce_depths"):
+
+        assert parallel_stats[name] == stats[name]
+
+    instrumentation.detach(scene)
+
+    assert "closest_object" not in scene.__dict__
+
+
+# A new kind of shape only brings its own methods: it is counted, cached and saved without changes elsewhere, and whatever it leaves out is refused with a TypeError
+def test_new_kinds_of_shapes_need_no_changes_elsewhere():
+
+    from lib import Shape, CompiledShape, CompiledSphere
+    from cache import canonical_shape
+    from scene_format import scene_to_dict
+
+    class CompiledBall(CompiledSphere):
+
+        __slots__ = ()
+        intersect_rays = CompiledShape.intersect_rays
+
+    class Ball(Sphere):
+
+        kind = "ball"
+        normals_at = Shape.normals_at
+
+        def compile(self, index: int):
+
+            return CompiledBall(index, self)
+
+    window = Window(30, 20, "test-ball", Vector(0, 0, 0))
+    ball = Ball(Vector(0, 0, 1), 0.5, Vector(0, 0, 255), Material(0.5, 32))
+    scene = Scene(window, [ball], Vector(0, 0, -1), [Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))], 3, instrument=True)
+
+    scene.ray_trace_sphere(scene.shapes, Image.new("RGB", (30, 20)).load())
+
+    assert scene.stats.ball_hits > 0 and scene.stats.as_dict()["ball_tests"] == scene.stats.closest_queries
+    assert canonical_shape(ball)[0] == "ball" and scene_to_dict(scene)["shapes"][0]["type"] == "ball"
+
+    for render_mode in ("numpy", "deferred"):
+
+        scene.render_mode = render_mode
+
+        with pytest.raises(TypeError):
+
+            scene.ray_trace_sphere(scene.shapes, Image.new("RGB", (30, 20)).load())
+
+    with pytest.raises(TypeError):
+
+        canonical_shape(Shape(Vector(0, 0, 0), Material(0, 8)))
+
+
+def test_animation_frames_match_single_renders(tmp_path):
+
+    from animation import render_animation, linear_path
+
+    window = Window(30, 20, "test-animation", Vector(0, 0, 0))
+    sphere = Sphere(Vector(0, 0, 1), 0.5, Vector(0, 0, 255), Material(0.5, 32))
+    floor_wall = Wall(Vector(-3,  0.5, 0), Vector(-3,  0.5, 4), Vector(3, 0.5, 0), Vector(3, 0.5, 4), Vector(120, 120, 120), Material(0.5, 8))
+    light = Light(Vector(-0.5, -0.5, 0), Vector(255, 255, 255))
+    scene = Scene(window, [sphere, floor_wall], Vector(0, 0, -1), [light], 3)
+
+    cameras = linear_path(Vector(-0.2, 0, -1), Vector(0.2, 0, -1), 3)
+    light_paths = [[Vector(-0.5, -0.5, 0)], [Vector(0, -0.5, 0)], [Vector(0.5, -0.5, 0)]]
+
+    result = render_animation(scene, cameras, light_paths, output_dir=str(tmp_path), name="turn", workers=2)
+
+    assert [os.path.basename(path) for path in result["frames"]] == ["turn_0000.png", "turn_0001.png", "turn_0002.png"]
+    assert result["frames_per_minute"] > 0
+    assert scene.camera.as_tuple(False) == (0, 0, -1)             # Only the worker processes moved the camera
+
+    for path, camera, light_positions in zip(result["frames"], cameras, light_paths):
+
+        scene.camera = camera
+        light.position = light_positions[0]
+
+        image = Image.new("RGB", (30, 20))
+        scene.ray_trace_sphere(scene.shapes, image.load())
+
+        assert Image.open(path).tobytes() == image.tobytes()
+
+
+# Moving the camera from frame to frame only bins the shapes again for the new view, the geometry and its hierarchy are compiled once
+def test_animation_camera_path_keeps_the_hierarchy(tmp_path):
+
+    import lib
+    from animation import render_animation, linear_path
+
+    window = Window(30, 20, "test-animation-bvh", Vector(0, 0, 0))
+    scene = Scene(window, **SCENES["many-spheres"](window), use_bvh=True, tile_size=8)
+    calls = {"compile": 0, "bvh": 0, "tiles": 0}
+    compile, bvh_init, tiles_init = Scene.compile, lib.BVH.__init__, lib.TileBins.__init__
+
+    def counted(name, function):
+
+        def call(*arguments):
+
+            calls[name] += 1
+            return function(*arguments)
+
+        return call
+
+    Scene.compile, lib.BVH.__init__, lib.TileBins.__init__ = counted("compile", compile), counted("bvh", bvh_init), counted("tiles", tiles_init)
+
+    try:
+
+        render_animation(scene, linear_path(Vector(-0.2, 0, -1), Vector(0.2, 0, -1), 6), output_dir=str(tmp_path), workers=1)
+
+    finally:
+
+        Scene.compile, lib.BVH.__init__, lib.TileBins.__init__ = compile, bvh_init, tiles_init
+
+    assert calls == {"compile": 0, "bvh": 0, "tiles": 6}            # Once for the camera of every frame
+
+    scene.render_mode = "numpy"
+    scene.compile_if_changed()
+
+    assert scene.tiles is None
+
+
+def test_incremental_render_matches_a_full_render(tmp_path):
+
+    from incremental import render, RecordStore
+
+    window = Window(40, 30, "test-incremental", Vector(0, 0, 0))
+    scene = Scene(window, **SCENES["shadows"](window))
+    store = RecordStore(str(tmp_path), max_records=1)
+
+    record, traced = render(scene, Image.new("RGB", (40, 30)))
+
+    assert traced == 40 * 30
+    store.save(scene, record)
+
+    scene.shapes[0].center = scene.shapes[0].center + Vector(0.1, 0, 0)     # Moving the blue sphere shows up in its reflections and in the shadows it casts
+    scene.shapes.append(Sphere(Vector(0, 0.3, 1), 0.1, Vector(0, 255, 0), Material(0.5, 32)))
+
+    image = Image.new("RGB", (40, 30))
+    record, traced = render(scene, image, store.load(scene))
+
+    full_image = Image.new("RGB", (40, 30))
+    scene.ray_trace_sphere(scene.shapes, full_image.load())
+
+    assert 0 < traced < 40 * 30
+    assert image.tobytes() == full_image.tobytes()
+    assert render(scene, Image.new("RGB", (40, 30)), record)[1] == 0
+
+    scene.lights[0].color = Vector(100, 100, 100)       # Anything besides the shapes needs a full render
+
+    assert render(scene, Image.new("RGB", (40, 30)), record)[1] == 40 * 30
+
+
+# Web renders with several processes per render are recorded too, and an edit only traces the pixels it reaches in those processes
+def test_web_renders_with_several_workers_re_render_in_part(tmp_path):
+
+    import queue
+    import incremental
+    from jobs import render_job
+    from incremental import RecordStore
+
+    store = RecordStore(str(tmp_path), max_records=4)
+    window = Window(40, 30, "test-job-workers", Vector(0, 0, 0))
+    scene = Scene(window, **SCENES["shadows"](window), workers=2)
+    renders = []
+    render, min_parallel_pixels = incremental.render, incremental.MIN_PARALLEL_PIXELS
+
+    incremental.render = lambda *arguments: renders.append(render(*arguments)) or renders[-1]
+    incremental.MIN_PARALLEL_PIXELS = 0      # The edit is small, its pixels go through the pool as well
+
+    try:
+
+        render_job("job", scene, queue.Queue(), store)
+
+        scene.shapes[0].center = scene.shapes[0].center + Vector(0.1, 0, 0)
+        events = queue.Queue()
+        framebuffer, _ = render_job("job", scene, events, store)
+
+    finally:
+
+        incremental.render, incremental.MIN_PARALLEL_PIXELS = render, min_parallel_pixels
+
+    full_image = Image.new("RGB", (40, 30))
+    scene.ray_trace_sphere(scene.shapes, full_image.load())
+
+    assert renders[0][1] == 40 * 30
+    assert 0 < renders[1][1] < 40 * 30
+    assert framebuffer.tobytes() == full_image.tobytes()
+    assert renders[1][0].touched == render(scene, Image.new("RGB", (40, 30)))[0].touched      # The workers recorded their pixels like a serial render does
+    assert any(event[1] == "band" for event in events.queue)
+
+
+def test_deferred_render_reshades_light_and_material_edits():
+
+    window = Window(40, 30, "test-deferred", Vector(0, 0, 0))
+    scene = Scene(window, **SCENES["shadows"](window))
+
+    def render(render_mode):
+
+        scene.render_mode = render_mode
+        image = Image.new("RGB", (40, 30))
+        scene.ray_trace_sphere(scene.shapes, image.load())
+
+        return image.tobytes()
+
+    assert render("deferred") == render("numpy")
+
+    gbuffer = scene.gbuffer
+    scene.lights[0].color = Vector(255, 120, 0)
+    scene.lights[1].position = Vector(-0.2, -0.5, 0)
+    scene.shapes[0].material = Material(0.9, 8)         # Deeper reflections than the first render had, the G-buffer keeps the whole path
+    scene.shapes[3].color = Vector(0, 200, 0)
+
+    assert render("deferred") == render("numpy")
+    assert scene.gbuffer is gbuffer
+
+    scene.shapes[0].center = Vector(0.5, -0.1, 1)
+
+    assert render("deferred") == render("numpy")
+    assert scene.gbuffer is not gbuffer
+
+
+def test_render_farm_hands_out_tiles_of_lost_workers_again():
+
+    import socket
+    import time
+    from threading import Thread
+    from multiprocessing import Process
+    from farm import Coordinator, run_worker, send_message, receive_message, HELLO
+
+    window = Window(60, 40, "test-farm", Vector(0, 0, 0))
+    scene = Scene(window, **SCENES["shadows"](window))
+    coordinator = Coordinator(scene, tile_size=16, timeout=1)
+
+    # Workers that take a tile and then close the connection or never answer
+    def lost_worker(stall: bool):
+
+        with socket.create_connection(coordinator.address) as connection:
+
+            send_message(connection, HELLO, b"lost")
+            receive_message(connection)
+            receive_message(connection)
+
+            if stall:
+
+                time.sleep(3)
+
+    lost_workers = [Thread(target=lost_worker, args=(stall,)) for stall in (False, True)]
+
+    for thread in lost_workers:
+
+        thread.start()
+
+    time.sleep(0.2)             # The lost workers connect first so that they get tiles
+
+    processes = [Process(target=run_worker, args=(*coordinator.address, f"local-{index}")) for index in range(2)]
+
+    for process in processes:
+
+        process.start()
+
+    framebuffer = coordinator.render()
+
+    for process in processes + lost_workers:
+
+        process.join()
+
+    image = Image.new("RGB", (60, 40))
+    serial_scene = Scene(window, **SCENES["shadows"](window))
+    serial_scene.ray_trace_sphere(serial_scene.shapes, image.load())
+
+    stats = coordinator.stats()
+
+    assert framebuffer.tobytes() == image.tobytes()
+    assert stats["requeued_tiles"] == 2 and stats["finished_tiles"] == stats["tiles"] == 12
+    assert sorted(worker["lost_tiles"] for worker in stats["workers"]) == [0, 0, 1, 1]
+    assert sum(worker["tiles"] for worker in stats["workers"]) == 12
+    assert all(worker["pixels_per_second"] > 0 for worker in stats["workers"] if worker["tiles"])
+
+
+def test_scene_format_reports_every_problem_and_round_trips():
+
+    from scene_format import validate, build_scene, scene_to_dict, SceneFormatError
+
+    window = Window(60, 40, "format", Vector(0, 0, 0))
+    scene = Scene(window, **SCENES["shadows"](window))
+    data = scene_to_dict(scene)
+
+    assert validate(data) == []
+    assert scene_to_dict(build_scene(data)) == data
+    assert validate(dict(data, max_depth=9), max_depth=8, max_shapes=1) == ["max_depth may be at most 8", "The scene may have at most 1 shapes"]      # The limits of /api/render
+
+    data["window"]["extra"] = 1
+    data["shapes"][0]["radius"] = 0
+    data["lights"][0]["color"] = [0, 0, 256]
+
+    with pytest.raises(SceneFormatError) as error:
+
+        build_scene(data, max_pixels=100)
+
+    assert error.value.errors == ["window.extra is not a known setting", "The image may have at most 100 pixels", "lights[0].color must be a color with components from 0 to 255", "shapes[0].radius must be a number greater than 0"]
+
+
+# The command line renderer writes PPM without importing Flask, Pillow or numpy
+def test_command_line_render_matches_a_render_in_memory(tmp_path):
+
+    import json
+    import subprocess
+    import sys
+    from scene_format import build_scene, load_file
+
+    data = load_file("scenes/reflections.json")
+    data["window"].update(width=54, height=40)
+
+    with open(tmp_path / "scene.json", "w") as file:
+
+        json.dump(data, file)
+
+    output = str(tmp_path / "scene.ppm")
+    check = f"import sys, cli; assert cli.main([{str(tmp_path / 'scene.json')!r}, '-o', {output!r}, '-q']) == 0; assert not {{'flask', 'PIL', 'numpy'}} & set(sys.modules)"
+
+    subprocess.run([sys.executable, "-c", check], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    image = Image.new("RGB", (54, 40))
+    scene = build_scene(data)
+    scene.ray_trace_sphere(scene.shapes, image.load())
+
+    with open(output, "rb") as file:
+
+        assert file.read() == b"P6\n54 40\n255\n" + image.tobytes()
+
+
+def test_api_render_queues_valid_scenes_only(tmp_path):
+
+    import time
+    import app as web_app
+    from scene_format import load_file
+
+    web_app.app.config["CACHE_DIR"] = str(tmp_path)
+    client = web_app.app.test_client()
+    data = load_file("scenes/three-spheres.yaml")
+    data["window"].update(width=40, height=30)
+
+    try:
+
+        response = client.post("/api/render", json=data)
+
+        assert response.status_code == 202
+
+        while client.get(response.json["progress"]).json["state"] not in ("done", "failed"):
+
+            time.sleep(0.1)
+
+        image = client.get(response.json["result"] + "?format=ppm")
+
+        assert image.status_code == 200 and image.data.startswith(b"P6\n40 30\n")
+
+        response = client.post("/api/render", json=dict(data, max_depth=0))
+
+        assert response.status_code == 400 and response.json["errors"] == ["max_depth must be an integer of at least 1"]
+        assert client.post("/api/render", data="not json").status_code == 400
+
+    finally:
+
+        if web_app.jobs is not None:
+
+            web_app.jobs.shutdown()
+            web_app.jobs = None
+
+
+# The stream sends the bands the workers report and then the end of the job, waking up for each of them instead of polling
+def test_stream_sends_bands_and_then_done(tmp_path):
+
+    import time
+    from concurrent.futures import Future
+    from threading import Thread
+    import app as web_app
+    from jobs import JobManager, RenderJob
+
+    web_app.jobs = jobs = JobManager(workers=1, output_dir=str(tmp_path))
+    client = web_app.app.test_client()
+    job = RenderJob("job")
+    jobs.jobs["job"] = job
+    waits = []
+    updates = jobs.updates
+    jobs.updates = lambda job, sent, progress, timeout: waits.append(sent) or updates(job, sent, progress, timeout)
+
+    def work():
+
+        for event in (("job", "progress", 50), ("job", "band", (0, "first")), ("job", "band", (16, "second"))):
+
+            jobs.events.put(event)
+
+        while 2 not in waits:       # The stream has sent both bands
+
+            time.sleep(0.01)
+
+        time.sleep(0.3)
+        future = Future()
+        future.set_result((None, None))
+        jobs.finish(job, future)
+
+    try:
+
+        worker = Thread(target=work)
+        worker.start()
+
+        events = [line[len("event: "):] for line in client.get("/stream/job").get_data(as_text=True).splitlines() if line.startswith("event: ")]
+        worker.join()
+
+        assert [event for event in events if event != "progress"] == ["band", "band", "done"]
+        assert len(waits) <= 6          # One wake up per change, nothing in between although the job took a while
+        assert client.get("/stream/unknown").status_code == 404
+
+    finally:
+
+        web_app.jobs = None
+        jobs.shutdown()
+
+
+def test_benchmark_scenes_match_golden_images():
+
+    from benchmarks.render import run, golden_mismatch, GOLDEN_MISMATCH
+
+    for name, result in run(list(SCENES)).items():
+
+        assert golden_mismatch(name, result["image"]) <= GOLDEN_MISMATCH, f"{name} does not match benchmarks/golden/{name}.png"
+
+
+# Timings depend on the machine, so they are only compared with benchmarks/baseline.json when asked for
+@pytest.mark.skipif(not os.environ.get("HIZTRACER_BENCHMARK"), reason="set HIZTRACER_BENCHMARK=1 to compare the render times with the baseline")
+def test_rendering_is_not_slower_than_the_baseline():
+
+    from benchmarks.render import run, load_baseline, regressions, THRESHOLD, REPEAT
+
+    threshold = float(os.environ.get("HIZTRACER_BENCHMARK_THRESHOLD", THRESHOLD))
+
+    assert regressions(run(list(SCENES), repeat=REPEAT), load_baseline(), threshold) == []
+
+
+def test_obj_meshes_load_into_flat_buffers_and_find_the_closest_triangle(tmp_path):
+
+    import random
+    from mesh import Mesh, TriangleTree, load_obj
+
+    path = tmp_path / "quad.obj"
+    path.write_text("# a quad and a triangle\nv -1 -1 2\nv 1 -1 2\nv 1 1 2\nv -1 1 2\nvn 0 0 -1\nf 1//1 2//1 3//1 4//1\nv 0 0 3\nf -1 1 2\n")
+
+    mesh = load_obj(str(path), Vector(255, 0, 0), Material(0, 8), scale=2, offset=(0, 0, 1))
+
+    assert mesh.vertices.tolist()[:3] == [-2, -2, 5] and mesh.indices.tolist() == [0, 1, 2, 0, 2, 3, 4, 0, 1]
+    assert mesh.bounds() == ((-2, -2, 5), (2, 2, 7))
+
+    path.write_text("v 0 0 0\nf 1 2 3\n")
+
+    with pytest.raises(ValueError, match="quad.obj:2"):
+
+        load_obj(str(path), Vector(255, 0, 0), Material(0, 8))
+
+    generator = random.Random(3)
+    vertices = [generator.uniform(-1, 1) for _ in range(3 * 300)]
+    indices = [generator.randrange(300) for _ in range(3 * 400)]
+    mesh = Mesh(vertices, indices, Vector(255, 0, 0), Material(0, 8))
+    compiled = mesh.compile(0)
+
+    TriangleTree.LEAF_SIZE, leaf_size = 10 ** 9, TriangleTree.LEAF_SIZE     # A single leaf tests every triangle
+    every_triangle = TriangleTree(mesh.vertices, mesh.indices)
+    TriangleTree.LEAF_SIZE = leaf_size
+
+    scene = Scene(Window(2, 2, "test-mesh-hits", Vector(0, 0, 0)), [mesh], Vector(0, 0, -2), [], 3)
+    other_ray = Ray(Vector(0, 0, -2), Vector(0.1, 0.1, 1))
+
+    for _ in range(300):
+
+        ray = Ray(Vector(generator.uniform(-1, 1), generator.uniform(-1, 1), -2), Vector(generator.uniform(-0.5, 0.5), generator.uniform(-0.5, 0.5), 1))
+        hit = mesh.tree.closest(ray)
+        expected = every_triangle.closest(ray)
+
+        assert (hit is None) == (expected is None) and (hit is None or hit[0] == expected[0])
+
+        if hit is not None:             # The record keeps the triangle hit, and its normal faces the ray whatever was intersected after it
+
+            record = scene.closest_object(ray, scene.shapes)
+            compiled.intersect(other_ray)
+
+            assert compiled.intersect(ray) == hit and record.part == hit[1]
+            assert record.normal.as_tuple(False) == mesh.normal_at(record.position, hit[1], ray.direction).as_tuple(False) and record.normal.dot_product(ray.direction) <= 0
+
+    tree = mesh.tree
+
+    assert mesh.compile(1).tree is tree             # Unchanged buffers keep their tree
+
+    mesh.vertices[0] += 1                           # Edits inside of the buffers are noticed like changed vectors
+
+    assert mesh.compile(1).tree is not tree
+
+
+def test_meshes_render_alike_in_every_mode_and_round_trip_through_the_scene_format(tmp_path):
+
+    from mesh import Mesh
+    from scene_format import build_scene, scene_to_dict, validate
+
+    window = Window(54, 40, "test-mesh", Vector(0, 0, 0))
+    pyramid = Mesh([0, -0.6, 1.5, -0.5, 0.3, 1.1, 0.5, 0.3, 1.1, 0, 0.3, 2], [0, 1, 2, 0, 2, 3, 0, 3, 1, 1, 3, 2], Vector(0, 200, 0), Material(0.4, 32))
+    images = {}
+
+    for render_mode in ("python", "numpy", "deferred"):
+
+        scene_window = Window(54, 40, "test-mesh", Vector(0, 0, 0))
+        scene = SCENES["reflections"](scene_window)
+        scene = Scene(scene_window, scene["shapes"] + [pyramid], scene["camera"], scene["lights"], scene["max_depth"], render_mode=render_mode, shadows=True, instrument=render_mode == "python")
+        scene.ray_trace_sphere(scene.shapes, scene_window.framebuffer)
+        images[render_mode] = np.frombuffer(scene_window.framebuffer.tobytes(), dtype=np.uint8).astype(int)
+
+        if render_mode == "python":
+
+            assert scene.stats.mesh_hits > 0 and scene.stats.mesh_tests >= scene.stats.mesh_hits
+
+    assert np.abs(images["python"] - images["numpy"]).max() <= 2
+    assert np.array_equal(images["numpy"], images["deferred"])
+
+    scene = Scene(window, [pyramid], Vector(0, 0, -1), [Light(Vector(1, -1, 0), Vector(255, 255, 255))], 3)
+    data = scene_to_dict(scene)
+
+    assert data["shapes"][0]["triangles"][1] == [0, 2, 3] and scene_to_dict(build_scene(data)) == data
+    assert validate(data, max_vertices=4) == [] and validate(data, max_vertices=3) == ["The meshes may have at most 3 vertices and 3 triangles together"]
+
+    (tmp_path / "pyramid.obj").write_text("".join(f"v {x} {y} {z}\n" for x, y, z in data["shapes"][0]["vertices"]) + "f 1 2 3\nf 1 3 4\nf 1 4 2\nf 2 4 3\n")
+    data["shapes"][0] = {"type": "mesh", "path": "pyramid.obj", "color": [0, 200, 0], "material": {"reflectivity": 0.4, "specular": 32}}
+
+    assert build_scene(data, directory=str(tmp_path)).shapes[0].signature() == pyramid.signature()
+    assert validate(data, allow_files=False) == ["shapes[0].path is not allowed here, give the vertices and triangles of the mesh instead"]
@@ -0,0 +1,357 @@
+import numpy as np
+
+# Batched counterpart of Scene.ray_trace_sphere, every ray of the window is traced at once as rows of numpy arrays instead of one Ray object per pixel. The kernels of the shapes are here,
+# each shape calls its own from intersect_rays and normals_at, so the render below never asks which kind of shape it has
+
+# Builds the origins and normalized directions of every primary ray, row by row exactly like the pixel loop in Scene.ray_trace_sphere
+def primary_rays(window, camera):
+
+    columns = window.left_side + window.x_step * np.arange(window.size_x, dtype=np.float64)
+    rows = window.upside + window.y_step * np.arange(window.size_y, dtype=np.float64)
+
+    x, y = np.meshgrid(columns, rows)
+    camera = np.array(camera.as_tuple(False), dtype=np.float64)
+
+    directions = np.stack((x.ravel(), y.ravel(), np.zeros(x.size)), axis=1) - camera
+    origins = np.broadcast_to(camera, directions.shape).copy()
+
+    return origins, normalize(directions)
+
+
+def normalize(vectors):
+
+    return vectors / np.sqrt(np.einsum("ij,ij->i", vectors, vectors))[:, None]
+
+
+def dot(a, b):
+
+    return np.einsum("ij,ij->i", a, b)
+
+
+def as_array(vector):
+
+    return np.array(vector.as_tuple(False), dtype=np.float64)
+
+
+def material_values(shapes, attribute):
+
+    return np.array([getattr(shape.material, attribute) for shape in shapes], dtype=np.float64)
+
+
+# Same as Scene.reflect_ray but for rows of vectors
+def reflect(normals, incidents):
+
+    return incidents - normals * (2 * dot(incidents, normals))[:, None]
+
+
+# Distance along each ray to a compiled sphere, np.inf where the sphere is missed, following the quadratic formula of CompiledSphere.intersect
+def sphere_distances(sphere, origins, directions):
+
+    sphere_to_ray = origins - np.array(sphere.center)
+    b = 2 * dot(directions, sphere_to_ray)
+    c = dot(sphere_to_ray, sphere_to_ray) - sphere.radius_squared
+    discriminant = b ** 2 - 4 * c
+
+    distances = np.full(len(origins), np.inf)
+    hit = discriminant >= 0
+
+    distance = (-b[hit] - np.sqrt(discriminant[hit])) / 2
+    distances[np.flatnonzero(hit)[distance >= 0]] = distance[distance >= 0]
+
+    return distances
+
+
+# Distance along each ray to a compiled wall, first against the wall's plane and then against the wall's box like CompiledWall.intersect
+def wall_distances(wall, origins, directions):
+
+    normal = np.array(wall.normal)
+    direction_and_normal = directions @ normal
+
+    distances = np.full(len(origins), np.inf)
+    hit = direction_and_normal != 0
+
+    t = (wall.plane_offset - origins[hit] @ normal) / direction_and_normal[hit]
+    hit_points = origins[hit] + directions[hit] * t[:, None]
+
+    lower = np.array(wall.lower)
+    upper = np.array(wall.upper)
+
+    inside = (t >= 0) & np.all((lower <= hit_points) & (hit_points <= upper), axis=1)
+    distances[np.flatnonzero(hit)[inside]] = t[inside]
+
+    return distances
+
+
+# Outward normals of hits on a sphere, its normalized radius vectors like Sphere.normal_at
+def sphere_normals(sphere, positions):
+
+    return normalize(positions - as_array(sphere.center))
+
+
+def wall_normals(wall, positions):
+
+    return np.broadcast_to(as_array(wall.outward_normal), positions.shape)
+
+
+# Flat copy of the hierarchy of a mesh, made once per TriangleTree: the boxes of the nodes, their children and the first triangle and amount of triangles of the leaves, -1 and 0 for inner nodes
+def tree_arrays(tree):
+
+    nodes = [tree.root]
+
+    for node in nodes:                  # Grows while it is walked, every inner node appends its children
+
+        if node.shapes is None:
+
+            nodes.extend((node.left, node.right))
+
+    positions = {id(node): position for position, node in enumerate(nodes)}
+    children = np.array([(positions[id(node.left)], positions[id(node.right)]) if node.shapes is None else (-1, -1) for node in nodes])
+    leaves = np.array([(node.shapes.start, len(node.shapes)) if node.shapes is not None else (-1, 0) for node in nodes])
+
+    return {
+        "lower": np.array([node.lower for node in nodes], dtype=np.float64),
+        "upper": np.array([node.upper for node in nodes], dtype=np.float64),
+        "left": children[:, 0],
+        "right": children[:, 1],
+        "first": leaves[:, 0],
+        "count": leaves[:, 1],
+        "triangles": np.frombuffer(tree.triangles, dtype=np.float64).reshape(-1, 9),
+        "normals": np.frombuffer(tree.normals, dtype=np.float64).reshape(-1, 3),
+    }
+
+
+# Moller-Trumbore for rows of rays against rows of triangles given like TriangleTree.triangles, the same test as TriangleTree.closest. np.inf where the triangle is missed
+def triangle_distances(origins, directions, triangles):
+
+    first, edge_1, edge_2 = triangles[:, 0:3], triangles[:, 3:6], triangles[:, 6:9]
+
+    p = np.cross(directions, edge_2)
+    determinant = dot(edge_1, p)
+    inverse = 1 / determinant
+
+    t = origins - first
+    u = dot(t, p) * inverse
+    q = np.cross(t, edge_1)
+    v = dot(directions, q) * inverse
+    distances = dot(edge_2, q) * inverse
+
+    hit = (determinant != 0) & (u >= 0) & (u <= 1) & (v >= 0) & (u + v <= 1) & (distances >= 0)
+
+    return np.where(hit, distances, np.inf)
+
+
+# Distance along each ray to a compiled mesh and the triangle hit, np.inf and -1 where the mesh is missed. All rays walk the mesh's hierarchy together one level at a time as pairs of ray and node,
+# a pair survives while the ray passes through the node's box in front of the closest triangle found so far, and the pairs that reach a leaf test all its triangles in one batch
+def mesh_distances(compiled, origins, directions):
+
+    tree = compiled.tree
+    distances = np.full(len(origins), np.inf)
+    triangles = np.full(len(origins), -1)
+
+    if tree.root is None:
+
+        return distances, triangles
+
+    if tree.arrays is None:
+
+        tree.arrays = tree_arrays(tree)
+
+    arrays = tree.arrays
+
+    with np.errstate(divide="ignore", invalid="ignore"):      # Directions with a zero component give infinite inverses, and zero times those gives nan
+
+        inverse = 1 / directions
+        rays = np.arange(len(origins))
+        nodes = np.zeros(len(origins), dtype=np.int64)
+
+        while len(rays):
+
+            ray_origins = origins[rays]
+            t_1 = (arrays["lower"][nodes] - ray_origins) * inverse[rays]
+            t_2 = (arrays["upper"][nodes] - ray_origins) * inverse[rays]
+
+            near = np.maximum(np.fmin(t_1, t_2).max(axis=1), 0)      # fmin and fmax skip the nan of a ray that is parallel to a slab and starts on it
+            far = np.fmax(t_1, t_2).min(axis=1)
+            passing = (near <= far) & (near <= distances[rays])
+
+            rays, nodes = rays[passing], nodes[passing]
+            counts = arrays["count"][nodes]
+            leaf = counts > 0
+
+            if leaf.any():
+
+                counts = counts[leaf]
+                pair_rays = np.repeat(rays[leaf], counts)
+                pair_triangles = np.repeat(arrays["first"][nodes[leaf]], counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                pair_distances = triangle_distances(origins[pair_rays], directions[pair_rays], arrays["triangles"][pair_triangles])
+
+                order = np.lexsort((pair_triangles, pair_distances, pair_rays))    # The closest triangle of every ray first, the lower triangle wins ties
+                closest = order[np.r_[True, pair_rays[order][1:] != pair_rays[order][:-1]]]
+                closest = closest[pair_distances[closest] < distances[pair_rays[closest]]]
+
+                distances[pair_rays[closest]] = pair_distances[closest]
+                triangles[pair_rays[closest]] = pair_triangles[closest]
+
+            inner = ~leaf
+            rays = np.concatenate((rays[inner], rays[inner]))
+            nodes = np.concatenate((arrays["left"][nodes[inner]], arrays["right"][nodes[inner]]))
+
+    return distances, triangles
+
+
+# Outward normals of hits on a mesh, the normals of the triangles hit turned towards the rays like Mesh.normal_at
+def mesh_normals(mesh, triangles, directions):
+
+    normals = mesh.tree.arrays["normals"][triangles]
+
+    return np.where((dot(normals, directions) > 0)[:, None], -normals, normals)
+
+
+# Returns the closest distance and the index of the shape hit for each ray, -1 if there is none, and the part of the shape hit, like the triangle of a mesh, -1 for shapes with a single part.
+# Works on the compiled geometry of the scene, earlier shapes win ties just like the strict comparison in Scene.closest_object
+def closest_objects(geometry, origins, directions):
+
+    min_distances = np.full(len(origins), np.inf)
+    min_shapes = np.full(len(origins), -1)
+    min_parts = np.full(len(origins), -1)
+
+    for compiled in geometry:
+
+        distances, parts = compiled.intersect_rays(origins, directions)
+
+        closer = distances < min_distances
+        min_distances[closer] = distances[closer]
+        min_shapes[closer] = compiled.index
+        min_parts[closer] = -1 if parts is None else parts[closer]
+
+    return min_distances, min_shapes, min_parts
+
+
+# Outward normals of the hits, the same as normal_at of the shapes gives for the hit records of Scene.closest_object
+def surface_normals(shapes, shape_indices, hit_positions, parts, directions):
+
+    normals = np.empty_like(hit_positions)
+
+    for index, shape in enumerate(shapes):
+
+        selected = shape_indices == index
+
+        if selected.any():
+
+            normals[selected] = shape.normals_at(hit_positions[selected], parts[selected], directions[selected])
+
+    return normals
+
+
+# Same as Scene.diffuse, the normals face the rays
+def diffuse(shapes, shape_indices, normals, directions):
+
+    colors = np.array([shape.color.as_tuple(False) for shape in shapes], dtype=np.float64)[shape_indices]
+
+    return colors * np.maximum(-dot(normals, directions), 0)[:, None]
+
+
+def specular_shade(shapes, shape_indices, normals, light, hit_positions, camera):
+
+    specular_constants = material_values(shapes, "specular_constant")[shape_indices]
+
+    light_to_plane = normalize(hit_positions - as_array(light.position))
+    viewer_vector = normalize(as_array(camera) - hit_positions)
+
+    reflected = reflect(normals, light_to_plane)
+    halfway_vector = normalize(viewer_vector - light_to_plane)
+    blinn_term = np.maximum(dot(halfway_vector, reflected), 0) ** specular_constants
+
+    return as_array(light.color) * blinn_term[:, None]
+
+
+# Which lights reach each hit, one shadow ray per hit and light like Scene.visible_lights. is_closed tells for every shape if it blocks the lights behind its own surface
+def visible_lights(scene, shape_indices, hit_positions, normals, is_closed):
+
+    visible = np.ones((len(hit_positions), len(scene.lights)), dtype=bool)
+
+    for light_index, light in enumerate(scene.lights):
+
+        visible[:, light_index] = light_visible(scene, light, shape_indices, hit_positions, normals, is_closed)
+
+    return visible
+
+
+def light_visible(scene, light, shape_indices, hit_positions, normals, is_closed):
+
+    to_light = as_array(light.position) - hit_positions
+    behind = is_closed[shape_indices] & (dot(normals, to_light) < 0)
+    casting = np.flatnonzero(~behind)
+
+    distances = np.sqrt(dot(to_light[casting], to_light[casting]))
+    origins = hit_positions[casting] + to_light[casting] * (1 / 1000 / distances)[:, None]
+
+    blocked_distances, _, _ = closest_objects(scene.geometry, origins, normalize(to_light[casting]))
+
+    visible = np.zeros(len(hit_positions), dtype=bool)
+    visible[casting] = blocked_distances >= distances - 1 / 1000
+    scene.shadow_rays += len(casting)
+
+    return visible
+
+
+# Traces all rays of the scene breadth first, each iteration of the loop is one bounce of the rays that are still active
+def render(scene):
+
+    origins, directions = primary_rays(scene.window, scene.camera)
+    pixel_indices = np.arange(len(origins))
+    throughputs = np.ones(len(origins))
+    colors = np.zeros(origins.shape)
+    sky = as_array(scene.window.color)
+    is_closed = np.array([shape.closed for shape in scene.shapes], dtype=bool)
+    reflectivities = material_values(scene.shapes, "reflectivity")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+
+        for depth in range(scene.MAX_DEPTH):
+
+            if not len(pixel_indices):
+
+                break
+
+            scene.progress = 100 * depth // scene.MAX_DEPTH
+
+            distances, shape_indices, parts = closest_objects(scene.geometry, origins, directions)
+            hit = shape_indices != -1
+
+            colors[pixel_indices[~hit]] += sky * throughputs[~hit][:, None]     # Rays that do not hit anything get the sky color
+
+            origins, directions, distances, shape_indices, parts, pixel_indices, throughputs = origins[hit], directions[hit], distances[hit], shape_indices[hit], parts[hit], pixel_indices[hit], throughputs[hit]
+            hit_positions = origins + directions * distances[:, None]
+
+            normals = surface_normals(scene.shapes, shape_indices, hit_positions, parts, directions)
+
+            color = diffuse(scene.shapes, shape_indices, normals, directions)
+            visible = visible_lights(scene, shape_indices, hit_positions, normals, is_closed) if scene.shadows else np.ones((len(hit_positions), len(scene.lights)), dtype=bool)
+
+            if scene.lights:
+
+                visible_counts = visible.sum(axis=1)
+                shadowed = visible_counts < len(scene.lights)
+
+                color[shadowed] *= (scene.SHADOW_AMBIENT + (1 - scene.SHADOW_AMBIENT) * visible_counts[shadowed] / len(scene.lights))[:, None]     # Same factor as Scene.ray_bounce
+
+            for light_index, light in enumerate(scene.lights):
+
+                color += np.where(visible[:, light_index, None], specular_shade(scene.shapes, shape_indices, normals, light, hit_positions, scene.camera), 0)
+
+            colors[pixel_indices] += color * throughputs[:, None]          # A pixel has at most one active ray, so the indices are unique
+
+            throughputs = throughputs * reflectivities[shape_indices]
+            reflecting = throughputs >= scene.min_throughput                # Same cut off as Scene.ray_bounce
+
+            origins, directions, hit_positions, normals, shape_indices, pixel_indices, throughputs = origins[reflecting], directions[reflecting], hit_positions[reflecting], normals[reflecting], shape_indices[reflecting], pixel_indices[reflecting], throughputs[reflecting]
+
+            origins = hit_positions + normals / 1000
+            directions = normalize(reflect(normals, directions))
+
+        colors[pixel_indices] += sky * throughputs[:, None]                 # Rays that reach the maximum depth get the sky color as well
+
+    scene.progress = 100
+
+    return np.clip(np.rint(colors), 0, 255).astype(np.uint8).reshape(scene.window.size_y, scene.window.size_x, 3)